@@ -0,0 +1,475 @@
+import argparse
+import os
+import random
+from time import perf_counter
+import pandas as pd
+from sheets import merge_results, DID_COLUMN
+
+
+def synthetic_sheet(rows, seed=0):
+    """
+    Builds a synthetic DID sheet and a batch of run results matching part of it.
+
+    Parameters:
+    rows (int): The number of rows in the synthetic sheet.
+    seed (int): The seed for the random generator.
+
+    Returns:
+    tuple: The sheet DataFrame and the results DataFrame (10% of the sheet, plus unknown and duplicated DID's).
+    """
+    rng = random.Random(seed)
+    dids = [str(5610000000 + i) for i in rng.sample(range(10 * rows), rows)]
+    sheet = pd.DataFrame({DID_COLUMN: dids, 'STATUS': '', 'TIME': '', 'Feedback ID': ''})
+
+    picked = rng.sample(dids, max(1, rows // 10))
+    unknown = [str(4000000000 + i) for i in range(max(1, rows // 100))]
+    results = pd.DataFrame({
+        DID_COLUMN: [f"['{did}']" for did in picked + unknown + picked[:len(unknown)]],
+        'STATUS': '',
+        'TIME': '2024-07-26 04:34:46+00:00',
+        'Feedback ID': 'FCRFE07252024233445395',
+    })
+    return sheet, results
+
+
+def bench_merge(sizes):
+    """
+    Times the DID merge of `update_sheet_data` on synthetic sheets of the given sizes.
+
+    Parameters:
+    sizes (list): The number of sheet rows for each run.
+
+    Returns:
+    None
+    """
+    print(f"{'rows':>8} {'results':>8} {'matched':>8} {'unmatched':>10} {'duplicated':>11} {'seconds':>9}")
+    for size in sizes:
+        sheet, results = synthetic_sheet(size)
+        start = perf_counter()
+        _, report = merge_results(sheet, results)
+        elapsed = perf_counter() - start
+        print(f"{size:>8} {len(results):>8} {report['matched']:>8} {report['unmatched']:>10} {report['duplicated']:>11} {elapsed:>9.4f}")
+
+
+def process_tree_memory(pid):
+    """
+    Sums the resident memory of a process and all of its descendants, read from /proc.
+
+    Parameters:
+    pid (int): The root process ID.
+
+    Returns:
+    float: The resident memory in MB, or None if /proc is not available.
+    """
+    if not os.path.isdir('/proc'):
+        return None
+    children = {}
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                with open(f'/proc/{entry}/stat') as stat:
+                    parent = int(stat.read().rsplit(')', 1)[1].split()[1])
+                children.setdefault(parent, []).append(int(entry))
+            except (OSError, IndexError, ValueError):
+                continue
+
+    total, stack = 0, [pid]
+    while stack:
+        current = stack.pop()
+        stack.extend(children.get(current, []))
+        try:
+            with open(f'/proc/{current}/status') as status:
+                for line in status:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1])
+        except OSError:
+            continue
+    return total / 1024
+
+
+def bench_driver(profiles, runs, url):
+    """
+    Measures the startup time, first page load and memory of each Chrome profile.
+
+    Parameters:
+    profiles (list): The names of the profiles in `browser.PROFILES` to compare.
+    runs (int): The number of browsers started per profile.
+    url (str): The page loaded once the browser is up.
+
+    Returns:
+    None
+    """
+    from browser import driver_setup
+
+    print(f"{'profile':>12} {'startup (s)':>12} {'page load (s)':>14} {'memory (MB)':>12}")
+    for profile in profiles:
+        startups, loads, memory = [], [], []
+        for _ in range(runs):
+            start = perf_counter()
+            driver = driver_setup(profile)
+            startups.append(perf_counter() - start)
+            try:
+                start = perf_counter()
+                driver.get(url)
+                loads.append(perf_counter() - start)
+                memory.append(process_tree_memory(driver.service.process.pid) or 0)
+            finally:
+                driver.quit()
+        print(f"{profile:>12} {sum(startups) / runs:>12.2f} {sum(loads) / runs:>14.2f} {sum(memory) / runs:>12.1f}")
+
+
+def fake_backends(dids):
+    """
+    Points `main` at in-memory and local stand-ins of the Google Sheet and the mailbox.
+
+    Parameters:
+    dids (int): The number of pending DID's in the fake sheet.
+
+    Returns:
+    tuple: The `main` module, the fake IMAP server (started) and the fake worksheet.
+
+    The ledger, sheet snapshots, logs and traces go to a temporary folder.
+    """
+    import tempfile
+    from fakes import FakeClient, FakeIMAPServer, FakeSpreadsheet, FakeWorksheet
+    import fetch_email
+    import main
+    import snapshots
+
+    server = FakeIMAPServer().start()
+    worksheet = FakeWorksheet([["DID'S", 'STATUS', 'TIME', 'Feedback ID']] + [[str(5612000000 + i)] for i in range(dids)])
+    main.gc = FakeClient()
+    main.gc.spreadsheets['fake://sheet'] = FakeSpreadsheet([worksheet])
+    main.sheet_url, main.sheet_id = 'fake://sheet', 'fake'
+    snapshots.iter_sheet_rows = lambda sheet_id, api_key, header=False: iter([(-1, worksheet.get_all_values())] if header else [(0, worksheet.get_all_values()[1:])])
+    snapshots.fetch_revision = lambda sheet_id, api_key, etag=None: (True, str(worksheet.calls['batch_update'] + worksheet.calls['clear']), None)
+    folder = tempfile.mkdtemp()
+    main.snapshots = snapshots.SnapshotCache(None, os.path.join(folder, 'sheet_cache'))
+    main.ledger_path = os.path.join(folder, 'ledger.sqlite3')
+    main.subfolder = folder
+    fetch_email.shared_session = fetch_email.MailSession(connect=server.connect)
+    return main, server, worksheet
+
+
+def percentile(values, q):
+    """
+    Returns the q-th percentile (0 to 100) of a list of values, by nearest rank. None if it is empty.
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, round(q / 100 * len(values) + 0.5) - 1))]
+
+
+def bench_e2e(dids, concurrency, profile, otp_delay, latency, refused=0):
+    """
+    Runs one cycle of the whole `main()` pipeline against local stand-ins of the form, the mailbox and the sheet.
+
+    Parameters:
+    dids (int): The number of DID's in the fake sheet.
+    concurrency (int): The number of browsers submitting in parallel.
+    profile (str): The Chrome profile of the browsers, see `browser.PROFILES`.
+    otp_delay (float): The seconds the fake mail server takes to deliver an OTP.
+    latency (float): The seconds added to every response of the fake form server.
+    refused (int): The number of DID's the fake form refuses, to measure the salvage of their batches.
+
+    Returns:
+    None
+
+    Real Chrome browsers fill and submit the local form (`fakes.FakeFormServer`, same element IDs as the live one),
+    which sends its codes through the fake IMAP server to the real OTP watcher. Reports DID's per hour,
+    the p50/p95 batch latency (from the `batch` spans of the traces) and the peak memory of the process and its browsers.
+    """
+    import json
+    import threading
+    import browser
+    from fakes import FakeFormServer
+
+    main, server, worksheet = fake_backends(dids)
+    refuse = [str(5612000000 + i) for i in random.Random(0).sample(range(dids), min(refused, dids))]
+    form = FakeFormServer(server, otp_delay=otp_delay, latency=latency, refuse=refuse).start()
+    browser.web_url = form.url
+    main.concurrency, main.driver_profile = concurrency, profile
+    main.cycle_interval, main.max_cycles, main.max_batches_per_minute = 0, 1, 0
+
+    peak, sampling = [0.0], threading.Event()
+
+    def sample():
+        while not sampling.wait(0.5):
+            peak[0] = max(peak[0], process_tree_memory(os.getpid()) or 0)
+
+    threading.Thread(target=sample, daemon=True).start()
+    start = perf_counter()
+    try:
+        main.main()
+    finally:
+        elapsed = perf_counter() - start
+        sampling.set()
+        form.stop()
+        server.stop()
+
+    latencies = []
+    with open(os.path.join(main.subfolder, 'traces.jsonl')) as traces:
+        for line in traces:
+            record = json.loads(line)
+            if record['stage'] == 'batch' and record['status'] == 'ok':
+                latencies.append(record['duration_ms'] / 1000)
+    done = sum(1 for row in worksheet.get_all_values()[1:] if len(row) > 3 and row[3])
+    submitted = sum(len(phones) for _, phones in form.submissions)
+
+    print(f"DID's: {done}/{dids} written back ({submitted} submitted, {len(form.submissions)} forms, rejected: {dict(form.rejected) or 0})")
+    print(f'Elapsed: {elapsed:.1f}s | Throughput: {done / elapsed * 3600:.0f} DIDs/hour on {concurrency} browser(s) ({profile})')
+    if latencies:
+        print(f'Batch latency: p50 {percentile(latencies, 50):.2f}s | p95 {percentile(latencies, 95):.2f}s over {len(latencies)} batches')
+    print(f'Peak memory (process and browsers): {peak[0]:.0f} MB')
+    report = main.retry_engine.report()
+    print(
+        f"Retries: {report['attempts']} attempts, failures {report['failures'] or 0}, {report['splits']} splits, "
+        f"{report['otps_reused']} OTPs reused | DID's salvaged {report['dids_salvaged']}, refused {report['dids_rejected']}, "
+        f"failed {report['dids_failed']} | Wasted form time {report['wasted_share']:.1%}"
+    )
+
+
+def bench_soak(minutes, dids, interval, otp_delay):
+    """
+    Runs the scheduler loop of `main()` against fake sheet, mail and browser backends and samples its memory.
+
+    Parameters:
+    minutes (float): How long the soak test runs before a graceful shutdown (SIGTERM) is sent.
+    dids (int): The number of DID's in the fake sheet.
+    interval (float): The seconds between the start of two cycles.
+    otp_delay (float): The seconds the fake mail server takes to deliver an OTP.
+
+    Returns:
+    None
+
+    Every cycle goes through the real ledger, OTP watcher, pool, sheet merge and delta writer;
+    only the form submission is replaced by a request for an OTP to the fake mail server.
+    """
+    import signal
+    import threading
+    import tracemalloc
+    from datetime import datetime
+    import pytz
+    import browser
+    from fakes import FakeDriver
+
+    main, server, worksheet = fake_backends(dids)
+    main.cycle_interval, main.max_cycles, main.max_batches_per_minute = interval, None, 0
+    browser.driver_setup = lambda profile, worker: FakeDriver()
+
+    def fake_submit(driver, index, batch, total, watcher, fields=None, on_reject=None):
+        request = watcher.expect(datetime.now(pytz.utc))
+        server.deliver(f'Your verification code: {random.randint(10000, 99999)}', delay=otp_delay)
+        otp = watcher.wait(request, timeout=10)
+        if not otp:
+            return None
+        feedback = f"FCRFE{datetime.now(pytz.utc).strftime('%m%d%Y%H%M%S%f')}"
+        return [{"DID'S": row[0], 'STATUS': '', 'TIME': datetime.now(pytz.utc).replace(microsecond=0), 'Feedback ID': feedback} for row in batch]
+
+    samples = []
+    run_cycle = main.run_cycle
+
+    def sampled_cycle(*args):
+        run_cycle(*args)
+        current, _ = tracemalloc.get_traced_memory()
+        samples.append((perf_counter() - start, current / 1024 / 1024, process_tree_memory(os.getpid()) or 0))
+
+    main.submit_batch = fake_submit
+    main.run_cycle = sampled_cycle
+    threading.Timer(minutes * 60, os.kill, args=(os.getpid(), signal.SIGTERM)).start()
+
+    tracemalloc.start()
+    start = perf_counter()
+    try:
+        main.main()
+    finally:
+        tracemalloc.stop()
+        server.stop()
+
+    print(f"{'minute':>8} {'cycles':>8} {'traced (MB)':>12} {'rss (MB)':>10}")
+    step = max(1, len(samples) // 20)
+    for i in range(0, len(samples), step):
+        elapsed, traced, rss = samples[i]
+        print(f"{elapsed / 60:>8.1f} {i + 1:>8} {traced:>12.2f} {rss:>10.1f}")
+    if len(samples) >= 8:
+        quarter = len(samples) // 4
+        first = sum(sample[2] for sample in samples[:quarter]) / quarter
+        last = sum(sample[2] for sample in samples[-quarter:]) / quarter
+        print(f'RSS growth between the first and last quarter of the run: {last - first:+.1f} MB over {len(samples)} cycles')
+    print(f"Sheet reads => {worksheet.calls['get_all_values']} | Snapshot cache => {main.snapshots.stats}")
+
+
+def bench_logging(batches, records, stall):
+    """
+    Times the logging of a batch on the submitting thread: the old synchronous log against the queued one.
+
+    Parameters:
+    batches (int): The number of simulated batches.
+    records (int): The number of records logged per batch.
+    stall (float): Milliseconds added to every write, to stand in for a slow or busy disk (0 for none).
+
+    Returns:
+    None
+
+    The queued log is also timed until its listener wrote every record (`drained`), which happens off the hot path.
+    """
+    import logging
+    import tempfile
+    from time import sleep
+    from logger import JSONFormatter, TEXT_FORMAT, file_handler, log_context, queue_logging
+
+    folder = tempfile.mkdtemp()
+
+    def slowed(handler):
+        if stall:
+            emit = handler.emit
+            handler.emit = lambda record: (sleep(stall / 1000), emit(record))
+        return handler
+
+    def run(logger):
+        start = perf_counter()
+        for batch in range(batches):
+            with log_context(batch_id=batch, dids=20):
+                for i in range(records - 1):
+                    logger.info(f'Batch {batch + 1} Step {i} => OK')
+                feedback = f'FCRFE{batch:017d}'
+                logger.info(f'Batch {batch + 1} Finished Successfully => Feedback ID => {feedback}', extra={'feedback_id': feedback})
+        return start, perf_counter() - start
+
+    print(f"{'logging':<18} {'per batch (us)':>15} {'hot path (s)':>13} {'drained (s)':>12}")
+    for fmt in ('text', 'json'):
+        logger = logging.getLogger(f'bench.sync.{fmt}')
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        handler = logging.FileHandler(os.path.join(folder, f'sync-{fmt}.log'))
+        handler.setFormatter(JSONFormatter() if fmt == 'json' else logging.Formatter(TEXT_FORMAT))
+        logger.addHandler(slowed(handler))
+        _, elapsed = run(logger)
+        handler.close()
+        print(f"{'synchronous ' + fmt:<18} {elapsed / batches * 1e6:>15.1f} {elapsed:>13.3f} {elapsed:>12.3f}")
+
+        logger = logging.getLogger(f'bench.queued.{fmt}')
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        listener = queue_logging(logger, slowed(file_handler(os.path.join(folder, f'queued-{fmt}.log'), fmt)))
+        start, elapsed = run(logger)
+        listener.stop()
+        drained = perf_counter() - start
+        print(f"{'queued ' + fmt:<18} {elapsed / batches * 1e6:>15.1f} {elapsed:>13.3f} {drained:>12.3f}")
+
+
+# Import time budgets (milliseconds), e.g. `main` must not load pandas, gspread nor Selenium
+IMPORT_BUDGETS = {
+    'main': 150,
+    'fetch_email': 100,
+    'ledger': 50,
+    'metrics': 30,
+    'sheets': 30,
+}
+
+
+def import_time(module):
+    """
+    Measures the cumulative import time of a module in a fresh interpreter with `python -X importtime`.
+
+    Parameters:
+    module (str): The name of the module.
+
+    Returns:
+    tuple: The import time of the module in milliseconds, and the slowest modules it imported as (ms, name) pairs.
+    """
+    import subprocess
+    import sys
+
+    output = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+    ).stderr
+    children = []
+    for line in output.splitlines():
+        # import time: self [us] | cumulative | imported package, indented by nesting level
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        if depth == 0 and name.strip() == module:
+            return int(cumulative) / 1000, sorted(children, reverse=True)[:3]
+        if depth == 0:
+            children = []
+        elif depth == 1:
+            children.append((int(cumulative) / 1000, name.strip()))
+    raise RuntimeError(f'{module} was not imported: {output[-200:]}')
+
+
+def bench_imports(modules, runs):
+    """
+    Checks the import time of the bot's modules against their budget (`IMPORT_BUDGETS`).
+
+    Parameters:
+    modules (list): The names of the modules.
+    runs (int): The number of imports of each module, the fastest is kept.
+
+    Returns:
+    bool: True if every module is within its budget.
+    """
+    within = True
+    print(f"{'module':<14} {'import (ms)':>12} {'budget (ms)':>12}  slowest imports")
+    for module in modules:
+        ms, slowest = min(import_time(module) for _ in range(runs))
+        budget = IMPORT_BUDGETS.get(module)
+        over = budget is not None and ms > budget
+        within = within and not over
+        heaviest = ', '.join(f'{name} {took:.0f}' for took, name in slowest)
+        print(f"{module:<14} {ms:>12.1f} {budget if budget is not None else '-':>12}  {heaviest}{'  OVER BUDGET' if over else ''}")
+    return within
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks for the DID bot.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    merge_parser = subparsers.add_parser('merge', help='DID merge of update_sheet_data on synthetic sheets')
+    merge_parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+
+    driver_parser = subparsers.add_parser('driver', help='Startup time, page load and memory of the Chrome profiles')
+    driver_parser.add_argument('--profiles', nargs='+', default=['legacy', 'production'])
+    driver_parser.add_argument('--runs', type=int, default=3)
+    driver_parser.add_argument('--url', default='https://www.freecallerregistry.com/fcr/#submitform')
+
+    e2e_parser = subparsers.add_parser('e2e', help="Throughput of the whole pipeline with Chrome against local stand-ins of the form, mailbox and sheet")
+    e2e_parser.add_argument('--dids', type=int, default=200)
+    e2e_parser.add_argument('--concurrency', type=int, default=1)
+    e2e_parser.add_argument('--profile', default='production')
+    e2e_parser.add_argument('--otp-delay', type=float, default=2)
+    e2e_parser.add_argument('--latency', type=float, default=0.05)
+    e2e_parser.add_argument('--refused', type=int, default=0, help="number of DID's the fake form refuses")
+
+    soak_parser = subparsers.add_parser('soak', help='Memory of the scheduler loop against fake sheet, mail and browser backends')
+    soak_parser.add_argument('--minutes', type=float, default=180)
+    soak_parser.add_argument('--dids', type=int, default=200)
+    soak_parser.add_argument('--interval', type=float, default=1)
+    soak_parser.add_argument('--otp-delay', type=float, default=0.05)
+
+    logging_parser = subparsers.add_parser('logging', help='Per-batch logging overhead on the submitting thread, synchronous against queued')
+    logging_parser.add_argument('--batches', type=int, default=2000)
+    logging_parser.add_argument('--records', type=int, default=12)
+    logging_parser.add_argument('--stall', type=float, default=0, help='milliseconds added to every write (slow disk)')
+
+    imports_parser = subparsers.add_parser('imports', help='Import time of the modules against their budget (exits with 1 when over)')
+    imports_parser.add_argument('--modules', nargs='+', default=list(IMPORT_BUDGETS))
+    imports_parser.add_argument('--runs', type=int, default=3)
+
+    args = parser.parse_args()
+    if args.command == 'merge':
+        bench_merge(args.sizes)
+    elif args.command == 'driver':
+        bench_driver(args.profiles, args.runs, args.url)
+    elif args.command == 'e2e':
+        bench_e2e(args.dids, args.concurrency, args.profile, args.otp_delay, args.latency, args.refused)
+    elif args.command == 'soak':
+        bench_soak(args.minutes, args.dids, args.interval, args.otp_delay)
+    elif args.command == 'logging':
+        bench_logging(args.batches, args.records, args.stall)
+    elif args.command == 'imports':
+        raise SystemExit(0 if bench_imports(args.modules, args.runs) else 1)
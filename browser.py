@@ -0,0 +1,416 @@
+import logging
+import os
+import re
+import weakref
+from time import perf_counter
+from selenium import webdriver
+from selenium.webdriver.common.by import By
+from metrics import span
+import waits
+from creds import (
+    web_url, contact_name, company_phone, city, company_email, calling_company_address, calling_company_name, calling_company_url, call_count, note, zipcode, service_provider
+)
+
+# Chrome profiles selectable per run
+PROFILES = {
+    # The original profile: a full, maximized, GUI browser
+    'legacy': {
+        'arguments': [
+            '--disable-gpu',  # Disable GPU hardware acceleration
+            '--no-sandbox',  # Bypass OS security model
+            '--disable-dev-shm-usage',  # Overcome limited resource problems
+            '--disable-extensions',  # Disable extensions
+            '--disable-popup-blocking',  # Disable popup blocking
+            '--disable-images',  # Disable images (ignored by modern Chrome)
+            '--disable-infobars',  # Disable infobars
+            '--start-maximized',  # Start maximized
+            '--disable-software-rasterizer',  # Disable software rasterizer
+        ],
+        'prefs': {},
+        'blocked_urls': [],
+        'page_load_strategy': 'normal',
+        'user_data_dir': None,
+    },
+    # Headless, loading only what the form needs, with a persistent profile per worker
+    'production': {
+        'arguments': [
+            '--headless=new',  # Run in headless mode
+            '--disable-gpu',
+            '--no-sandbox',
+            '--disable-dev-shm-usage',
+            '--disable-extensions',
+            '--disable-popup-blocking',
+            '--disable-infobars',
+            '--disable-software-rasterizer',
+            '--window-size=1366,768',
+            '--no-first-run',
+            '--no-default-browser-check',
+            '--disable-background-networking',
+            '--disable-sync',
+            '--disable-component-update',
+            '--mute-audio',
+        ],
+        'prefs': {
+            # Really block images and notifications
+            'profile.managed_default_content_settings.images': 2,
+            'profile.default_content_setting_values.notifications': 2,
+        },
+        # Requests blocked through the DevTools protocol: images, fonts and third parties. Stylesheets are
+        # loaded: they hide the error messages of the form, which the outcome check (`SUBMIT_OUTCOME_JS`)
+        # and the clickable/displayed waits tell apart by their layout
+        'blocked_urls': [
+            '*.png', '*.jpg', '*.jpeg', '*.gif', '*.svg', '*.webp', '*.ico',
+            '*.woff', '*.woff2', '*.ttf', '*.otf', '*.eot',
+            '*fonts.googleapis.com*', '*fonts.gstatic.com*',
+            '*google-analytics.com*', '*googletagmanager.com*', '*doubleclick.net*',
+            '*facebook.net*', '*facebook.com/tr*', '*hotjar.com*', '*clarity.ms*',
+        ],
+        'page_load_strategy': 'eager',
+        'user_data_dir': os.path.abspath('chrome_profiles'),
+    },
+}
+
+# Keep the form page warm between batches instead of reloading it (set FORM_REUSE=0 to disable)
+form_reuse = os.getenv('FORM_REUSE', '1') == '1'
+
+# The form session of every open driver
+form_sessions = weakref.WeakKeyDictionary()
+
+# A fresh form shows a single, empty phone number input and no OTP
+FRESH_FORM_JS = """
+var phone = document.getElementById('enterprise_phone_0');
+var captcha = document.getElementById('captcha');
+return !!phone && phone.value === '' && !document.getElementById('enterprise_phone_1')
+    && !(captcha && captcha.value);
+"""
+
+
+def driver_setup(profile='legacy', worker=0):
+    """
+    Set up a Chrome WebDriver with the options of the given profile.
+
+    Parameters:
+    profile (str): The name of the profile in `PROFILES`, 'legacy' or 'production'.
+    worker (int): The index of the worker the driver is for, used to give each driver its own user-data dir.
+
+    Returns:
+    driver (webdriver.Chrome): The initialized Chrome WebDriver instance.
+
+    The 'legacy' profile is the original one: a full, maximized, GUI browser.
+    The 'production' profile runs headless with page-load strategy `eager`, blocks images,
+    fonts (and their stylesheets) and third-party requests, and keeps a persistent user-data dir per worker
+    so the browser cache and cookies survive restarts.
+    """
+    settings = PROFILES[profile]
+
+    # Set up Chrome options for optimization
+    chrome_options = webdriver.ChromeOptions()
+    for argument in settings['arguments']:
+        chrome_options.add_argument(argument)
+    if settings['prefs']:
+        chrome_options.add_experimental_option('prefs', settings['prefs'])
+    if settings['user_data_dir']:
+        chrome_options.add_argument(f"--user-data-dir={os.path.join(settings['user_data_dir'], f'worker-{worker}')}")
+    chrome_options.page_load_strategy = settings['page_load_strategy']
+
+    # Initialize the WebDriver
+    driver = webdriver.Chrome(options=chrome_options)
+    if settings['blocked_urls']:
+        driver.execute_cdp_cmd('Network.enable', {})
+        driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': settings['blocked_urls']})
+    logging.info(f'Driver Initiated! (Profile: {profile}, Worker: {worker})')
+    return driver
+
+
+# Fills the phone numbers (adding inputs as needed) and the company details in one go,
+# through the native value setters so the page sees the same input/change events as typing,
+# then reads every value back for validation
+FAST_FILL_JS = """
+var phones = arguments[0], fields = arguments[1];
+var missing = [], values = {};
+function set(element, value) {
+    var prototype = element.tagName === 'SELECT' ? HTMLSelectElement.prototype
+        : element.tagName === 'TEXTAREA' ? HTMLTextAreaElement.prototype : HTMLInputElement.prototype;
+    Object.getOwnPropertyDescriptor(prototype, 'value').set.call(element, value);
+    ['input', 'change', 'blur'].forEach(function (type) {
+        element.dispatchEvent(new Event(type, {bubbles: true}));
+    });
+}
+for (var i = 0; i < phones.length; i++) {
+    var id = 'enterprise_phone_' + i;
+    var input = document.getElementById(id);
+    var add = document.getElementById('add-number-command');
+    if (!input && add) {
+        add.click();
+        input = document.getElementById(id);
+    }
+    if (!input) {
+        missing.push(id);
+        break;
+    }
+    set(input, phones[i]);
+    values[id] = input.value;
+}
+Object.keys(fields).forEach(function (id) {
+    var element = document.getElementById(id);
+    if (!element) {
+        missing.push(id);
+        return;
+    }
+    set(element, fields[id]);
+    values[id] = element.value;
+});
+return {missing: missing, values: values};
+"""
+
+
+def form_values():
+    """
+    Returns the company details of the form, keyed by the ID of their field.
+
+    Returns:
+    dict: The field ID => value mapping, dropdowns included.
+    """
+    return {
+        'enterprise_category': 'telemarketing',
+        'enterprise_contact_name': contact_name,
+        'enterprise_contact_phone': company_phone,
+        'enterprise_contact_email': company_email,
+        'enterprise_company_name': calling_company_name,
+        'enterprise_company_address_line_1': calling_company_address,
+        'enterprise_company_address_city': city,
+        'enterprise_company_address_state': 'FL',
+        'enterprise_company_address_zip': zipcode,
+        'enterprise_company_url': calling_company_url,
+        'enterprise_service_provider': service_provider,
+        'call_count': call_count,
+        'additional_feedback': note,
+    }
+
+
+def fast_fill(driver, phone_numbers, fields):
+    """
+    Fills the whole form with a single `execute_script` call and validates it once.
+
+    Parameters:
+    driver (webdriver.Chrome): The WebDriver instance showing a fresh form.
+    phone_numbers (list): The (already cleaned) phone numbers, at most 20.
+    fields (dict): The company details keyed by field ID, see `form_values()`.
+
+    Returns:
+    bool: True if every field holds its expected value, False otherwise (the form is then
+          left partially filled and should be reloaded).
+    """
+    start = perf_counter()
+    try:
+        result = driver.execute_script(FAST_FILL_JS, phone_numbers, fields)
+    except Exception as e:
+        logging.error(f'Fast Fill Failed => {e}')
+        return False
+
+    wrong = [field for field, value in fields.items() if result['values'].get(field) != value]
+    # Phone inputs may format what they hold, only the digits have to match
+    wrong += [
+        f'enterprise_phone_{i}' for i, number in enumerate(phone_numbers)
+        if re.sub(r'\D', '', result['values'].get(f'enterprise_phone_{i}') or '') != re.sub(r'\D', '', number)
+    ]
+    if result['missing'] or wrong:
+        logging.error(f"Fast Fill Failed => Missing: {result['missing']} | Wrong Values: {wrong}")
+        return False
+
+    logging.info(f'Fast Fill Done in {(perf_counter() - start) * 1000:.0f}ms')
+    return True
+
+
+# Elements the form shows its errors in
+FORM_ERRORS = '#error, .error, .alert-danger, .invalid-feedback'
+
+# Returns the feedback ID once the confirmation shows it, or the first error the form shows with the phone
+# fields it marked as invalid, null meanwhile
+SUBMIT_OUTCOME_JS = """
+function shown(element) { return element && element.getClientRects().length && element.textContent.trim(); }
+var feedback = document.querySelector('.feedback-id');
+if (shown(feedback)) return {feedback: feedback.textContent.trim()};
+var errors = document.querySelectorAll(arguments[0]);
+for (var i = 0; i < errors.length; i++) {
+    if (shown(errors[i])) {
+        var invalid = document.querySelectorAll('[id^="enterprise_phone_"].is-invalid, [id^="enterprise_phone_"][aria-invalid="true"]');
+        return {error: errors[i].textContent.trim(), fields: Array.prototype.map.call(invalid, function (field) { return field.id; })};
+    }
+}
+return null;
+"""
+
+# Empties the errors a previous submit left on the form
+CLEAR_ERRORS_JS = """
+document.querySelectorAll(arguments[0]).forEach(function (element) { element.textContent = ''; });
+"""
+
+
+def submit_outcome(driver, timeout=30, wait=True):
+    """
+    Waits for the outcome of a submit: the feedback ID of the confirmation, or the error shown by the form.
+    The page is checked again on every DOM mutation (`waits.observe()`), so the outcome is seen as soon as it shows.
+
+    Parameters:
+    driver (webdriver.Chrome): The WebDriver instance.
+    timeout (float): Seconds before a `TimeoutException` is raised.
+    wait (bool): Only checks the page once if False, returning None when it shows neither.
+
+    Returns:
+    dict: {'feedback': ...} or {'error': ...}.
+    """
+    if not wait:
+        return driver.execute_script(SUBMIT_OUTCOME_JS, FORM_ERRORS)
+    return waits.observe(driver, SUBMIT_OUTCOME_JS, FORM_ERRORS, timeout=timeout)
+
+
+def clear_errors(driver):
+    driver.execute_script(CLEAR_ERRORS_JS, FORM_ERRORS)
+
+
+def start_submission(driver):
+    """
+    This function navigates to the specified web page URL and clicks on the registration button.
+
+    Parameters:
+    driver (webdriver.Chrome): The initialized Chrome WebDriver instance.
+
+    Returns:
+    None
+
+    The function performs the following steps:
+    1. Navigates to the web page URL using the provided WebDriver instance.
+    2. Refreshes the current page (Page Does not load on 1st Attempt, Restricted by URL).
+    3. Waits for the registration button to be clickable (`waits.clickable()`).
+    4. Clicks on the registration button.
+    """
+    with span('start_submission'):
+        # Go to the Page URL
+        driver.get(web_url)
+        driver.refresh()
+
+        # Register Button
+        reg_num_button = waits.clickable(driver, 'nextButton')
+        reg_num_button.click()
+
+
+class FormSession:
+    """
+    Keeps the registration form of a driver warm between batches.
+
+    Parameters:
+    driver (webdriver.Chrome): The WebDriver instance the form is opened in.
+
+    After a successful submit, the next form is reached through the cheapest path that works:
+    clicking `nextButton` again if the confirmation page shows it, then back navigation.
+    The full `start_submission()` reload (two page loads) is only used for the first batch,
+    after a failed batch, or when the cheap paths do not end on a fresh form.
+    The time of every full reload is kept, so the time saved by each warm open can be measured.
+    """
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.warm = False
+        self.full_loads = []
+        self.warm_loads = 0
+        self.saved = 0.0
+
+    def is_fresh(self):
+        """
+        Checks whether the current page is a fresh, empty form.
+        """
+        try:
+            return bool(self.driver.execute_script(FRESH_FORM_JS))
+        except Exception:
+            return False
+
+    def _wait_fresh(self, timeout=5):
+        try:
+            waits.until(self.driver, lambda driver: self.is_fresh(), timeout)
+            return True
+        except Exception:
+            return False
+
+    def _reopen(self):
+        """
+        Tries the cheap paths back to a fresh form, returns the name of the one that worked.
+        """
+        # The confirmation page may offer the registration button again
+        buttons = self.driver.find_elements(By.ID, 'nextButton')
+        if buttons and buttons[0].is_displayed():
+            buttons[0].click()
+            if self._wait_fresh():
+                return 'nextButton'
+
+        # Go back to the form page
+        self.driver.back()
+        buttons = self.driver.find_elements(By.ID, 'nextButton')
+        if buttons and buttons[0].is_displayed():
+            buttons[0].click()
+        if self._wait_fresh():
+            return 'back'
+        return None
+
+    def open(self):
+        """
+        Brings the driver to a fresh registration form.
+
+        Returns:
+        None
+        """
+        start = perf_counter()
+        if form_reuse and self.warm:
+            try:
+                path = self._reopen()
+            except Exception as e:
+                logging.info(f'Warm Form Reopen Failed => {e}')
+                path = None
+            if path:
+                elapsed = perf_counter() - start
+                self.warm_loads += 1
+                if self.full_loads:
+                    saved = sum(self.full_loads) / len(self.full_loads) - elapsed
+                    self.saved += saved
+                    logging.info(f'Form Reopened Through {path} in {elapsed:.2f}s, {saved:.2f}s Saved')
+                return
+            logging.info('Page State Invalid, Falling Back To A Full Reload')
+
+        start = perf_counter()
+        start_submission(self.driver)
+        self.full_loads.append(perf_counter() - start)
+
+    def finished(self, success):
+        """
+        Records the outcome of the batch submitted through the form.
+
+        Parameters:
+        success (bool): Whether the form was submitted successfully.
+            Only then can the next form be reached without a full reload.
+
+        Returns:
+        None
+        """
+        self.warm = success
+
+    def stats(self):
+        """
+        Returns the page-load counters of the session as a dict.
+        """
+        return {'full_loads': len(self.full_loads), 'warm_loads': self.warm_loads, 'saved_seconds': round(self.saved, 2)}
+
+
+def get_form_session(driver):
+    """
+    Returns the form session of a driver, created on first use.
+
+    Parameters:
+    driver (webdriver.Chrome): The WebDriver instance.
+
+    Returns:
+    FormSession: The form session of the driver.
+    """
+    session = form_sessions.get(driver)
+    if session is None:
+        session = form_sessions[driver] = FormSession(driver)
+    return session
@@ -0,0 +1,176 @@
+import logging
+import re
+from collections import Counter
+import numpy as np
+import pandas as pd
+from sheets import DID_NOISE, normalize_dids
+
+# Characters a DID may be written with in the sheet, besides its digits
+DID_ALLOWED = r"^[\s\d+\-().\[\]'\"]*$"
+
+# Rejection reasons, in the order they are checked
+EMPTY = 'empty'
+INVALID_CHARACTERS = 'invalid characters'
+NOT_NANP = 'not a 10-digit NANP number'
+INVALID_AREA_CODE = 'invalid area code'
+INVALID_EXCHANGE_CODE = 'invalid exchange code'
+DUPLICATE = 'duplicate'
+
+# The 10 digits of a valid NANP number: area and exchange codes start with 2-9 and are not N11 service codes
+NANP = re.compile(r'(?![2-9]11)[2-9]\d\d(?![2-9]11)[2-9]\d{6}')
+
+
+def validate_dids(values):
+    """
+    Turns raw DID cells into canonical E.164 numbers in one vectorized pass, with a reason for every invalid one.
+
+    Parameters:
+    values (iterable): The raw DID values, as read from the sheet.
+
+    Returns:
+    pandas.DataFrame: One row per value with the `raw` value, its canonical `did` (+1NXXNXXXXXX, None if invalid)
+                      and the `reason` it was rejected (None if valid).
+
+    A valid DID is a 10-digit NANP number, optionally written with the country code 1: its area code and
+    exchange code start with 2-9 and are not N11 service codes (211, 411, 911, ...).
+    """
+    raw = pd.Series(list(values), dtype=object)
+    text = raw.astype(str).str.strip()
+    digits = text.str.replace(r'\D', '', regex=True)
+    # Drop the country code
+    digits = digits.where(~((digits.str.len() == 11) & digits.str.startswith('1')), digits.str[1:])
+
+    area, exchange = digits.str[:3], digits.str[3:6]
+    n11 = r'^[2-9]11$'
+    reason = np.select(
+        [
+            raw.isna().to_numpy() | (text.str.replace(DID_NOISE, '', regex=True).str.strip() == '').to_numpy(),
+            ~text.str.match(DID_ALLOWED).to_numpy(dtype=bool),
+            (digits.str.len() != 10).to_numpy(),
+            (~area.str.match(r'^[2-9]') | area.str.match(n11)).to_numpy(dtype=bool),
+            (~exchange.str.match(r'^[2-9]') | exchange.str.match(n11)).to_numpy(dtype=bool),
+        ],
+        [EMPTY, INVALID_CHARACTERS, NOT_NANP, INVALID_AREA_CODE, INVALID_EXCHANGE_CODE],
+        default='',
+    )
+    valid = reason == ''
+    return pd.DataFrame({
+        'raw': raw,
+        'did': pd.Series(np.where(valid, ('+1' + digits).to_numpy(dtype=object), None), dtype=object),
+        'reason': pd.Series(np.where(valid, None, reason), dtype=object),
+    })
+
+
+def canonical_did(value):
+    """
+    Returns the canonical E.164 form of a single DID, the same way `validate_dids()` does, or None if it is invalid.
+
+    Checks the value with plain regular expressions: a single DID does not pay for building a DataFrame.
+    """
+    if not isinstance(value, str) and pd.isna(value):
+        return None
+    text = str(value).strip()
+    if not re.sub(DID_NOISE, '', text).strip() or not re.match(DID_ALLOWED, text):
+        return None
+    digits = re.sub(r'\D', '', text)
+    if len(digits) == 11 and digits.startswith('1'):
+        digits = digits[1:]
+    return f'+1{digits}' if NANP.fullmatch(digits) else None
+
+
+def national_number(value):
+    """
+    Returns the 10-digit national number of a DID, as typed in the form.
+
+    Parameters:
+    value: The raw DID value.
+
+    Returns:
+    str: The 10 digits of a valid DID, or the value stripped of brackets and quotes if it is invalid.
+    """
+    did = canonical_did(value)
+    return did[2:] if did else re.sub(DID_NOISE, '', str(value)).strip()
+
+
+class DIDFilter:
+    """
+    The validation stage of the pipeline: only lets valid, unique DID's through to the batches (`planner.BatchPlanner`).
+
+    Parameters:
+    on_reject (callable): Called with a list of (raw value, reason) tuples for every chunk holding rejected DID's,
+                          e.g. `JobLedger.reject`.
+
+    The same DID written twice (e.g. `5615550100` and `(561) 555-0100`) is only submitted once: the later
+    rows are rejected as duplicates. Rows repeating the exact same value are dropped without being rejected,
+    since they are a single job in the ledger.
+    """
+
+    def __init__(self, on_reject=None):
+        self.on_reject = on_reject
+        self.seen = {}
+        self.stats = Counter()
+
+    def check(self, rows):
+        """
+        Validates and deduplicates a list of rows against every row seen so far.
+
+        Parameters:
+        rows (list): The rows, holding their DID first.
+
+        Returns:
+        tuple: The list of valid, unique rows and the list of (raw value, reason) tuples of the rejected ones.
+        """
+        checked = validate_dids(row[0] if row else None for row in rows)
+        keys = normalize_dids(checked['raw']).tolist()
+        valid, rejected = [], []
+        for row, key, did, reason in zip(rows, keys, checked['did'], checked['reason']):
+            self.stats['checked'] += 1
+            if reason is None:
+                first = self.seen.get(did)
+                if first is None:
+                    self.seen[did] = key
+                elif first == key:
+                    # The exact same value again
+                    self.stats['repeated'] += 1
+                    continue
+                else:
+                    reason = DUPLICATE
+            if reason is not None:
+                if reason != EMPTY:
+                    rejected.append((row[0], reason))
+                self.stats[reason] += 1
+                continue
+            valid.append(row)
+        self.stats['valid'] += len(valid)
+        return valid, rejected
+
+    def filter(self, rows, chunk=1000):
+        """
+        Lets the valid, unique rows of an iterable through, validating them chunk by chunk.
+
+        Parameters:
+        rows (iterable): The rows, a list or rows still being downloaded.
+        chunk (int): The number of rows validated at once.
+
+        Yields:
+        list: A valid, unique row.
+        """
+        pending = []
+        for row in rows:
+            pending.append(row)
+            if len(pending) >= chunk:
+                yield from self._flush(pending)
+                pending = []
+        if pending:
+            yield from self._flush(pending)
+        rejected = {reason: count for reason, count in self.stats.items() if reason not in ('checked', 'valid', 'repeated')}
+        logging.info(f"Validated {self.stats['checked']} DID(s) => {self.stats['valid']} Valid | Rejected: {rejected or 0}")
+
+    def _flush(self, rows):
+        valid, rejected = self.check(rows)
+        if rejected:
+            for raw, reason in rejected:
+                logging.warning(f'DID Rejected => {raw!r} ({reason})')
+            if self.on_reject:
+                self.on_reject(rejected)
+        return valid
@@ -0,0 +1,608 @@
+"""
+Local stand-ins for the external services the bot talks to, so its logic can be exercised offline.
+"""
+import imaplib
+import json
+import random
+import re
+import socket
+import socketserver
+import threading
+from collections import Counter
+from datetime import datetime, timezone
+from email.utils import format_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import sleep
+
+
+def parse_a1(range_name):
+    """
+    Parses an A1 range such as 'C2:D4' (or a single cell 'C2') into 1-based bounds.
+
+    Parameters:
+    range_name (str): The A1 range.
+
+    Returns:
+    tuple: (first_row, first_col, last_row, last_col).
+    """
+    bounds = []
+    for cell in range_name.split('!')[-1].split(':'):
+        letters, digits = re.fullmatch(r'([A-Z]+)(\d+)', cell).groups()
+        col = 0
+        for letter in letters:
+            col = col * 26 + ord(letter) - 64
+        bounds.append((int(digits), col))
+    (first_row, first_col), (last_row, last_col) = bounds[0], bounds[-1]
+    return first_row, first_col, last_row, last_col
+
+
+class FakeWorksheet:
+    """
+    An in-memory worksheet implementing the part of `gspread.Worksheet` the bot uses.
+
+    Every call is counted in `calls` and every written cell in `cells_written`,
+    so tests and benchmarks can check how much traffic a write would have cost.
+    """
+
+    def __init__(self, values=None, rows=1000, cols=26):
+        self.values = [list(row) for row in values or []]
+        self.row_count = max(rows, len(self.values))
+        self.col_count = max([cols] + [len(row) for row in self.values])
+        self.calls = Counter()
+        self.cells_written = 0
+
+    def get_all_values(self):
+        self.calls['get_all_values'] += 1
+        width = max([len(row) for row in self.values] or [0])
+        # Trailing empty rows are not returned by the Sheets API
+        rows = [row + [''] * (width - len(row)) for row in self.values]
+        while rows and not any(rows[-1]):
+            rows.pop()
+        return rows
+
+    def get_all_records(self):
+        self.calls['get_all_records'] += 1
+        values = self.get_all_values()
+        if not values:
+            return []
+        return [dict(zip(values[0], row)) for row in values[1:]]
+
+    def col_values(self, col):
+        self.calls['col_values'] += 1
+        column = [row[col - 1] if len(row) >= col else '' for row in self.values]
+        while column and not column[-1]:
+            column.pop()
+        return column
+
+    def add_rows(self, rows):
+        self.calls['add_rows'] += 1
+        self.row_count += rows
+
+    def add_cols(self, cols):
+        self.calls['add_cols'] += 1
+        self.col_count += cols
+
+    def clear(self):
+        self.calls['clear'] += 1
+        self.values = []
+
+    def batch_update(self, data, **kwargs):
+        self.calls['batch_update'] += 1
+        for entry in data:
+            first_row, first_col, _, _ = parse_a1(entry['range'])
+            for r, row in enumerate(entry['values']):
+                for c, value in enumerate(row):
+                    self._set(first_row + r, first_col + c, value)
+
+    def update(self, values, range_name='A1', **kwargs):
+        self.calls['update'] += 1
+        first_row, first_col, _, _ = parse_a1(range_name)
+        for r, row in enumerate(values):
+            for c, value in enumerate(row):
+                self._set(first_row + r, first_col + c, value)
+
+    def _set(self, row, col, value):
+        if row > self.row_count or col > self.col_count:
+            raise IndexError(f'Cell {row}:{col} is outside of the {self.row_count}x{self.col_count} grid')
+        while len(self.values) < row:
+            self.values.append([])
+        line = self.values[row - 1]
+        while len(line) < col:
+            line.append('')
+        line[col - 1] = '' if value is None else str(value)
+        self.cells_written += 1
+
+
+class FakeSpreadsheet:
+    """
+    An in-memory spreadsheet holding a list of `FakeWorksheet`.
+    """
+
+    def __init__(self, worksheets=None):
+        self.worksheets = worksheets or [FakeWorksheet()]
+
+    def get_worksheet(self, index):
+        return self.worksheets[index]
+
+    @property
+    def sheet1(self):
+        return self.worksheets[0]
+
+
+class FakeClient:
+    """
+    An in-memory stand-in for the `gspread.Client` returned by `gspread.service_account()`.
+    Spreadsheets are opened by URL and created empty on first use.
+    """
+
+    def __init__(self):
+        self.spreadsheets = {}
+
+    def open_by_url(self, url):
+        return self.spreadsheets.setdefault(url, FakeSpreadsheet())
+
+
+class _IMAPHandler(socketserver.StreamRequestHandler):
+    """
+    Serves one client connection of `FakeIMAPServer`.
+    """
+
+    def setup(self):
+        super().setup()
+        self.write_lock = threading.Lock()
+        self.idle_tag = None
+        self.selected = False
+        self.reported = 0
+        self.server.imap.sessions.add(self)
+
+    def finish(self):
+        self.server.imap.sessions.discard(self)
+        try:
+            super().finish()
+        except OSError:
+            pass
+
+    def send(self, line):
+        with self.write_lock:
+            self.wfile.write(line if isinstance(line, bytes) else line.encode() + b'\r\n')
+            self.wfile.flush()
+
+    def notify(self):
+        """
+        Reports new messages to the client, right away when it is idling.
+        """
+        if self.selected and self.idle_tag:
+            self.send_exists()
+
+    def send_exists(self):
+        count = len(self.server.imap.messages)
+        if count != self.reported:
+            self.reported = count
+            self.send(f'* {count} EXISTS')
+
+    def handle(self):
+        try:
+            self.serve()
+        except OSError:
+            # The client went away (or the connection was dropped on purpose)
+            pass
+
+    def serve(self):
+        imap = self.server.imap
+        self.send('* OK [CAPABILITY IMAP4rev1 IDLE UIDPLUS] Fake IMAP server ready')
+        for raw in self.rfile:
+            line = raw.decode().rstrip('\r\n')
+            if self.idle_tag:
+                if line.upper() == 'DONE':
+                    tag, self.idle_tag = self.idle_tag, None
+                    self.send(f'{tag} OK IDLE terminated')
+                continue
+
+            tag, _, rest = line.partition(' ')
+            command, _, args = rest.partition(' ')
+            command = command.upper()
+            use_uid = command == 'UID'
+            if use_uid:
+                command, _, args = args.partition(' ')
+                command = command.upper()
+            imap.commands[('UID ' if use_uid else '') + command] += 1
+
+            if imap.delay:
+                sleep(imap.delay)
+            if command == 'CAPABILITY':
+                self.send('* CAPABILITY IMAP4rev1 IDLE UIDPLUS')
+            elif command == 'LOGIN':
+                pass
+            elif command in ('SELECT', 'EXAMINE'):
+                self.selected = True
+                self.reported = 0
+                self.send_exists()
+                self.send(f'* OK [UIDVALIDITY {imap.uidvalidity}] UIDs valid')
+                self.send(f'* OK [UIDNEXT {imap.next_uid}] Predicted next UID')
+            elif command == 'IDLE':
+                self.idle_tag = tag
+                self.send('+ idling')
+                self.send_exists()
+                continue
+            elif command == 'SEARCH':
+                self.send('* SEARCH ' + ' '.join(str(n) for n in imap.search(args, use_uid)))
+            elif command == 'FETCH':
+                message_set, _, items = args.partition(' ')
+                for number, message in imap.select_messages(message_set, use_uid):
+                    self.send(imap.fetch_response(number, message, items, use_uid))
+            elif command == 'LOGOUT':
+                self.send('* BYE Logging out')
+                self.send(f'{tag} OK LOGOUT completed')
+                return
+            elif command not in ('NOOP', 'CLOSE', 'CHECK'):
+                self.send(f'{tag} BAD Unknown command {command}')
+                continue
+
+            if self.selected:
+                self.send_exists()
+            self.send(f'{tag} OK {command} completed')
+
+
+class FakeIMAPServer:
+    """
+    A local, plain-text IMAP server holding a single inbox, for exercising the OTP code offline.
+
+    Parameters:
+    host (str): The interface to listen on.
+    port (int): The port to listen on, 0 picks a free one.
+    tz (datetime.tzinfo): The timezone of the server, which SINCE compares the arrival dates in.
+
+    It implements the subset of IMAP4rev1 the bot relies on: LOGIN, SELECT, SEARCH and FETCH
+    (plain and UID variants, FROM/SINCE/UID criteria, header fields, INTERNALDATE and RFC822),
+    NOOP, IDLE and LOGOUT. Every command received is counted in `commands`.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, tz=timezone.utc):
+        self.tz = tz
+        self.messages = []
+        self.next_uid = 1
+        self.uidvalidity = 1
+        self.delay = 0
+        self.commands = Counter()
+        self.sessions = set()
+        self.lock = threading.Lock()
+        self.server = socketserver.ThreadingTCPServer((host, port), _IMAPHandler)
+        self.server.daemon_threads = True
+        self.server.imap = self
+        self.host, self.port = self.server.server_address
+        self.thread = threading.Thread(target=self.server.serve_forever, name='fake-imap', daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.drop_connections()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def connect(self, user='bot', password='secret'):
+        """
+        Opens a logged-in `imaplib.IMAP4` connection to the server.
+        """
+        mail = imaplib.IMAP4(self.host, self.port)
+        mail.login(user, password)
+        return mail
+
+    def drop_connections(self):
+        """
+        Closes every client socket, as a dropped network connection would.
+        """
+        for session in list(self.sessions):
+            try:
+                session.request.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def deliver(self, subject, sender='no-reply@tnsi.com', date=None, delay=0):
+        """
+        Adds a message to the inbox, optionally after `delay` seconds, and notifies idling clients.
+
+        Parameters:
+        subject (str): The subject of the message, e.g. 'Your verification code: 48877'.
+        sender (str): The address the message is from.
+        date (datetime.datetime): The date (header and arrival) of the message, defaults to the delivery time.
+        delay (float): Seconds to wait before the message arrives.
+
+        Returns:
+        None
+        """
+        if delay:
+            threading.Timer(delay, self.deliver, args=(subject, sender, date)).start()
+            return
+        now = datetime.now(timezone.utc)
+        with self.lock:
+            self.messages.append({
+                'uid': self.next_uid,
+                'from': sender,
+                'subject': subject,
+                'date': date or now,
+                'internaldate': date or now,
+            })
+            self.next_uid += 1
+        for session in list(self.sessions):
+            session.notify()
+
+    def _numbers(self, message_set, use_uid):
+        """
+        Expands an IMAP sequence set ('1,3:5', '7:*') into message numbers or UIDs.
+        """
+        largest = (self.messages[-1]['uid'] if use_uid else len(self.messages)) if self.messages else 0
+        numbers = set()
+        for part in message_set.split(','):
+            first, _, last = part.partition(':')
+            first = largest if first == '*' else int(first)
+            last = first if not last else largest if last == '*' else int(last)
+            numbers.update(range(min(first, last), max(first, last) + 1))
+        return numbers
+
+    def select_messages(self, message_set, use_uid):
+        numbers = self._numbers(message_set, use_uid)
+        return [
+            (number, message) for number, message in enumerate(self.messages, start=1)
+            if (message['uid'] if use_uid else number) in numbers
+        ]
+
+    def search(self, criteria, use_uid):
+        tokens = re.findall(r'"[^"]*"|[^\s()]+', criteria)
+        matches = list(enumerate(self.messages, start=1))
+        i = 0
+        while i < len(tokens):
+            key = tokens[i].upper()
+            if key in ('ALL', 'CHARSET'):
+                i += 2 if key == 'CHARSET' else 1
+                continue
+            if key == 'FROM':
+                sender = tokens[i + 1].strip('"').lower()
+                matches = [(n, m) for n, m in matches if sender in m['from'].lower()]
+            elif key == 'SINCE':
+                since = datetime.strptime(tokens[i + 1].strip('"'), '%d-%b-%Y').date()
+                matches = [(n, m) for n, m in matches if m['internaldate'].astimezone(self.tz).date() >= since]
+            elif key == 'UID':
+                uids = self._numbers(tokens[i + 1], True)
+                matches = [(n, m) for n, m in matches if m['uid'] in uids]
+            else:
+                numbers = self._numbers(tokens[i], use_uid)
+                matches = [(n, m) for n, m in matches if (m['uid'] if use_uid else n) in numbers]
+                i += 1
+                continue
+            i += 2
+        return [m['uid'] if use_uid else n for n, m in matches]
+
+    def fetch_response(self, number, message, items, use_uid):
+        headers = {
+            'FROM': f"From: {message['from']}",
+            'SUBJECT': f"Subject: {message['subject']}",
+            'DATE': f"Date: {format_datetime(message['date'])}",
+        }
+        parts = []
+        if use_uid or 'UID' in items.upper():
+            parts.append(f"UID {message['uid']}")
+        if 'INTERNALDATE' in items.upper():
+            parts.append(f'INTERNALDATE "{message["internaldate"].strftime("%d-%b-%Y %H:%M:%S %z")}"')
+
+        literal = None
+        fields = re.search(r'BODY(?:\.PEEK)?\[HEADER\.FIELDS \(([^)]*)\)\]', items, re.IGNORECASE)
+        if fields:
+            names = fields.group(1).upper().split()
+            literal = ('\r\n'.join(headers[name] for name in names if name in headers) + '\r\n\r\n').encode()
+            parts.append(f'BODY[HEADER.FIELDS ({fields.group(1).upper()})] {{{len(literal)}}}')
+        elif 'RFC822' in items.upper():
+            literal = ('\r\n'.join(headers.values()) + f"\r\n\r\n{message['subject']}\r\n").encode()
+            parts.append(f'RFC822 {{{len(literal)}}}')
+
+        line = f"* {number} FETCH ({' '.join(parts)}"
+        if literal is None:
+            return (line + ')\r\n').encode()
+        return line.encode() + b'\r\n' + literal + b')\r\n'
+
+
+# The registration form stand-in, with the element IDs the bot relies on
+FORM_HTML = """<!DOCTYPE html>
+<html>
+<head><meta charset="utf-8"><title>Free Caller Registry (local stand-in)</title><link rel="stylesheet" href="form.css"></head>
+<body>
+<div id="landing"><button id="nextButton" type="button">Register Numbers</button></div>
+<form id="submitform" style="display: none" onsubmit="return false">
+  <div id="phones"><input id="enterprise_phone_0" type="tel"></div>
+  <button id="add-number-command" type="button">Add Number</button>
+  <select id="enterprise_category">
+    <option value="">Select</option><option value="telemarketing">Telemarketing</option><option value="other">Other</option>
+  </select>
+  <input id="enterprise_contact_name"><input id="enterprise_contact_phone"><input id="enterprise_contact_email">
+  <input id="enterprise_company_name"><input id="enterprise_company_address_line_1"><input id="enterprise_company_address_city">
+  <select id="enterprise_company_address_state"><option value="">State</option><option value="FL">FL</option><option value="NY">NY</option></select>
+  <input id="enterprise_company_address_zip"><input id="enterprise_company_url"><input id="enterprise_service_provider">
+  <input id="call_count"><textarea id="additional_feedback"></textarea>
+  <button id="send-verification-code" type="button">Send Code</button>
+  <input id="captcha">
+  <button id="submitButton" type="button">Submit</button>
+  <div id="error"></div>
+  <div class="invalid-feedback">Please enter a valid phone number.</div>
+</form>
+<div id="done" style="display: none">Your feedback ID: <span class="feedback-id"></span></div>
+<script>
+var session = Math.random().toString(36).slice(2);
+var count = 1;
+function $(id) { return document.getElementById(id); }
+function post(path, body, done) {
+    var request = new XMLHttpRequest();
+    request.open('POST', path);
+    request.onload = function () { done(request.status, JSON.parse(request.responseText || '{}')); };
+    request.send(JSON.stringify(body));
+}
+function reset() {
+    $('submitform').reset();
+    $('phones').innerHTML = '<input id="enterprise_phone_0" type="tel">';
+    count = 1;
+    $('error').textContent = '';
+}
+$('nextButton').onclick = function () {
+    reset();
+    $('landing').style.display = 'none';
+    $('done').style.display = 'none';
+    $('submitform').style.display = 'block';
+};
+$('add-number-command').onclick = function () {
+    if (count >= 20) return;
+    var input = document.createElement('input');
+    input.id = 'enterprise_phone_' + count++;
+    input.type = 'tel';
+    $('phones').appendChild(input);
+};
+$('send-verification-code').onclick = function () {
+    post('otp', {session: session}, function () {});
+};
+$('submitButton').onclick = function () {
+    var phones = [];
+    for (var i = 0; i < count; i++) phones.push($('enterprise_phone_' + i).value);
+    post('submit', {session: session, code: $('captcha').value, phones: phones}, function (status, body) {
+        if (status !== 200) {
+            $('error').textContent = body.error;
+            return;
+        }
+        document.querySelector('.feedback-id').textContent = body.feedback;
+        $('submitform').style.display = 'none';
+        $('done').style.display = 'block';
+        $('landing').style.display = 'block';
+    });
+};
+</script>
+</body>
+</html>
+"""
+
+# The stylesheet of the form: like the live one, it hides the validation messages rendered with the page
+FORM_CSS = """.invalid-feedback { display: none; }
+"""
+
+
+class _FormHandler(BaseHTTPRequestHandler):
+    """
+    Serves the registration form stand-in and its OTP and submit endpoints.
+    """
+
+    def reply(self, status, body, content_type='application/json'):
+        sleep(self.server.form.latency)
+        data = body.encode() if isinstance(body, str) else json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.split('?')[0].endswith('.css'):
+            self.reply(200, FORM_CSS, 'text/css')
+        else:
+            self.reply(200, FORM_HTML, 'text/html; charset=utf-8')
+
+    def do_POST(self):
+        form = self.server.form
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        if self.path.endswith('/otp'):
+            self.reply(200, {'sent': form.send_code(body.get('session'))})
+        elif self.path.endswith('/submit'):
+            feedback, error = form.submit(body.get('session'), body.get('code'), body.get('phones') or [])
+            self.reply(200 if feedback else 400, {'feedback': feedback, 'error': error})
+        else:
+            self.reply(404, {'error': 'not found'})
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeFormServer:
+    """
+    A local HTTP stand-in of the registration form, sending its verification codes through a `FakeIMAPServer`.
+
+    Parameters:
+    imap (FakeIMAPServer): The mail server the verification codes are delivered to.
+    otp_delay (float): Seconds between the request of a code and its arrival in the inbox.
+    latency (float): Seconds added to every HTTP response, to mimic the network.
+    refuse (iterable): Phone numbers the form refuses, as the live form does for some numbers.
+    host (str): The interface to listen on.
+    port (int): The port to listen on, 0 picks a free one.
+
+    The form is served at `url`. A submit only succeeds with the last code sent to the same page, and every
+    accepted submission is kept in `submissions` as (feedback ID, phone numbers).
+    """
+
+    def __init__(self, imap, otp_delay=0, latency=0, refuse=(), host='127.0.0.1', port=0):
+        self.imap = imap
+        self.otp_delay = otp_delay
+        self.latency = latency
+        self.refuse = {re.sub(r'\D', '', str(number))[-10:] for number in refuse}
+        self.codes = {}
+        self.submissions = []
+        self.rejected = Counter()
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), _FormHandler)
+        self.server.daemon_threads = True
+        self.server.form = self
+        self.host, self.port = self.server.server_address
+        self.url = f'http://{self.host}:{self.port}/fcr/#submitform'
+        self.thread = threading.Thread(target=self.server.serve_forever, name='fake-form', daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def send_code(self, session):
+        code = f'{random.randint(0, 99999):05d}'
+        with self.lock:
+            self.codes[session] = code
+        self.imap.deliver(f'Your verification code: {code}', delay=self.otp_delay)
+        return True
+
+    def submit(self, session, code, phones):
+        with self.lock:
+            if not code or self.codes.get(session) != code:
+                self.rejected['wrong code'] += 1
+                return None, 'Invalid verification code.'
+            if not all(re.fullmatch(r'\d{10}', re.sub(r'\D', '', phone)) for phone in phones):
+                self.rejected['invalid number'] += 1
+                return None, 'Invalid phone number.'
+            refused = [phone for phone in phones if re.sub(r'\D', '', phone) in self.refuse]
+            if refused:
+                # The code stays valid, like after any other refused submit
+                self.rejected['refused number'] += 1
+                return None, f'Phone number {refused[0]} cannot be registered.'
+            del self.codes[session]
+            feedback = f"FCRFE{datetime.now(timezone.utc).strftime('%m%d%Y%H%M%S%f')}"
+            self.submissions.append((feedback, phones))
+        return feedback, None
+
+
+class FakeDriver:
+    """
+    A stand-in for `webdriver.Chrome` for code paths that only hold on to a driver.
+    """
+
+    def __init__(self):
+        self.current_url = 'about:blank'
+        self.closed = False
+
+    def quit(self):
+        self.closed = True
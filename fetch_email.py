@@ -2,10 +2,19 @@ import email
 import imaplib
 import os
 import logging
+import re
+import select
+import socket
+import threading
+import weakref
+from concurrent.futures import Future, CancelledError, TimeoutError as FutureTimeout
+from time import monotonic, mktime, sleep
 from dotenv import load_dotenv
-from email.utils import parsedate_to_datetime
-from datetime import datetime
+from datetime import datetime, timedelta
+from itertools import count
 import pytz
+from metrics import span
+from logger import setup_logging
 
 # Load environment variables from .env file
 load_dotenv()
@@ -16,20 +25,20 @@ web_mail = os.getenv('WEB_MAIL')
 password = os.getenv('PASSWORD')
 server_ = os.getenv('SERVER')
 
-# Create a folder for logging
-log_folder = 'logs'
-if not os.path.exists(log_folder):
-    os.makedirs(log_folder)
+# Seconds to wait for an OTP before giving up on a batch
+otp_timeout = float(os.getenv('OTP_TIMEOUT', 180))
 
-# Create a subfolder with the current date
-current_date = datetime.now().strftime('%Y-%m-%d')
-subfolder = os.path.join(log_folder, current_date)
-if not os.path.exists(subfolder):
-    os.makedirs(subfolder)
+# IMAP connections are not thread-safe, commands are serialized through this lock
+mail_lock = threading.Lock()
 
-# Set up logging
-log_file = os.path.join(subfolder, 'automation.log')
-logging.basicConfig(filename=log_file, level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# The OTP fetcher of every open connection
+fetchers = weakref.WeakKeyDictionary()
+
+# The mail session shared by every run, see `get_session()`
+shared_session = None
+
+# Month names of IMAP dates, independent of the locale
+MONTHS = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
 
 def login():
     """
@@ -61,6 +70,84 @@ def logout(mail):
     mail.logout()
     logging.info('Logged out from the mail server.')
 
+class OTPFetcher:
+    """
+    Incrementally scans the inbox for OTP emails, remembering the highest UID it has already seen.
+
+    Parameters:
+    mail (imaplib.IMAP4_SSL): An instance of the IMAP4_SSL class representing the connected mail server.
+    sender (str): The address the OTP emails are sent from.
+
+    Each poll only searches the UIDs above the last one seen (`UID n+1:*`), restricted to the day
+    of the request (`SINCE`), and fetches the Subject header and arrival date of the matches,
+    never the full message. The cost of a poll therefore does not grow with the size of the inbox.
+    """
+
+    def __init__(self, mail, sender='no-reply@tnsi.com'):
+        self.mail = mail
+        self.sender = sender
+        self.last_uid = 0
+        self.uidvalidity = None
+
+    def select(self):
+        """
+        Selects the inbox, starting over if the server renumbered its UIDs since the last selection.
+        """
+        status, _ = self.mail.select('inbox')
+        if status != 'OK':
+            raise imaplib.IMAP4.error('Could not select the inbox.')
+        _, data = self.mail.response('UIDVALIDITY')
+        uidvalidity = data[0] if data and data[0] else None
+        if uidvalidity != self.uidvalidity:
+            self.uidvalidity = uidvalidity
+            self.last_uid = 0
+
+    def poll(self, start_time):
+        """
+        Fetches the OTP emails that arrived since the previous poll.
+
+        Parameters:
+        start_time (datetime.datetime): Only emails from that day onwards are searched.
+
+        Returns:
+        list: A list of (uid, arrival_time, subject) tuples, oldest first.
+        """
+        with span('otp_poll'):
+            if self.mail.state != 'SELECTED':
+                self.select()
+
+            since = f'{start_time.day:02d}-{MONTHS[start_time.month - 1]}-{start_time.year}'
+            status, data = self.mail.uid('SEARCH', f'UID {self.last_uid + 1}:*', f'FROM "{self.sender}"', f'SINCE {since}')
+            if status != 'OK':
+                raise imaplib.IMAP4.error('Search failed.')
+
+            # `n:*` always matches the newest message, even when it is not above `n`
+            uids = [int(uid) for uid in data[0].split() if int(uid) > self.last_uid]
+            if not uids:
+                return []
+
+            status, data = self.mail.uid('FETCH', ','.join(str(uid) for uid in uids), '(UID INTERNALDATE BODY.PEEK[HEADER.FIELDS (SUBJECT)])')
+            if status != 'OK':
+                raise imaplib.IMAP4.error('Fetch failed.')
+
+            messages = []
+            for response_part in data:
+                if isinstance(response_part, tuple):
+                    uid = re.search(rb'UID (\d+)', response_part[0])
+                    internal_date = imaplib.Internaldate2tuple(response_part[0])
+                    if uid is None or internal_date is None:
+                        # A part the server answered in an unexpected shape: the other emails are still read
+                        logging.warning(f'Unreadable OTP Email Skipped => {response_part[0][:100]!r}')
+                        continue
+                    arrived = datetime.fromtimestamp(mktime(internal_date), pytz.utc)
+                    subject = email.message_from_bytes(response_part[1])['subject']
+                    messages.append((int(uid.group(1)), arrived, subject))
+
+            self.last_uid = max(uids)
+            messages.sort()
+            return messages
+
+
 def fetch_otp(mail, start_time):
     """
     Fetches the subject of the most recent email from a specific sender within a given time frame.
@@ -72,80 +159,398 @@ def fetch_otp(mail, start_time):
     Returns:
     str: The subject of the most recent email from the specific sender within the given time frame.
          Returns None if no emails are found or an error occurs.
+
+    Only the emails that arrived since the previous call on the same connection are looked at,
+    through the `OTPFetcher` kept for that connection.
     """
-    try:
-        # Select the inbox
-        mail.select('inbox')
+    # The connection may be shared by several submission workers
+    with mail_lock:
+        try:
+            fetcher = fetchers.get(mail)
+            if fetcher is None:
+                fetcher = fetchers[mail] = OTPFetcher(mail)
 
-        # Search for emails from the specific sender
-        search_criteria = '(FROM "no-reply@tnsi.com")'
-        status, data = mail.search(None, search_criteria)
+            # SINCE compares dates in the timezone of the server: look back a day, so a server behind UTC
+            # does not skip the emails of the hours after midnight UTC
+            messages = [message for message in fetcher.poll(start_time - timedelta(days=1)) if message[1] > start_time]
+            if not messages:
+                logging.info('Still Waiting For OTP.')
+                return
+
+            return messages[-1][2]
+        except Exception as e:
+            logging.error(f'An error occurred while fetching email: {e}')
+
+
+def idle(mail, timeout, interrupt=None):
+    """
+    Waits in IMAP IDLE until the server reports a change of the selected mailbox, or the timeout expires.
+
+    Parameters:
+    mail (imaplib.IMAP4_SSL): An instance of the IMAP4_SSL class representing the connected mail server,
+                              with a mailbox selected.
+    timeout (float): The maximum number of seconds to wait.
+    interrupt (socket.socket): Optional socket that ends the wait early as soon as it becomes readable.
+
+    Returns:
+    bool: True if the server reported new messages, False if the timeout expired first.
+    """
+    with mail_lock:
+        tag = mail._new_tag()
+        mail.send(tag + b' IDLE\r\n')
+        line = mail.readline()
+        if not line.startswith(b'+'):
+            raise imaplib.IMAP4.error(f'IDLE rejected: {line!r}')
+
+        changed = False
+        deadline = monotonic() + timeout
+        try:
+            while not changed:
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    break
+                # Decrypted bytes may already be waiting in the SSL layer
+                pending = getattr(mail.sock, 'pending', lambda: 0)()
+                if not pending:
+                    ready = select.select([mail.sock] + ([interrupt] if interrupt else []), [], [], remaining)[0]
+                    if mail.sock not in ready:
+                        break
+                line = mail.readline()
+                if not line:
+                    raise imaplib.IMAP4.abort('Connection closed during IDLE')
+                changed = b'EXISTS' in line or b'RECENT' in line
+        finally:
+            mail.send(b'DONE\r\n')
+            # Read up to the end of the IDLE command, keeping an eye on late notifications
+            while True:
+                line = mail.readline()
+                if not line:
+                    raise imaplib.IMAP4.abort('Connection closed during IDLE')
+                if line.startswith(tag):
+                    break
+                changed = changed or b'EXISTS' in line or b'RECENT' in line
+        return changed
+
+
+def wait_for_otp(mail, start_time, timeout=None):
+    """
+    Waits for the OTP email to arrive, waking up as soon as the server reports it.
+
+    Parameters:
+    mail (imaplib.IMAP4_SSL): An instance of the IMAP4_SSL class representing the connected mail server.
+    start_time (datetime.datetime): The time the OTP was requested at, older emails are ignored.
+    timeout (float): The maximum number of seconds to wait, defaults to `otp_timeout`.
+
+    Returns:
+    str: The subject of the OTP email, or None if it did not arrive in time.
+
+    When the server supports IDLE, the function blocks until new mail is reported and checks it.
+    Otherwise (or if IDLE fails) it polls with an adaptive backoff, starting at half a second.
+    """
+    timeout = otp_timeout if timeout is None else timeout
+    deadline = monotonic() + timeout
+    use_idle = 'IDLE' in mail.capabilities
+    delay = 0.5
+
+    while True:
+        otp = fetch_otp(mail, start_time)
+        if otp:
+            return otp
+
+        remaining = deadline - monotonic()
+        if remaining <= 0:
+            logging.error(f'No OTP Received Within {timeout} Seconds.')
+            return None
+
+        if use_idle:
+            try:
+                idle(mail, remaining)
+                continue
+            except (imaplib.IMAP4.error, OSError) as e:
+                logging.error(f'IDLE failed, falling back to polling: {e}')
+                use_idle = False
+
+        sleep(min(delay, remaining))
+        delay = min(delay * 2, 5)
+
+
+class MailSession:
+    """
+    A persistent IMAP connection, opened lazily and reopened transparently when it drops.
+
+    Parameters:
+    connect (callable): Opens and logs in a new connection, defaults to `login`.
+    max_attempts (int): The number of connection attempts before a reconnect gives up.
+
+    The connection is reused across batches and runs. `check()` sends a NOOP to make sure it is
+    still alive, and `reconnect()` replaces it with a backoff between failed attempts.
+    The number of `connections`, `reconnects` and IMAP `round_trips` made is kept for monitoring.
+    """
+
+    def __init__(self, connect=login, max_attempts=5):
+        self.connect = connect
+        self.max_attempts = max_attempts
+        self.connection = None
+        self.connections = 0
+        self.reconnects = 0
+        self.closed_round_trips = 0
+        self.lock = threading.RLock()
+
+    @property
+    def mail(self):
+        """
+        The open connection, connecting first if needed.
+        """
+        with self.lock:
+            if self.connection is None:
+                self._open()
+            return self.connection
+
+    def _open(self):
+        delay = 0.5
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                self.connection = self.connect()
+                self.connections += 1
+                return
+            except (imaplib.IMAP4.error, OSError) as e:
+                logging.error(f'Mail Connection Attempt {attempt}/{self.max_attempts} Failed: {e}')
+                if attempt == self.max_attempts:
+                    raise
+                sleep(delay)
+                delay = min(delay * 2, 30)
+
+    def _drop(self):
+        if self.connection is not None:
+            self.closed_round_trips += self.connection.tagnum
+            try:
+                self.connection.shutdown()
+            except Exception:
+                pass
+            self.connection = None
+
+    def reconnect(self):
+        """
+        Replaces the connection with a new one.
+
+        Returns:
+        imaplib.IMAP4_SSL: The new connection.
+        """
+        with self.lock:
+            self._drop()
+            self.reconnects += 1
+            logging.info('Reconnecting to the mail server.')
+            return self.mail
+
+    def check(self):
+        """
+        Sends a NOOP to check the connection is alive, reconnecting if it is not.
+
+        Returns:
+        bool: True if the connection was healthy, False if it had to be replaced.
+        """
+        with self.lock:
+            try:
+                with mail_lock:
+                    status, _ = self.mail.noop()
+                if status == 'OK':
+                    return True
+            except (imaplib.IMAP4.error, OSError) as e:
+                logging.error(f'Mail Connection Check Failed: {e}')
+            self.reconnect()
+            return False
+
+    @property
+    def round_trips(self):
+        return self.closed_round_trips + (self.connection.tagnum if self.connection else 0)
+
+    def stats(self):
+        """
+        Returns the connection counters as a dict.
+        """
+        return {'connections': self.connections, 'reconnects': self.reconnects, 'round_trips': self.round_trips}
+
+    def close(self):
+        """
+        Logs out and closes the connection.
+        """
+        with self.lock:
+            if self.connection is not None:
+                try:
+                    logout(self.connection)
+                except Exception as e:
+                    logging.error(f'Could Not Log Out: {e}')
+            self._drop()
+        logging.info(f'Mail Session Closed => {self.stats()}')
+
+
+def get_session():
+    """
+    Returns the mail session shared by every run of the process, created on first use.
+
+    Returns:
+    MailSession: The shared mail session.
+    """
+    global shared_session
+    with mail_lock:
+        if shared_session is None:
+            shared_session = MailSession()
+        return shared_session
+
+
+class OTPWatcher:
+    """
+    A single mailbox watcher handing OTP emails out to the form sessions waiting for them.
+
+    Parameters:
+    session (MailSession): The mail session to watch. The watcher becomes the only user of its connection.
+
+    Each `fill_form` call registers a request with `expect()` right before asking for a code.
+    A background thread watches the inbox (IDLE, or polling with backoff) and assigns every new OTP
+    email, in arrival order, to the oldest pending request sent before the email arrived. Many
+    in-flight submissions can therefore share one IMAP connection without stealing each other's codes.
+    """
+
+    def __init__(self, session):
+        self.session = session
+        self.fetcher = OTPFetcher(session.mail)
+        self.requests = []
+        self.sequence = count()
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.wakeup, self.interrupt = socket.socketpair()
+        self.thread = threading.Thread(target=self._run, name='otp-watcher', daemon=True)
+
+    def start(self):
+        """
+        Starts watching the inbox. Messages already in it are skipped.
+        """
+        with mail_lock:
+            self.fetcher.poll(datetime.now(pytz.utc) - timedelta(days=1))
+        self.thread.start()
+        logging.info('OTP Watcher Started.')
+        return self
+
+    def stop(self):
+        """
+        Stops watching the inbox and fails every pending request.
+        """
+        self.stopping.set()
+        self.wakeup.send(b'x')
+        if self.thread.is_alive():
+            self.thread.join()
+        with self.lock:
+            for _, _, future in self.requests:
+                future.cancel()
+            self.requests = []
+        self.wakeup.close()
+        self.interrupt.close()
+        logging.info('OTP Watcher Stopped.')
+
+    def expect(self, sent_at):
+        """
+        Registers a request for the next OTP email sent after `sent_at`.
+
+        Parameters:
+        sent_at (datetime.datetime): The time the code is requested at (just before clicking the send button).
+
+        Returns:
+        concurrent.futures.Future: Resolved with the subject of the OTP email assigned to the request.
+        """
+        future = Future()
+        with self.lock:
+            self.requests.append((sent_at.replace(microsecond=0), next(self.sequence), future))
+            self.requests.sort(key=lambda request: request[:2])
+        return future
+
+    def wait(self, future, timeout=None):
+        """
+        Waits for the OTP email assigned to a request.
+
+        Parameters:
+        future (concurrent.futures.Future): The request, as returned by `expect()`.
+        timeout (float): The maximum number of seconds to wait, defaults to `otp_timeout`.
+
+        Returns:
+        str: The subject of the OTP email, or None if it did not arrive in time.
+        """
+        timeout = otp_timeout if timeout is None else timeout
+        try:
+            return future.result(timeout)
+        except (FutureTimeout, CancelledError):
+            with self.lock:
+                self.requests = [request for request in self.requests if request[2] is not future]
+            logging.error(f'No OTP Received Within {timeout} Seconds.')
+            return None
+
+    def dispatch(self, messages):
+        """
+        Assigns new OTP emails, oldest first, to the oldest pending request sent before each of them.
+
+        Parameters:
+        messages (list): The (uid, arrival_time, subject) tuples returned by `OTPFetcher.poll()`.
+
+        Returns:
+        None
+        """
+        with self.lock:
+            for uid, arrived, subject in messages:
+                for request in self.requests:
+                    if request[0] <= arrived:
+                        self.requests.remove(request)
+                        request[2].set_result(subject)
+                        break
+                else:
+                    logging.info(f'OTP Email {uid} Not Claimed By Any Session.')
+
+    def _run(self):
+        use_idle = True
+        delay = 0.5
+        while not self.stopping.is_set():
+            try:
+                mail = self.session.mail
+                if self.fetcher.mail is not mail:
+                    # Reconnected: the inbox is selected again, the UIDs already seen are kept
+                    self.fetcher.mail = mail
+
+                # Look back a day so mails arriving around midnight are not missed
+                with mail_lock:
+                    messages = self.fetcher.poll(datetime.now(pytz.utc) - timedelta(days=1))
+                if messages:
+                    self.dispatch(messages)
+                    delay = 0.5
+                if use_idle and 'IDLE' in mail.capabilities:
+                    if not idle(mail, 60, self.interrupt) and not self.stopping.is_set():
+                        # Nothing happened for a while, make sure the connection is still alive
+                        self.session.check()
+                    continue
+            except (imaplib.IMAP4.abort, OSError) as e:
+                if self.stopping.is_set():
+                    break
+                logging.error(f'Mail Connection Lost: {e}')
+                try:
+                    self.session.reconnect()
+                    delay = 0.5
+                    continue
+                except (imaplib.IMAP4.error, OSError) as e:
+                    logging.error(f'Could Not Reconnect To The Mail Server: {e}')
+            except imaplib.IMAP4.error as e:
+                logging.error(f'OTP Watcher Error: {e}')
+                if use_idle:
+                    logging.error('IDLE failed, falling back to polling.')
+                    use_idle = False
+            except Exception as e:
+                # Anything else must not end the thread: every session would then wait for its OTP in vain
+                logging.error(f'OTP Watcher Failed, Retrying => {e}', exc_info=True)
+
+            self.stopping.wait(delay)
+            delay = min(delay * 2, 5)
 
-        if status != 'OK':
-            logging.error('Search failed.')
-            return
-
-        mail_ids = data[0].split()
-        
-        if not mail_ids:
-            logging.info('No emails found from no-reply@tnsi.com.')
-            return
-
-        # Fetch headers and filter by date
-        email_dates = []
-        # for i in mail_ids:
-        status, data = mail.fetch(mail_ids[-1], '(BODY[HEADER.FIELDS (DATE)])')
-        # if status != 'OK':
-        #     logging.error(f'Failed to fetch email ID {i}')
-        #     continue
-        for response_part in data:
-            if isinstance(response_part, tuple):
-                msg = email.message_from_bytes(response_part[1])
-                date = parsedate_to_datetime(msg['Date'])
-                
-                # print(f"Comparison| Start_time => {start_time} | Message_time => {date}")
-                
-                # Ensure email date is in UTC
-                if date.tzinfo is None:
-                    date = date.replace(tzinfo=pytz.utc)
-                
-                if date > start_time:
-                    email_dates.append((mail_ids[-1], date))
-
-        if not email_dates:
-            logging.info('Still Waiting For OTP.')
-            return
-
-        # Sort emails by date, most recent first
-        email_dates.sort(key=lambda x: x[1], reverse=True)
-        most_recent_email_id = email_dates[0][0]
-
-        # Fetch the most recent email by ID
-        status, data = mail.fetch(most_recent_email_id, '(RFC822)')
-        if status != 'OK':
-            logging.error('Failed to fetch the most recent email.')
-            return
-
-        for response_part in data:
-            if isinstance(response_part, tuple):
-                message = email.message_from_bytes(response_part[1])
-                mail_subject = message['subject']
-                return mail_subject
-    except Exception as e:
-        logging.error(f'An error occurred while fetching email: {e}')
-        print(f'An error occurred while fetching email: {e}')
 
 if __name__ == '__main__':
+    setup_logging()
     current_time = datetime.now(pytz.utc).replace(microsecond=0)
     mail = login()
-    from time import sleep
-    while True:
-        sleep(5)
-        otp = fetch_otp(mail, current_time)
-        if otp:
-            print(otp)
-            break
-        else:
-            print('retrying')
-        
+    otp = wait_for_otp(mail, current_time)
+    print(otp if otp else 'No OTP received')
     logout(mail)
@@ -0,0 +1,336 @@
+import logging
+import sqlite3
+import threading
+from datetime import datetime
+import pytz
+from sheets import normalize_did
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    did TEXT PRIMARY KEY,
+    raw TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    batch_id INTEGER,
+    feedback TEXT,
+    time TEXT,
+    reason TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    synced INTEGER NOT NULL DEFAULT 1,
+    added_at TEXT,
+    updated_at TEXT,
+    sync_pass INTEGER
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, position);
+CREATE INDEX IF NOT EXISTS jobs_unsynced ON jobs (synced) WHERE synced = 0;
+CREATE TABLE IF NOT EXISTS batches (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    state TEXT NOT NULL,
+    started_at TEXT,
+    finished_at TEXT,
+    feedback TEXT
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# Columns added to the jobs table after its first release, for the ledgers created before them
+MIGRATIONS = {
+    'reason': 'ALTER TABLE jobs ADD COLUMN reason TEXT',
+    'attempts': 'ALTER TABLE jobs ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0',
+    'added_at': 'ALTER TABLE jobs ADD COLUMN added_at TEXT',
+    'sync_pass': 'ALTER TABLE jobs ADD COLUMN sync_pass INTEGER',
+}
+
+
+def utc_now():
+    return datetime.now(pytz.utc).replace(microsecond=0).isoformat()
+
+
+class JobLedger:
+    """
+    A durable local record of every DID, its status, feedback ID and time, kept in SQLite.
+
+    Parameters:
+    path (str): The path of the database file.
+
+    The ledger is the source of truth for the pending work: the sheet is only read to learn about new
+    or removed DID's or a cleared cycle, and results are written back to it incrementally (`unsynced()`).
+    A batch is recorded as `in_flight` before it is submitted, so the next run puts the DID's a crashed
+    run was working on back to pending, first in line (`requeue()`), to be packed with the other ones.
+    """
+
+    def __init__(self, path='ledger.sqlite3'):
+        self.path = path
+        # The full sync under way, see `begin_sync()`
+        self.sync_pass = None
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript(SCHEMA)
+        columns = [column[1] for column in self.db.execute('PRAGMA table_info(jobs)')]
+        for column, migration in MIGRATIONS.items():
+            if column not in columns:
+                self.db.execute(migration)
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def is_empty(self):
+        """
+        Returns True if the ledger does not know any DID yet.
+        """
+        with self.lock:
+            return self.db.execute('SELECT 1 FROM jobs LIMIT 1').fetchone() is None
+
+    def fully_synced(self):
+        """
+        Returns True if the whole sheet was synced into the ledger at least once (`complete_sync()`).
+
+        A ledger holding DID's without it was interrupted while the sheet was streamed into it.
+        """
+        with self.lock:
+            return self.db.execute("SELECT 1 FROM meta WHERE key = 'full_sync_at'").fetchone() is not None
+
+    def begin_sync(self):
+        """
+        Starts a full sync of the sheet: the DID's the following `sync()` calls see are recorded as seen by it.
+        """
+        with self.lock, self.db:
+            last = self.db.execute("SELECT value FROM meta WHERE key = 'sync_pass'").fetchone()
+            self.sync_pass = int(last[0]) + 1 if last else 1
+            self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('sync_pass', ?)", (self.sync_pass,))
+
+    def complete_sync(self):
+        """
+        Records that every page of the sheet was synced into the ledger.
+
+        Returns:
+        int: The number of DID's marked as removed: those the full sync (`begin_sync()`) did not see in the sheet.
+             They are no longer pending, and come back if they are added to the sheet again.
+        """
+        now = utc_now()
+        removed = 0
+        with self.lock, self.db:
+            if self.sync_pass is not None:
+                removed = self.db.execute(
+                    """UPDATE jobs SET status = 'removed', batch_id = NULL, synced = 1, updated_at = ?
+                       WHERE (sync_pass IS NULL OR sync_pass != ?) AND status NOT IN ('in_flight', 'removed')""",
+                    (now, self.sync_pass),
+                ).rowcount
+                self.sync_pass = None
+            self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('full_sync_at', ?)", (now,))
+        if removed:
+            logging.info(f'{removed} DID(s) No Longer In The Sheet, Marked As Removed')
+        return removed
+
+    def sync(self, values, start=0):
+        """
+        Merges the rows of the sheet into the ledger.
+
+        Parameters:
+        values (list): The rows of the sheet, without the header. A row holding only the DID is pending,
+                       a longer one (DID'S, STATUS, TIME, Feedback ID) was already processed.
+        start (int): The index of the first row of `values` in the sheet, when syncing it page by page.
+
+        Returns:
+        dict: The number of `added` DID's and of DID's whose status was `updated` from the sheet.
+
+        New DID's are added, and DID's the sheet shows as done (or as cleared, for a new cycle) are updated,
+        unless they are in flight, rejected or hold results not yet written back to the sheet. A removed DID
+        found in the sheet again is back in its status of the sheet.
+        """
+        rows = []
+        for position, row in enumerate(values, start):
+            if not row or not str(row[0]).strip():
+                continue
+            done = len(row) > 1 and any(str(cell).strip() for cell in row[1:])
+            rows.append((
+                normalize_did(row[0]), str(row[0]), position,
+                'done' if done else 'pending',
+                row[3] if done and len(row) > 3 else None,
+                row[2] if done and len(row) > 2 else None,
+            ))
+
+        now = utc_now()
+        with self.lock, self.db:
+            before = self.db.total_changes
+            self.db.executemany(
+                'INSERT OR IGNORE INTO jobs (did, raw, position, status, feedback, time, added_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                [row + (now, now) for row in rows],
+            )
+            added = self.db.total_changes - before
+            before = self.db.total_changes
+            self.db.executemany(
+                """UPDATE jobs SET status = ?, feedback = ?, time = ?, position = ?, updated_at = ?
+                   WHERE did = ? AND status != ? AND status NOT IN ('in_flight', 'rejected') AND synced = 1""",
+                [(status, feedback, time, position, now, did, status) for did, _, position, status, feedback, time in rows],
+            )
+            updated = self.db.total_changes - before
+            if self.sync_pass is not None:
+                self.db.executemany(
+                    'UPDATE jobs SET sync_pass = ? WHERE did = ?', [(self.sync_pass, row[0]) for row in rows]
+                )
+            self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('synced_at', ?)", (now,))
+
+        logging.info(f'Ledger Synced With Sheet => {added} Added, {updated} Updated')
+        return {'added': added, 'updated': updated}
+
+    def pending(self, in_flight=False):
+        """
+        Returns the pending DID's as single-cell rows (the shape of pending sheet rows), by priority:
+        the DID's already attempted first, then the oldest ones, in sheet order.
+
+        Parameters:
+        in_flight (bool): Also returns the DID's left in flight, as `requeue()` would make them pending.
+        """
+        statuses = ('pending', 'in_flight') if in_flight else ('pending',)
+        with self.lock:
+            return [[raw] for raw, in self.db.execute(
+                f"SELECT raw FROM jobs WHERE status IN ({', '.join('?' * len(statuses))}) ORDER BY attempts DESC, added_at, position",
+                statuses,
+            )]
+
+    def requeue(self):
+        """
+        Puts the DID's of the batches a previous run left in flight back to pending, so they can be
+        packed again with the other pending DID's. Having been attempted, they come first in `pending()`.
+
+        Returns:
+        int: The number of DID's put back to pending.
+        """
+        now = utc_now()
+        with self.lock, self.db:
+            self.db.execute("UPDATE batches SET state = 'requeued', finished_at = ? WHERE state = 'in_flight'", (now,))
+            count = self.db.execute(
+                "UPDATE jobs SET status = 'pending', batch_id = NULL, updated_at = ? WHERE status = 'in_flight'", (now,)
+            ).rowcount
+        if count:
+            logging.info(f'Requeued {count} DID(s) Left In Flight')
+        return count
+
+    def start_batch(self, rows):
+        """
+        Records a batch as in flight, right before it is submitted.
+
+        Parameters:
+        rows (list): The rows of the batch.
+
+        Returns:
+        int: The ID of the batch.
+        """
+        now = utc_now()
+        with self.lock, self.db:
+            batch_id = self.db.execute("INSERT INTO batches (state, started_at) VALUES ('in_flight', ?)", (now,)).lastrowid
+            self.db.executemany(
+                "UPDATE jobs SET status = 'in_flight', batch_id = ?, attempts = attempts + 1, updated_at = ? WHERE did = ?",
+                [(batch_id, now, normalize_did(row[0])) for row in rows],
+            )
+        return batch_id
+
+    def finish_batch(self, batch_id, results):
+        """
+        Records the outcome of a batch.
+
+        Parameters:
+        batch_id (int): The ID of the batch.
+        results (list): The result dicts of the batch (DID'S, STATUS, TIME, Feedback ID), or None if it failed.
+                        The DID's of a failed batch go back to pending.
+
+        Returns:
+        None
+        """
+        now = utc_now()
+        with self.lock, self.db:
+            if not results:
+                self.db.execute("UPDATE batches SET state = 'failed', finished_at = ? WHERE id = ?", (now, batch_id))
+                self.db.execute(
+                    "UPDATE jobs SET status = 'pending', batch_id = NULL, updated_at = ? WHERE batch_id = ? AND status = 'in_flight'",
+                    (now, batch_id),
+                )
+                return
+            self.db.execute(
+                "UPDATE batches SET state = 'done', finished_at = ?, feedback = ? WHERE id = ?",
+                (now, results[0]['Feedback ID'], batch_id),
+            )
+            self.db.executemany(
+                "UPDATE jobs SET status = 'done', feedback = ?, time = ?, synced = 0, updated_at = ? WHERE did = ?",
+                [(result['Feedback ID'], str(result['TIME']), now, normalize_did(result["DID'S"])) for result in results],
+            )
+            # DID's of the batch without a result row are not done
+            self.db.execute(
+                "UPDATE jobs SET status = 'pending', batch_id = NULL, updated_at = ? WHERE batch_id = ? AND status = 'in_flight'",
+                (now, batch_id),
+            )
+
+    def reject(self, rejected):
+        """
+        Records the DID's that failed validation or that the form refused, so they are not counted as pending
+        until the next cycle.
+
+        Parameters:
+        rejected (list): A list of (raw value, reason) tuples, see `dids.DIDFilter` and `retries.RetryEngine`.
+
+        Returns:
+        None
+        """
+        now = utc_now()
+        with self.lock, self.db:
+            self.db.executemany(
+                "UPDATE jobs SET status = 'rejected', reason = ?, updated_at = ? WHERE did = ? AND status IN ('pending', 'in_flight')",
+                [(reason, now, normalize_did(raw)) for raw, reason in rejected],
+            )
+
+    def unsynced(self):
+        """
+        Returns the results not yet written back to the sheet.
+
+        Returns:
+        list: A list of result dicts (DID'S, STATUS, TIME, Feedback ID).
+        """
+        with self.lock:
+            return [
+                {"DID'S": raw, 'STATUS': '', 'TIME': time, 'Feedback ID': feedback}
+                for raw, time, feedback in self.db.execute(
+                    "SELECT raw, time, feedback FROM jobs WHERE synced = 0 ORDER BY position"
+                )
+            ]
+
+    def mark_synced(self, results):
+        """
+        Records that the given results were written back to the sheet.
+
+        Parameters:
+        results (list): The result dicts, as returned by `unsynced()`.
+
+        Returns:
+        None
+        """
+        with self.lock, self.db:
+            self.db.executemany(
+                'UPDATE jobs SET synced = 1 WHERE did = ?',
+                [(normalize_did(result["DID'S"]),) for result in results],
+            )
+
+    def reset(self):
+        """
+        Starts a new cycle: every DID goes back to pending, with its feedback ID and time cleared.
+        Rejected DID's are validated again, removed ones stay removed.
+        """
+        with self.lock, self.db:
+            self.db.execute(
+                "UPDATE jobs SET status = 'pending', batch_id = NULL, feedback = NULL, time = NULL, reason = NULL, attempts = 0, synced = 1, updated_at = ? WHERE status NOT IN ('in_flight', 'removed')",
+                (utc_now(),),
+            )
+        logging.info('Ledger Reset For A New Cycle')
+
+    def counts(self):
+        """
+        Returns the number of DID's per status.
+        """
+        with self.lock:
+            return dict(self.db.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
@@ -0,0 +1,228 @@
+import atexit
+import copy
+import glob
+import gzip
+import json
+import logging
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
+
+# Folder of the logs, with one subfolder per day
+log_folder = 'logs'
+# Format of the log file: 'json' (one JSON record per line) or 'text'
+log_format = os.getenv('LOG_FORMAT', 'json')
+# Size (MB) a log file is rotated at, besides every midnight, and the number of compressed old files kept
+log_max_mb = float(os.getenv('LOG_MAX_MB', 20))
+log_backups = int(os.getenv('LOG_BACKUPS', 30))
+
+# The fields of the current batch added to every record of the thread running it, see `log_context()`
+context = threading.local()
+
+# The listener writing the queued records to the file, see `setup_logging()`
+listener = None
+
+# Record attributes written as fields of the JSON records
+FIELDS = ('tenant', 'batch_id', 'dids', 'feedback_id')
+
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+
+def log_subfolder():
+    """
+    Returns the log subfolder of the current day, e.g. logs/2024-07-26.
+    """
+    return os.path.join(log_folder, datetime.now().strftime('%Y-%m-%d'))
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    Formats a record as one JSON line: time, level, thread, message and the batch fields it carries (`FIELDS`).
+    """
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        for field in FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry['error'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            # Formatted before the record was queued, see `RecordQueueHandler`
+            entry['error'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class ContextFilter(logging.Filter):
+    """
+    Adds the fields of the current batch (`log_context()`) to the records of the thread running it.
+
+    It runs on the thread logging the record, before the record is queued for the listener thread.
+    """
+
+    def filter(self, record):
+        for field, value in getattr(context, 'fields', {}).items():
+            if getattr(record, field, None) is None:
+                setattr(record, field, value)
+        return True
+
+
+@contextmanager
+def log_context(**fields):
+    """
+    Adds fields (batch_id, dids, ...) to every record logged by the current thread within the block.
+    """
+    previous = getattr(context, 'fields', {})
+    context.fields = {**previous, **fields}
+    try:
+        yield
+    finally:
+        context.fields = previous
+
+
+class RecordQueueHandler(QueueHandler):
+    """
+    Queues records with their message rendered and their exception formatted apart, in `exc_text`.
+
+    The default `QueueHandler.prepare()` appends the traceback to the message and drops `exc_info`,
+    so the formatters of the listener could no longer tell them apart (the `error` field of `JSONFormatter`).
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        return record
+
+
+class RotatingLogHandler(logging.FileHandler):
+    """
+    A log file rotated every midnight and whenever it outgrows a size, its old files compressed with gzip.
+
+    Parameters:
+    path (str): The path of the log file.
+    max_bytes (int): The size the file is rotated at, 0 for no limit.
+    backups (int): The number of compressed old files kept, the oldest are deleted.
+
+    An old file is named after the time it was rotated, e.g. automation.log.2024-07-26_23-59-59-123456.gz.
+    Rotation and compression run on the thread writing the records, the listener thread of `setup_logging()`.
+    """
+
+    def __init__(self, path, max_bytes=0, backups=30):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        super().__init__(path, encoding='utf-8')
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.rollover_at = self._next_midnight()
+
+    @staticmethod
+    def _next_midnight():
+        return (datetime.now() + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0).timestamp()
+
+    def emit(self, record):
+        try:
+            if self.should_rollover(record):
+                self.rollover()
+        except Exception:
+            self.handleError(record)
+        super().emit(record)
+
+    def should_rollover(self, record):
+        if record.created >= self.rollover_at:
+            return True
+        return bool(self.max_bytes) and self.stream is not None and self.stream.tell() >= self.max_bytes
+
+    def rollover(self):
+        """
+        Compresses the current file next to it and starts a new one.
+        """
+        self.close()
+        target = f"{self.baseFilename}.{datetime.now().strftime('%Y-%m-%d_%H-%M-%S-%f')}.gz"
+        if os.path.exists(self.baseFilename):
+            with open(self.baseFilename, 'rb') as source, gzip.open(target, 'wb') as compressed:
+                shutil.copyfileobj(source, compressed)
+            os.remove(self.baseFilename)
+        # The names sort by rotation time
+        for old in sorted(glob.glob(glob.escape(self.baseFilename) + '.*.gz'))[:-self.backups or None]:
+            os.remove(old)
+        self.rollover_at = self._next_midnight()
+        self.stream = self._open()
+
+
+def file_handler(path, fmt=None):
+    """
+    Returns the rotating handler of a log file, formatted as LOG_FORMAT asks.
+    """
+    handler = RotatingLogHandler(path, int(log_max_mb * 1024 * 1024), log_backups)
+    handler.setFormatter(JSONFormatter() if (fmt or log_format) == 'json' else logging.Formatter(TEXT_FORMAT))
+    return handler
+
+
+def queue_logging(logger, handler):
+    """
+    Sends the records of a logger through a queue to a handler running on a background listener thread.
+
+    Parameters:
+    logger (logging.Logger): The logger, e.g. the root logger.
+    handler (logging.Handler): The handler writing the records, e.g. `file_handler()`.
+
+    Returns:
+    QueueListener: The started listener, to be stopped (which flushes the queue) with `stop()`.
+
+    Logging then costs the calling thread a queue put: formatting and disk I/O happen on the listener thread.
+    """
+    queue = SimpleQueue()
+    queue_handler = RecordQueueHandler(queue)
+    queue_handler.addFilter(ContextFilter())
+    logger.addHandler(queue_handler)
+    started = QueueListener(queue, handler, respect_handler_level=True)
+    started.start()
+    return started
+
+
+def setup_logging():
+    """
+    Creates the log subfolder of the day and sends the logs to its `automation.log`, through a queue.
+
+    Returns:
+    str: The log subfolder.
+
+    Only the first call configures logging, so every entry point can call it.
+    The queue is flushed when the process exits, or by `stop_logging()`.
+    """
+    global listener
+    subfolder = log_subfolder()
+    root = logging.getLogger()
+    if listener is None and not root.handlers:
+        root.setLevel(logging.INFO)
+        listener = queue_logging(root, file_handler(os.path.join(subfolder, 'automation.log')))
+        atexit.register(stop_logging)
+    return subfolder
+
+
+def stop_logging():
+    """
+    Writes the records still queued and stops the listener thread.
+    """
+    global listener
+    if listener is not None:
+        root = logging.getLogger()
+        for handler in [handler for handler in root.handlers if isinstance(handler, QueueHandler)]:
+            root.removeHandler(handler)
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+        listener = None
@@ -1,419 +1,730 @@
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.common.keys import Keys
-from selenium.webdriver.support.ui import WebDriverWait, Select
-from selenium.webdriver.support import expected_conditions as EC
-from pprint import pprint
-from time import sleep
-import requests
+import argparse
 import logging
 import os
+from contextlib import closing
+from functools import partial
 from dotenv import load_dotenv
-from creds import (
-    web_url, contact_name, company_phone, city, company_email, calling_company_address, calling_company_name, calling_company_url, call_count, note, zipcode, service_provider
-)
-from fetch_email import fetch_otp, login, logout
+from sheets import merge_results, clear_results, render_values, write_delta, normalize_did, column_matches
+from planner import BatchPlanner
+from metrics import metrics, span
+from logger import setup_logging, log_subfolder, log_context
+from snapshots import SnapshotCache
+from pool import SubmissionPool
+from scheduler import Scheduler
+from writeback import WriteBack
+from tenants import FairShare, Tenant, load_tenants
+from retries import RetryEngine, Progress, SubmitError, form_error, PAGE_LOAD, ELEMENT_TIMEOUT, OTP_TIMEOUT, SUBMIT_TIMEOUT
 from datetime import datetime
 import pytz
-import pandas as pd
-import gspread
-from gspread_dataframe import set_with_dataframe
-#     driver.quit()
+# pandas, gspread, selenium and the browser, mail and DID validation modules are imported
+# by the functions using them, so commands that do not need them start fast (see `benchmark.py imports`)
 
 # Load environment variables from .env file
 load_dotenv()
 g_api = os.getenv('GAPI')
-
-# Create a folder for logging
-log_folder = 'logs'
-if not os.path.exists(log_folder):
-    os.makedirs(log_folder)
-
-# Create a subfolder with the current date
-current_date = datetime.now().strftime('%Y-%m-%d')
-subfolder = os.path.join(log_folder, current_date)
-if not os.path.exists(subfolder):
-    os.makedirs(subfolder)
-    
-# Create a folder for Results
-result_folder = 'results'
-if not os.path.exists(result_folder):
-    os.makedirs(result_folder)
-    
-gc = gspread.service_account(filename='glassy-bonsai-390211-1e87faf20a89.json')
-
-# Set up logging
-log_file = os.path.join(subfolder, 'automation.log')
-logging.basicConfig(filename=log_file, level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-
-def driver_setup():
+# The Google Sheet holding the DID's: https://docs.google.com/spreadsheets/d/{sheet_id}/edit?gid=0#gid=0
+sheet_id = os.getenv('SHEET_ID', '1YyrMfGEl2KioO90rcKYuqFrzJhMblJsTmOyxvYhZtvo')
+sheet_url = f'https://docs.google.com/spreadsheets/d/{sheet_id}/edit?gid=0#gid=0'
+# JSON file of the tenants served by the bot, each with its own sheet, form profile and throttles
+# (see `tenants.load_tenants()`), unset to serve the sheet of SHEET_ID with the form details of `creds`
+tenants_file = os.getenv('TENANTS_FILE')
+# Service account of the Google Sheets client, see `get_client()`
+service_account_file = os.getenv('SERVICE_ACCOUNT_FILE', 'glassy-bonsai-390211-1e87faf20a89.json')
+# Number of browsers submitting batches in parallel
+concurrency = int(os.getenv('CONCURRENCY', 1))
+# Chrome profile of the browsers, see `browser.PROFILES`
+driver_profile = os.getenv('DRIVER_PROFILE', 'legacy')
+# Local job ledger (SQLite), source of truth for the pending DID's
+ledger_path = os.getenv('LEDGER_PATH', 'ledger.sqlite3')
+# Seconds between the start of two cycles, submission rate limit (0 for none) and number of cycles (0 to run until stopped)
+cycle_interval = float(os.getenv('CYCLE_INTERVAL', 60))
+max_batches_per_minute = float(os.getenv('MAX_BATCHES_PER_MINUTE', 0))
+max_cycles = int(os.getenv('MAX_CYCLES', 0)) or None
+# Fill the whole form with a single script (set FAST_FILL=0 to fill it field by field)
+fast_fill_mode = os.getenv('FAST_FILL', '1') == '1'
+# Local snapshots of the Google Sheet, served instead of reading it again while it does not change
+snapshots = SnapshotCache(g_api, os.getenv('SNAPSHOT_CACHE', 'sheet_cache'))
+# Stage timings: Prometheus text file written after every cycle and/or HTTP port serving it (unset for none)
+metrics_file = os.getenv('METRICS_FILE')
+metrics_port = int(os.getenv('METRICS_PORT', 0))
+# Seconds the results of finished batches are gathered for before they are written to the sheet
+writeback_window = float(os.getenv('WRITEBACK_WINDOW', 5))
+
+# Log subfolder of the day, created by `setup_logging()` when a command starts
+subfolder = log_subfolder()
+
+# The Google Sheets client, see `get_client()`
+gc = None
+
+# Retries the failed submissions, shared by every worker (see `retries.RetryEngine`)
+retry_engine = RetryEngine()
+
+
+def get_client():
     """
-    Set up a Chrome WebDriver with specified options for optimization.
-
-    Parameters:
-    None
+    Returns the Google Sheets client, authorized with the service account on first use.
 
     Returns:
-    driver (webdriver.Chrome): The initialized Chrome WebDriver instance.
-
-    The function initializes a Chrome WebDriver with various options for optimization.
-    These options include disabling GPU hardware acceleration, disabling extensions,
-    disabling popup blocking, disabling images, disabling JavaScript, disabling infobars,
-    maximizing the window, and disabling software rasterizer.
-    """
-    # Set up Chrome options for optimization
-    chrome_options = webdriver.ChromeOptions()
-    # chrome_options.add_argument('--headless')  # Run in headless mode
-    chrome_options.add_argument('--disable-gpu')  # Disable GPU hardware acceleration
-    chrome_options.add_argument('--no-sandbox')  # Bypass OS security model
-    chrome_options.add_argument('--disable-dev-shm-usage')  # Overcome limited resource problems
-    chrome_options.add_argument('--disable-extensions')  # Disable extensions
-    chrome_options.add_argument('--disable-popup-blocking')  # Disable popup blocking
-    chrome_options.add_argument('--disable-images')  # Disable images
-    # chrome_options.add_argument('--disable-javascript')  # Disable JavaScript
-    chrome_options.add_argument('--disable-infobars')  # Disable infobars
-    chrome_options.add_argument('--start-maximized')  # Start maximized
-    chrome_options.add_argument('--disable-software-rasterizer')  # Disable software rasterizer
-
-    # Initialize the WebDriver
-    driver = webdriver.Chrome(options=chrome_options)
-    logging.info('Driver Initiated!')
-    return driver
-
-def get_sheet_data(id):
-    """
-    Fetch data from a Google Sheet using the provided ID.
+    gspread.Client: The client.
+    """
+    global gc
+    if gc is None:
+        import gspread
 
-    Parameters:
-    id (str): The ID of the Google Sheet.
+        gc = gspread.service_account(filename=service_account_file)
+    return gc
 
-    Returns:
-    dict: The JSON response from the Google Sheets API, or None if an error occurred.
 
-    This function sends a GET request to the Google Sheets API using the provided ID and API key.
-    It then checks the response status code and returns the JSON response if the status code is 200.
-    If an error occurs during the request, it prints an error message and returns None.
-    """
-    try:
-        response = requests.get(f'https://sheets.googleapis.com/v4/spreadsheets/{id}/values/!A1:Z?alt=json&key={g_api}')
-        
-        if response.status_code == 200:
-            logging.info('Data Fetched From Google Sheet!')
-            return response.json()
-            
-    except Exception as e:
-        print(f'Error fetching data from Google Sheet: {str(e)}')
-        
-def update_sheet_data(spreadsheet_url, df, clear=False):
+def update_sheet_data(spreadsheet_url, df, clear=False, snapshot=None):
     """
     Updates the data in a Google Sheet using the provided URL and DataFrame.
 
     Parameters:
     spreadsheet_url (str): The URL of the Google Sheet to be updated.
     df (pandas.DataFrame): The DataFrame containing the data to be written to the Google Sheet.
+    clear (bool): Clears the results of every DID instead, once all of them were done.
+    snapshot (SheetSnapshot): The snapshot of the sheet, read instead of the sheet itself. It must match the
+                              current revision of the sheet (`SnapshotCache.fresh()`): cells are addressed by row.
+                              Its DID column is checked against the sheet right before the write, and the
+                              sheet is read again if they differ.
 
     Returns:
     None
 
     The function opens the Google Sheet specified by the `spreadsheet_url`, selects the first sheet,
     matches the DID'S in the existing data with the new data, and updates matching rows without appending new rows.
+    Only the cells that changed are sent back, grouped into ranges in one `batch_update` call,
+    and the snapshot is updated with the values written.
     """
-    # Authorize and open the Google Sheet
-    sh = gc.open_by_url(spreadsheet_url)
-
-    # Select the first sheet in the document
-    worksheet = sh.get_worksheet(0)
-
-    # Read existing data into a DataFrame
-    existing_data = pd.DataFrame(worksheet.get_all_records())
-
-    if not existing_data.empty:
-            for dex, existing_row in existing_data.iterrows():
-                if clear:
-                    print('Clearing Columns')
-                    # Clear 'TIME' and 'Feedback ID' columns in existing data
-                    if 'TIME' in existing_data.columns:
-                        existing_data['TIME'] = pd.NA
-                    if 'Feedback ID' in existing_data.columns:
-                        existing_data['Feedback ID'] = pd.NA
-                        
-                    logging.info("All DiD's Were Done, Clearing Sheet!")
-                    logging.info('Time Cleared')
-                    logging.info('Feedback ID Cleared')
-                else:
-                    for index, new_row in df.iterrows():
-                        if str(existing_row["DID'S"]).lower() == str(new_row["DID'S"]).lower():                            
-                            # Update the existing row in the DataFrame using the index `dex`
-                            existing_data.loc[dex] = new_row
-
-                            # print(f"Updated Row => {existing_data.loc[dex]}")
-                            # print(f"New Row => {new_row}")
-                            break
-                        
-    # Clear the existing data in the worksheet
-    worksheet.clear()
-
-    # Write the updated DataFrame to the worksheet
-    set_with_dataframe(worksheet, existing_data)
+    import pandas as pd
+
+    with span('sheet_sync', rows=len(df), clear=clear):
+        # Authorize and open the Google Sheet
+        sh = get_client().open_by_url(spreadsheet_url)
+
+        # Select the first sheet in the document
+        worksheet = sh.get_worksheet(0)
+
+        # Read existing data into a DataFrame
+        values = snapshot.values if snapshot is not None else worksheet.get_all_values()
+        if snapshot is not None and not column_matches(worksheet.col_values(1), values):
+            # Rows were inserted, deleted or sorted since the snapshot, e.g. between a write and its revision
+            logging.info('DID Column Changed Since The Sheet Snapshot, Reading It Again Before Writing')
+            snapshot = snapshots.reload(snapshot.sheet_id)
+            values = snapshot.values
+        existing_data = pd.DataFrame(values[1:], columns=values[0]) if values else pd.DataFrame()
+
+        if not existing_data.empty:
+            if clear:
+                logging.info("All DiD's Were Done, Clearing Sheet!")
+                existing_data = clear_results(existing_data)
+            else:
+                existing_data, report = merge_results(existing_data, df)
+                logging.info(f"DID Merge => Matched: {report['matched']} | Unmatched: {report['unmatched']} | Duplicated: {report['duplicated']}")
+
+        # Write only the cells that changed, in a single request
+        new_values = render_values(existing_data)
+        write_delta(worksheet, values, new_values)
+        if snapshot is not None:
+            snapshots.written(snapshot, new_values)
 
     logging.info("Sheet updated successfully.")
-    print("Sheet updated successfully.")
 
-        
-def fill_form(driver, phone_numbers, current_time, mail):
+
+def fill_fields(driver, phone_numbers, fields=None):
     """
-    Fills the form on the website with the provided phone numbers, current time, and email.
-    It also handles the OTP verification process and returns the feedback ID.
+    Fills the phone numbers and the company details of the form, one field at a time.
 
     Parameters:
     driver (webdriver.Chrome): The initialized Chrome WebDriver instance.
     phone_numbers (list): A list of phone numbers to be filled in the form.
-    current_time (datetime): The current time in UTC.
-    mail (str): The email address used for OTP verification.
+    fields (dict): The company details keyed by field ID, defaults to `browser.form_values()`.
 
     Returns:
-    str: The feedback ID generated after submitting the form.
+    bool: True once the form is filled.
+
+    Raises a `SubmitError` (element timeout) if a field or button could not be used, rather than
+    leaving the form short of some numbers.
     """
-    for i, phone_number in enumerate(phone_numbers):
-        if i >= 20:
-            break
-        # Find the element and send the Enter key
-        num_input = WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.ID, f'enterprise_phone_{i}')))
-        sleep(0.2)
-        try:
-            phone_number = phone_number.replace("[", "").replace("]", "").replace("'", "")
-        except:
-            print('Could not purify phone number')
-        num_input.send_keys(phone_number)
-        if i < min(len(phone_numbers), 20) - 1:
-            try:
+    from selenium.webdriver.support.ui import Select
+    from browser import form_values
+    from dids import national_number
+    import waits
+
+    try:
+        for i, phone_number in enumerate(phone_numbers[:20]):
+            num_input = waits.element(driver, f'enterprise_phone_{i}')
+            num_input.send_keys(national_number(phone_number))
+            if i < min(len(phone_numbers), 20) - 1:
                 # Add Number Button
-                WebDriverWait(driver, 10).until(EC.element_to_be_clickable((By.ID, 'add-number-command'))).click()
-            except Exception as e:
-                print(f"Error occurred while clicking 'add-number-command': {e}")
-                break
-    
+                waits.clickable(driver, 'add-number-command').click()
+    except Exception as e:
+        raise SubmitError(ELEMENT_TIMEOUT, f'Could not fill the phone numbers: {e}')
+
     try:
-        # Select Category
-        dropdown = WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.ID, 'enterprise_category')))
-        select = Select(dropdown)
-        select.select_by_value('telemarketing')
-        
+        # The company details are all on the form already, wait for them at once
+        fields = fields or form_values()
+        elements = waits.elements(driver, list(fields))
+
+        # Dropdowns
+        Select(elements['enterprise_category']).select_by_value(fields['enterprise_category'])
+        Select(elements['enterprise_company_address_state']).select_by_value(fields['enterprise_company_address_state'])
+
         # Fill Other Details
-        WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.ID, 'enterprise_contact_name'))).send_keys(contact_name)
-        WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.ID, 'enterprise_contact_phone'))).send_keys(company_phone)
-        WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.ID, 'enterprise_contact_email'))).send_keys(company_email)
-        WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.ID, 'enterprise_company_name'))).send_keys(calling_company_name)
-        WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.ID, 'enterprise_company_address_line_1'))).send_keys(calling_company_address)
-        WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.ID, 'enterprise_company_address_city'))).send_keys(city)
-        
-        # DropDown of State
-        state_dropdown = WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.ID, 'enterprise_company_address_state')))
-        state_select = Select(state_dropdown)
-        state_select.select_by_value('FL')
-        
-        WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.ID, 'enterprise_company_address_zip'))).send_keys(zipcode)
-        WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.ID, 'enterprise_company_url'))).send_keys(calling_company_url)
-        WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.ID, 'enterprise_service_provider'))).send_keys(service_provider)
-        WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.ID, 'call_count'))).send_keys(call_count)
-        WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.ID, 'additional_feedback'))).send_keys(note)
-        
+        for field, value in fields.items():
+            if elements[field].tag_name != 'select':
+                elements[field].send_keys(value)
+        return True
+    except Exception as e:
+        raise SubmitError(ELEMENT_TIMEOUT, f'Could not fill the company details: {e}')
+
+
+def fill_form(driver, phone_numbers, watcher, fields=None, progress=None):
+    """
+    Fills the form on the website with the provided phone numbers and company details, verifies it
+    with an OTP and submits it.
+
+    Parameters:
+    driver (webdriver.Chrome): The WebDriver instance, showing a fresh form unless `progress` says it is filled.
+    phone_numbers (list): A list of phone numbers to be filled in the form.
+    watcher (OTPWatcher): The mailbox watcher delivering the OTP of this form.
+    fields (dict): The company details keyed by field ID, defaults to `browser.form_values()`.
+    progress (Progress): What the previous attempts left on the page (`retries.Progress`): a filled form
+                         is not filled again, and a fresh OTP is submitted again instead of asking for a new one.
+
+    Returns:
+    str: The feedback ID generated after submitting the form.
+
+    Raises a `SubmitError` classifying the failure, see `retries.RetryEngine`.
+    In fast-fill mode the whole form is filled with a single script, see `browser.fast_fill()`.
+    If that fails, the form is reloaded and filled field by field with `fill_fields()`.
+    """
+    from browser import start_submission, fast_fill, form_values, submit_outcome, clear_errors
+    from dids import national_number
+    from selenium.common.exceptions import TimeoutException
+    import waits
+
+    progress = progress or Progress()
+    if not progress.filled:
+        with span('form_fill'):
+            filled = False
+            if fast_fill_mode:
+                values = [national_number(number) for number in phone_numbers[:20]]
+                filled = fast_fill(driver, values, fields or form_values())
+                if not filled:
+                    # Start over on a clean form
+                    try:
+                        start_submission(driver)
+                    except Exception as e:
+                        raise SubmitError(PAGE_LOAD, str(e))
+            if not filled:
+                fill_fields(driver, phone_numbers, fields)
+        progress.filled = True
         logging.info('Form Filled Successfully')
-        
-        send_otp_ = WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.ID, 'send-verification-code')))
-        send_otp_.click()
-        print("Waiting For OTP...")
-        
+
+    otp = progress.usable_otp()
+    if otp is None:
+        with span('otp_request'):
+            try:
+                send_otp_ = waits.clickable(driver, 'send-verification-code')
+            except Exception as e:
+                raise SubmitError(ELEMENT_TIMEOUT, f'No send code button: {e}')
+            # Claim the next OTP sent from now on, before asking for it
+            otp_request = watcher.expect(datetime.now(pytz.utc))
+            send_otp_.click()
+        logging.info('Waiting For OTP...')
+
         # Get OTP!
-        while True:
-            sleep(5)
-            otp = fetch_otp(mail, current_time)
-            if otp:
-                otp = otp.split(':')[-1].replace(' ', '')
-                logging.info(f"OTP Received: {otp}")
-                break
-        
-        WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.ID, 'captcha'))).send_keys(otp)
-        WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.ID, 'submitButton'))).click()
-        # Get Feedback Number
-        feedback_ = WebDriverWait(driver, 30).until(EC.visibility_of_element_located((By.CLASS_NAME, 'feedback-id'))).text.strip()
-        return feedback_
-    except Exception as e:
-        logging.error(f"Error occurred while filling form: {e}")
-        return None
+        with span('otp_wait'):
+            otp = watcher.wait(otp_request)
+            if not otp:
+                raise SubmitError(OTP_TIMEOUT, 'No OTP received')
+        otp = otp.split(':')[-1].replace(' ', '')
+        progress.received(otp)
+        logging.info(f"OTP Received: {otp}")
+    else:
+        # A previous submit of this page timed out: it may have gone through meanwhile
+        outcome = submit_outcome(driver, wait=False)
+        if outcome and outcome.get('feedback'):
+            return outcome['feedback']
+        logging.info(f'Reusing The OTP Received For This Form: {otp}')
+
+    with span('form_submit'):
+        try:
+            elements = waits.elements(driver, ['captcha', 'submitButton'])
+            clear_errors(driver)
+            elements['captcha'].clear()
+            elements['captcha'].send_keys(otp)
+            elements['submitButton'].click()
+        except Exception as e:
+            raise SubmitError(ELEMENT_TIMEOUT, f'Could not submit: {e}')
+        # Get Feedback Number (or the error of the form), as soon as the page shows it
+        try:
+            outcome = submit_outcome(driver, timeout=30)
+        except TimeoutException:
+            raise SubmitError(SUBMIT_TIMEOUT, 'No feedback ID within 30s')
+    if outcome.get('error'):
+        raise form_error(outcome['error'], phone_numbers, outcome.get('fields') or ())
+    return outcome['feedback']
+
+
+def stream_pending(sheet_id, ledger):
+    """
+    Streams the Google Sheet into the ledger page by page, yielding the pending rows of each page.
+
+    Parameters:
+    sheet_id (str): The ID of the Google Sheet.
+    ledger (JobLedger): The local job ledger the rows are recorded in.
+
+    Yields:
+    list: A pending row (holding only its DID), as soon as its page has been recorded.
+
+    Once the last page is recorded the ledger is marked as fully synced (`JobLedger.complete_sync()`).
+    Closing the generator ends the read of the sheet.
+    """
+    ledger.begin_sync()
+    with closing(snapshots.pages(sheet_id)) as pages:
+        for start, rows in pages:
+            ledger.sync(rows, start)
+            for row in rows:
+                # Rows holding nothing but their DID are pending
+                if row and str(row[0]).strip() and not any(str(cell).strip() for cell in row[1:]):
+                    yield row[:1]
+    ledger.complete_sync()
+
+
+def close_with(batches, stream):
+    """
+    Yields the batches packed from a stream, closing the stream once the batches are closed or done.
+    """
+    with closing(stream):
+        yield from batches
 
 
-def process_batches(values):
+def submit_batch(driver, index, batch, total, watcher, fields=None, on_reject=None):
     """
-    Divides a list of values into smaller batches of 20.
+    Submits one batch of phone numbers through the form and builds its result rows.
 
     Parameters:
-    values (list): A list of values to be divided into batches.
+    driver (webdriver.Chrome): The WebDriver instance of the worker running the batch.
+    index (int): The index of the batch.
+    batch (list): The rows of the batch, each holding a pending DID (see `planner.BatchPlanner`).
+    total (int): The total number of batches, for logging. None when still unknown.
+    watcher (OTPWatcher): The mailbox watcher shared by all workers for OTP verification.
+    fields (dict): The company details of the tenant of the batch, defaults to `browser.form_values()`.
+    on_reject (callable): Called with the (raw value, reason) pairs of the DID's the form refused,
+                          e.g. `JobLedger.reject`.
 
     Returns:
-    list: A list of lists, where each inner list represents a batch of 20 values.
-          If the number of values is not a multiple of 20, the last batch may contain fewer than 20 values.
+    list: A list of result dicts (DID'S, STATUS, TIME, Feedback ID), or None if the batch failed.
+
+    Failures are retried by `retry_engine` as their class calls for: the DID's the form refused are dropped and
+    the rest resubmitted, so the result rows may hold several feedback IDs and miss the DID's that failed.
     """
-    batches = [values[i:i + 20] for i in range(0, len(values), 20)]
-    logging.info(F'Made {len(batches)} Batches of 20 Number(s) for Further Processing')
-    return batches
+    from browser import get_form_session
+    import waits
+
+    label = f'{index + 1}/{total}' if total else f'{index + 1}'
+    logging.info(f'Processing Batch {label} => {[row[0] for row in batch]}')
+    waits.reset()
+    form = get_form_session(driver)
+
+    def attempt(rows, progress):
+        try:
+            if not progress.filled:
+                with span('page_load'):
+                    try:
+                        form.open()
+                    except Exception as e:
+                        raise SubmitError(PAGE_LOAD, str(e))
+            feedback = fill_form(driver, [row[0] for row in rows], watcher, fields, progress)
+        except Exception:
+            form.finished(False)
+            raise
+        form.finished(True)
+        return feedback
+
+    done, rejected = retry_engine.run(batch, attempt)
+    if rejected:
+        logging.error(f'Batch {label}: The Form Refused {len(rejected)} DID(s) => {[raw for raw, _ in rejected]}')
+        if on_reject:
+            on_reject(rejected)
+    waited = waits.waited()
+    metrics.observe('batch_wait', waited, 'ok' if done else 'error')
+    logging.info(f'Batch {label} Waited {waited:.2f}s For The Page')
+    if not done:
+        logging.error(f'Batch {label} RETURNED WITH AN ERROR!!!')
+        return None
 
-def start_submission(driver):
+    results = []
+    for rows, feedback in done:
+        for bat in rows:
+            result = {}
+            result["DID'S"] = normalize_did(bat[0])
+            result['STATUS'] = ""
+            result['TIME'] = datetime.now(pytz.utc).replace(microsecond=0)
+            result['Feedback ID'] = feedback
+            results.append(result)
+
+    feedbacks = ', '.join(feedback for _, feedback in done)
+    logging.info(
+        f'Batch {label} Finished Successfully => {len(results)}/{len(batch)} DID(s) => Feedback ID => {feedbacks}',
+        extra={'feedback_id': feedbacks},
+    )
+    return results
+
+
+def sync_sheet(sheet_id, ledger):
     """
-    This function navigates to the specified web page URL and clicks on the registration button.
+    Streams the Google Sheet into the ledger page by page (from its snapshot when it did not change).
 
     Parameters:
-    driver (webdriver.Chrome): The initialized Chrome WebDriver instance.
+    sheet_id (str): The ID of the Google Sheet.
+    ledger (JobLedger): The local job ledger the rows are recorded in.
 
     Returns:
     None
 
-    The function performs the following steps:
-    1. Navigates to the web page URL using the provided WebDriver instance.
-    2. Refreshes the current page (Page Does not load on 1st Attempt, Restricted by URL).
-    3. Waits for the registration button to be clickable using WebDriverWait and the specified locator.
-    4. Clicks on the registration button.
+    The DID's no longer in the sheet are marked as removed (`JobLedger.complete_sync()`).
     """
-    # Go to the Page URL
-    driver.get(web_url)
-    driver.refresh()
+    ledger.begin_sync()
+    for start, rows in snapshots.pages(sheet_id):
+        ledger.sync(rows, start)
+    ledger.complete_sync()
 
-    # Register Button
-    reg_num_button = WebDriverWait(driver, 10).until(EC.element_to_be_clickable((By.ID, 'nextButton')))
-    reg_num_button.click()
 
+def write_results(tenant, results):
+    """
+    Writes result rows to the Google Sheet of a tenant, through the snapshot of the current cycle.
 
-def main(driver, values):
+    Parameters:
+    tenant (Tenant): The tenant the results belong to.
+    results (list): A list of result dicts (DID'S, STATUS, TIME, Feedback ID).
+
+    Returns:
+    None
+    """
+    import pandas as pd
+
+    update_sheet_data(tenant.sheet_url, pd.DataFrame(results), snapshot=snapshots.fresh(tenant.sheet_id))
+
+
+def get_tenants():
     """
-    This function orchestrates the entire process of logging in, fetching data from a Google Sheet,
-    processing the data into batches, starting the submission process, filling the form, and logging out.
+    Returns the tenants served by the bot: those of TENANTS_FILE, or the single sheet of SHEET_ID.
+
+    Returns:
+    list: The tenants, their ledgers not opened yet.
+    """
+    if tenants_file:
+        return load_tenants(tenants_file)
+    return [Tenant('default', sheet_id, ledger_path, sheet_url)]
+
+
+def plan_batches(tenant):
+    """
+    Fetches, validates and batches the pending DID's of a tenant for the current cycle.
 
     Parameters:
-    driver (webdriver.Chrome): The initialized Chrome WebDriver instance.
-    values (list): A list of values fetched from the Google Sheet. Each value represents a batch of phone numbers.
+    tenant (Tenant): The tenant, its ledger open.
+
+    Returns:
+    tuple: The batches of the tenant as (index, batch) pairs (lazy while its sheet streams), their total
+           (None while unknown) and the planner packing them. None if the tenant had nothing left to do.
+
+    When the ledger does not know the Google Sheet yet, it is streamed into the ledger page by page and its
+    pending DID's are batched as they arrive. A stream that did not reach the last page (e.g. the run was
+    stopped) is done again in full before batching, as the ledger then misses part of the sheet.
+    Otherwise the sheet is synced into the ledger (the DID's removed from it are no longer submitted),
+    and the pending DID's of the ledger are batched, those a crashed run left in flight first.
+    Once every DID is done, the sheet is cleared, the ledger reset and the DID's added to the sheet
+    are picked up.
+    """
+    import pandas as pd
+    from dids import DIDFilter
+
+    ledger = tenant.ledger
+    # Only valid, unique DID's take a slot of the form
+    dids = DIDFilter(on_reject=ledger.reject)
+    planner = BatchPlanner()
+    if ledger.is_empty():
+        # Stream the sheet: submission starts with the first complete batch
+        stream = stream_pending(tenant.sheet_id, ledger)
+        batches = close_with(enumerate(planner.pack(dids.filter(stream))), stream)
+        total = None
+    else:
+        if not ledger.fully_synced():
+            logging.info(f'Sync Of {tenant.name} Was Interrupted, Syncing The Whole Sheet Again')
+        # Pick up the DID's added to or removed from the sheet, from its snapshot when it did not change
+        sync_sheet(tenant.sheet_id, ledger)
+        # The DID's left in flight by a crashed run go first, packed with the other pending DID's
+        ledger.requeue()
+        batches = list(enumerate(planner.pack(dids.filter(ledger.pending()))))
+        total = len(batches)
+
+    if total == 0 and not ledger.unsynced():
+        logging.info(f"All DiD's Of {tenant.name} Were Done, Starting A New Cycle")
+        update_sheet_data(tenant.sheet_url, pd.DataFrame(), clear=True, snapshot=snapshots.fresh(tenant.sheet_id))
+        ledger.reset()
+        # Pick up the DID's added to the sheet since the last cycle
+        sync_sheet(tenant.sheet_id, ledger)
+        return None
+    return batches, total, planner
+
+
+def run_cycle(pool, tenants, watcher, scheduler):
+    """
+    Runs one cycle of the bot over every tenant: fetch, batch, submit and sync.
+
+    Parameters:
+    pool (SubmissionPool): The pool of workers, each owning a Chrome WebDriver instance, shared by the tenants.
+    tenants (list): The tenants, their ledgers open and their background writers started.
+    watcher (OTPWatcher): The mailbox watcher delivering the OTPs of every tenant.
+    scheduler (Scheduler): The scheduler running the cycle, for its rate limit and shutdown signal.
 
     Returns:
     None
 
     The function performs the following steps:
-    1. Logs in to the email account using the `login()` function.
-    2. Initializes an empty list `results_list` to store the results.
-    3. Processes the `values` into batches of 20 using the `process_batches()` function.
-    4. Iterates over each batch and performs the following steps:
-        - Calls the `start_submission()` function to navigate to the web page and click on the registration button.
-        - Initializes an empty dictionary `result` to store the batch and feedback ID.
-        - Retrieves the current time in UTC.
-        - Extracts the phone numbers from the current batch.
-        - Calls the `fill_form()` function to fill the form with the phone numbers, current time, and email.
-        - Stores the feedback ID in the `result` dictionary.
-        - Prints the `result` dictionary.
-        - Waits for 1 second before proceeding with the next batch.
-    5. Closes the WebDriver after the task is done using the `logout()` and `driver.quit()` functions.
-    6. Prints a separator line.
-    7. Saves the `results_list` into csv
+    1. Plans the batches of every tenant (`plan_batches()`): drops the invalid and duplicated DID's
+       (`dids.DIDFilter`), recording them in its ledger, then packs the rest into full forms of 20 numbers
+       (`planner.BatchPlanner`), reporting the slot utilization.
+    2. Interleaves the batches of the tenants (`tenants.FairShare`), within their own rate limits,
+       so that a big sheet cannot hold the others back.
+    3. Hands every batch to the pool, where each worker waits for the global rate limit, records the batch
+       as in flight in the ledger of its tenant, calls `submit_batch()` with the form profile of the tenant
+       and records the outcome:
+        - Navigate to the web page and click on the registration button (`start_submission()`).
+        - Fill the form with the phone numbers and the company details of the tenant, ask for an OTP and
+          submit it (`fill_form()`), retried as its failures call for (`retry_engine`).
+        - Build the result rows (DID'S, STATUS, TIME, Feedback ID) of the batch.
+       The results of each batch are handed to the background writer of its tenant as soon as they are recorded.
+    4. Flushes the results not yet in the Google Sheets and waits for the writers to be done.
+
+    Every read of the cycle goes through one snapshot of each sheet (`snapshots`), checked against the
+    current revision of the sheet before every write.
+    """
+    from browser import form_values
+
+    snapshots.begin_cycle()
+
+    # Fetch, Validate & Batch
+    plans = {}
+    for tenant in tenants:
+        try:
+            plan = plan_batches(tenant)
+        except Exception as e:
+            logging.error(f'Could Not Plan The Batches Of {tenant.name} => {e}')
+            continue
+        if plan:
+            plans[tenant] = plan
+    if not plans:
+        return
+
+    # Submit
+    defaults = form_values()
+    share = FairShare(scheduler.stopping)
+
+    def run_batch(driver, job):
+        tenant, (index, batch) = job
+        _, total, _ = plans[tenant]
+        if not scheduler.throttle():
+            return None
+        batch_id = tenant.ledger.start_batch(batch)
+        # Every record logged while the batch runs carries its tenant, ID and size
+        with log_context(tenant=tenant.name, batch_id=batch_id, dids=len(batch)), \
+                span('batch', tenant=tenant.name, batch_id=batch_id, dids=len(batch)) as batch_span:
+            results = submit_batch(driver, index, batch, total, watcher, fields=tenant.fields(defaults), on_reject=tenant.ledger.reject)
+            if not results:
+                batch_span['status'] = 'error'
+        tenant.ledger.finish_batch(batch_id, results)
+        if results:
+            # Written to the sheet in the background, the worker goes on with the next batch
+            tenant.writer.notify()
+        return results
+
+    results, summary = pool.run(share.interleave({tenant: batches for tenant, (batches, _, _) in plans.items()}), run_batch)
+    summary['slots'] = {tenant.name: planner.report() for tenant, (_, _, planner) in plans.items()}
+    summary['tenants'] = share.served
+    summary['retries'] = retry_engine.report()
+    logging.info(f'Cycle Summary => {summary}')
+
+    # A stream the cycle stopped pulling from (e.g. on shutdown) must end its read of the sheet
+    for batches, _, _ in plans.values():
+        if hasattr(batches, 'close'):
+            batches.close()
+
+    # Sync the results the sheets do not have yet
+    for tenant in plans:
+        tenant.writer.notify()
+    for tenant in plans:
+        tenant.writer.drain()
+        if tenant.ledger.unsynced():
+            logging.error(f'Some Results Of {tenant.name} Could Not Be Written, Left For The Next Cycle')
+
+    if metrics_file:
+        metrics.write(metrics_file)
+
+
+def main(cycles=None):
+    """
+    This function sets up the bot (tenants, browsers, mail session and OTP watcher) and runs it
+    as a long-lived loop of cycles (`run_cycle()`) until it is asked to stop (SIGINT or SIGTERM).
+
+    Parameters:
+    cycles (int): The number of cycles to run, defaults to MAX_CYCLES (None to run until stopped).
+
+    Returns:
+    None
+
+    The interval between cycles, the submission rate limit and the number of cycles are read from
+    the CYCLE_INTERVAL, MAX_BATCHES_PER_MINUTE and MAX_CYCLES environment variables.
+    The tenants (TENANTS_FILE) share the browsers, the OTP watcher and the Google Sheets client.
+    Everything is closed once the loop exits.
+
+    Stage timings are traced to `traces.jsonl` next to the log file and exported in the Prometheus format
+    to METRICS_FILE and/or on METRICS_PORT.
     """
+    from browser import driver_setup
+    from fetch_email import OTPWatcher, get_session
+
+    metrics.configure(trace_path=os.path.join(subfolder, 'traces.jsonl'))
+    server = metrics.serve(metrics_port) if metrics_port else None
+    tenants = get_tenants()
+    for tenant in tenants:
+        logging.info(f'Ledger {tenant.name} => {tenant.open().counts()}')
+        tenant.writer = WriteBack(tenant.ledger, partial(write_results, tenant), window=writeback_window).start()
+    # The browsers are only started by the first batch of each worker
+    pool = SubmissionPool(lambda worker: driver_setup(driver_profile, worker), concurrency)
+    session = get_session()
+    watcher = OTPWatcher(session).start()
+    scheduler = Scheduler(
+        lambda: run_cycle(pool, tenants, watcher, scheduler),
+        interval=cycle_interval,
+        max_batches_per_minute=max_batches_per_minute,
+        max_cycles=cycles or max_cycles,
+    )
+    # Backoffs end and no retry starts once a shutdown is requested
+    retry_engine.stopping = scheduler.stopping
     try:
-        mail = login()
-        
-        results_list = []
-        
-        # Process values in batches of 20
-        batches = process_batches(values)
-        for index, batch in enumerate(batches):
-            # if batch
-            # logging.info(f'Processing Batch {index + 1}/{len(batches)}')
-            # pprint(batch)
-            phone_numbers = [row[0] for row in batch if len(row) == 1]
-            # print(phone_numbers)
-            if phone_numbers:
-                print(phone_numbers)
-                print(f'Processing Batch {index + 1}/{len(batches)}')
-                start_submission(driver)
-                # Get the current time in UTC
-                current_time = datetime.now(pytz.utc).replace(microsecond=0)
-                # print(batch)
-                feedback = fill_form(driver, phone_numbers, current_time, mail)
-                if feedback:
-                    for bat in batch:
-                        # Check if any part of the row contains '+00:00' and skip it if found
-                        if any('+00:00' in str(element) for element in bat):
-                            # print('00:00 found in bat...')
-                            continue
-
-                        # print(f'Bat => {bat}')
-                        result = {}
-                        result["DID'S"] = bat[0].replace("[", "").replace("]", "").replace("'", "").replace("'", '')
-                        result['STATUS'] = ""
-                        result['TIME'] = datetime.now(pytz.utc).replace(microsecond=0)
-                        result['Feedback ID'] = feedback
-                        results_list.append(result)
-
-                    logging.info(f'Batch {index + 1}/{len(batches)} Finished Successfully => Feedback ID => {feedback}')
-                    # Only Process 1st Batch
-                    break
-
-                else:
-                    logging.error(f'Batch {index + 1}/{len(batches)} RETURNED WITH AN ERROR!!!')
-                    continue
-                
-    except Exception as e:
-        print(f"error: {e}")
-        
+        scheduler.run()
     finally:
-        # Close the WebDriver & Mail Connection after the task is done
-        logout(mail)
+        # Close the WebDrivers & Mail Connection after the task is done
+        watcher.stop()
+        for tenant in tenants:
+            tenant.close()
+        pool.close()
+        session.close()
+        if server:
+            server.shutdown()
+        logging.info(f'Stage Timings => {metrics.summary()}')
+        logging.info(f'Retries => {retry_engine.report()}')
+        metrics.close()
         end_time = datetime.now(pytz.utc).replace(microsecond=0)
         logging.info(f'Driver Exited After Successful Run Of The BOT at => {end_time}!')
-        
-        # Convert results_list to a DataFrame and print it
-        if results_list:
-            df = pd.DataFrame(results_list)
-            # print(df)
-            
-            update_sheet_data(sheet_url, df)
-
-            logging.info('Results printed to the console')
-        else:
-            print('List is empty')
-            
-            df = pd.DataFrame(results_list)
-            # print(df)
-            
-            update_sheet_data(sheet_url, df, clear=True)
-            
-            json_response = get_sheet_data(sheet_id)
-    
-            if json_response:
-                # Extract the 'values' key from the response
-                values = json_response.get('values', [])
-                
-                if values:
-                    # Remove the header row if present
-                    values = values[1:]
-                
-                main(driver, values)
-            
-        driver.quit()
+
+
+def fetch_only():
+    """
+    Reads the Google Sheet of every tenant into its ledger and plans the batches, without submitting anything.
+
+    Returns:
+    dict: The batch plan (`planner.BatchPlanner.report()`), the ledger counts, the DID's left in flight
+          and the invalid DID's of every tenant.
+
+    Needs neither a browser, the mailbox nor the service account: a dry run of a cycle. The status of
+    the DID's is left alone: those left in flight are planned as the next run would requeue them, but
+    stay in flight, and the invalid ones are counted without being rejected.
+    """
+    from dids import DIDFilter
+
+    snapshots.begin_cycle()
+    plans = {}
+    for tenant in get_tenants():
+        ledger = tenant.open()
+        try:
+            sync_sheet(tenant.sheet_id, ledger)
+            counts = ledger.counts()
+            dids = DIDFilter()
+            planner = BatchPlanner()
+            for batch in planner.pack(dids.filter(ledger.pending(in_flight=True))):
+                pass
+            invalid = {reason: count for reason, count in dids.stats.items() if reason not in ('checked', 'valid', 'repeated')}
+            plans[tenant.name] = {
+                'plan': planner.report(), 'ledger': counts, 'in_flight': counts.get('in_flight', 0), 'invalid': invalid,
+            }
+        finally:
+            tenant.close()
+    return plans
+
+
+def sync_results():
+    """
+    Writes the results of the ledgers the Google Sheets do not have yet, e.g. after a crashed run.
+
+    Returns:
+    bool: True if nothing is left to write, False if the write kept failing for a tenant.
+    """
+    snapshots.begin_cycle()
+    synced = True
+    for tenant in get_tenants():
+        ledger = tenant.open()
+        try:
+            logging.info(f'{len(ledger.unsynced())} Result(s) To Write ({tenant.name})')
+            synced = WriteBack(ledger, partial(write_results, tenant)).flush() and synced
+        finally:
+            tenant.close()
+    return synced
+
+
+def otp_test():
+    """
+    Checks the mailbox: logs in, sends a NOOP and waits for an OTP sent from now on.
+
+    Returns:
+    str: The OTP, None if none arrived.
+    """
+    from fetch_email import get_session, wait_for_otp
+
+    session = get_session()
+    try:
+        print(f"Mail Connection => {'OK' if session.check() else 'Reconnected'}")
+        return wait_for_otp(session.mail, datetime.now(pytz.utc).replace(microsecond=0))
+    finally:
+        session.close()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Registers the DIDs of a Google Sheet through the TNS form.')
+    commands = parser.add_subparsers(dest='command')
+    submit = commands.add_parser('submit', help='run the bot (default)')
+    submit.add_argument('--cycles', type=int, help='number of cycles to run (default: MAX_CYCLES, or until stopped)')
+    commands.add_parser('fetch-only', help='read the sheet into the ledger and plan the batches, submit nothing')
+    commands.add_parser('sync', help='write the results the sheet does not have yet')
+    commands.add_parser('otp-test', help='check the mailbox and wait for an OTP')
+    args = parser.parse_args(argv)
+    args.command = args.command or 'submit'
+    return args
+
 
 if __name__ == "__main__":
     '''
-        Sheet ID is stored in Sheet URL
+        Sheet ID is stored in Sheet URL, set through the SHEET_ID environment variable (or per tenant in TENANTS_FILE)
         The Pattern of Sheet URL is: https://docs.google.com/spreadsheets/d/{sheet_id}/edit?gid=0#gid=0
         e.g. https://docs.google.com/spreadsheets/d/1YyrMfGEl2KioO90rcKYuqFrzJhMblJsTmOyxvYhZtvo/edit?gid=0#gid=0
+
+        Commands load only what they need: `fetch-only` never imports Selenium nor logs in to Google or the mailbox.
     '''
+    args = parse_args()
+    setup_logging()
     start_time = datetime.now(pytz.utc).replace(microsecond=0)
-    logging.info(f'Bot Run Started at => {start_time}')
-    sheet_id = "1YyrMfGEl2KioO90rcKYuqFrzJhMblJsTmOyxvYhZtvo"
-    sheet_url = "https://docs.google.com/spreadsheets/d/1YyrMfGEl2KioO90rcKYuqFrzJhMblJsTmOyxvYhZtvo/edit?gid=0#gid=0"
-    json_response = get_sheet_data(sheet_id)
-    
-    if json_response:
-        # Extract the 'values' key from the response
-        values = json_response.get('values', [])
-        
-        if values:
-            # Remove the header row if present
-            values = values[1:]
-        
-        driver = driver_setup()
-        main(driver, values)
+    logging.info(f'Bot Run Started at => {start_time} ({args.command})')
+    if args.command == 'fetch-only':
+        print(f'Fetch Only => {fetch_only()}')
+    elif args.command == 'sync':
+        print('Results Synced' if sync_results() else 'Some Results Could Not Be Written')
+    elif args.command == 'otp-test':
+        otp = otp_test()
+        print(otp if otp else 'No OTP received')
+    else:
+        main(getattr(args, 'cycles', None))
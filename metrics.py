@@ -0,0 +1,213 @@
+import json
+import logging
+import os
+import threading
+import uuid
+from contextlib import contextmanager
+from time import perf_counter, time
+
+# Upper bounds (seconds) of the buckets of the stage histograms
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# Name of the Prometheus metric holding the stage histograms
+METRIC = 'did_bot_stage_seconds'
+
+
+class Histogram:
+    """
+    A cumulative histogram of durations, in the Prometheus sense.
+
+    Parameters:
+    buckets (tuple): The upper bounds of the buckets, in seconds.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.count += 1
+        self.sum += seconds
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                self.counts[i] += 1
+
+    def quantile(self, q):
+        """
+        Estimates a quantile from the buckets (the upper bound of the bucket it falls in), None if empty.
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        for bound, count in zip(self.buckets, self.counts):
+            if count >= rank:
+                return bound
+        return float('inf')
+
+
+class Metrics:
+    """
+    Times the stages of the bot (page load, form fill, OTP wait, sheet sync, ...) as nested spans.
+
+    Parameters:
+    buckets (tuple): The upper bounds of the histogram buckets, in seconds.
+
+    Every span is observed in the histogram of its stage and outcome (`ok` or `error`), exported in the
+    Prometheus text format (`render()`, `write()`, `serve()`), and written as one JSON line to the trace
+    file, if any (`configure()`). Spans opened inside another span of the same thread share its trace ID.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.histograms = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.trace_file = None
+
+    def configure(self, trace_path=None):
+        """
+        Sets the JSON-lines file the spans are appended to, None to stop writing traces.
+        """
+        with self.lock:
+            if self.trace_file:
+                self.trace_file.close()
+            self.trace_file = None
+            if trace_path:
+                os.makedirs(os.path.dirname(trace_path) or '.', exist_ok=True)
+                self.trace_file = open(trace_path, 'a', buffering=1)
+
+    def close(self):
+        self.configure(None)
+
+    @contextmanager
+    def span(self, stage, **attributes):
+        """
+        Times the block it wraps as a span of the given stage.
+
+        Parameters:
+        stage (str): The name of the stage.
+        **attributes: Extra fields written to the trace (batch label, number of DID's, ...).
+
+        Yields:
+        dict: The span. Setting its `status` to 'error' marks it as failed without raising.
+        """
+        stack = self.local.__dict__.setdefault('stack', [])
+        parent = stack[-1] if stack else None
+        span = {
+            'trace': parent['trace'] if parent else uuid.uuid4().hex[:16],
+            'span': uuid.uuid4().hex[:8],
+            'parent': parent['span'] if parent else None,
+            'stage': stage,
+            'status': 'ok',
+            **attributes,
+        }
+        stack.append(span)
+        started, start = time(), perf_counter()
+        try:
+            yield span
+        except BaseException as e:
+            span['status'] = 'error'
+            span['error'] = str(e)[:200]
+            raise
+        finally:
+            stack.pop()
+            duration = perf_counter() - start
+            self.observe(stage, duration, span['status'])
+            self.trace({**span, 'start': round(started, 3), 'duration_ms': round(duration * 1000, 1)})
+
+    def observe(self, stage, seconds, status='ok'):
+        """
+        Records a duration in the histogram of a stage.
+        """
+        with self.lock:
+            histogram = self.histograms.get((stage, status))
+            if histogram is None:
+                histogram = self.histograms[(stage, status)] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    def trace(self, record):
+        with self.lock:
+            if self.trace_file:
+                try:
+                    self.trace_file.write(json.dumps(record, default=str) + '\n')
+                except (OSError, ValueError) as e:
+                    logging.error(f'Could Not Write Trace => {e}')
+
+    def summary(self):
+        """
+        Returns the count, mean, p50 and p95 (in seconds) of every stage and outcome.
+        """
+        with self.lock:
+            return {
+                f'{stage}/{status}': {
+                    'count': histogram.count,
+                    'mean': round(histogram.sum / histogram.count, 3),
+                    'p50': histogram.quantile(0.5),
+                    'p95': histogram.quantile(0.95),
+                }
+                for (stage, status), histogram in sorted(self.histograms.items())
+            }
+
+    def render(self):
+        """
+        Renders every histogram in the Prometheus text exposition format.
+
+        Returns:
+        str: The metrics text.
+        """
+        lines = [f"# HELP {METRIC} Duration of the bot's stages.", f'# TYPE {METRIC} histogram']
+        with self.lock:
+            for (stage, status), histogram in sorted(self.histograms.items()):
+                labels = f'stage="{stage}",status="{status}"'
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    lines.append(f'{METRIC}_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f'{METRIC}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+                lines.append(f'{METRIC}_sum{{{labels}}} {histogram.sum:.6f}')
+                lines.append(f'{METRIC}_count{{{labels}}} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """
+        Writes the metrics text to a file, e.g. for the textfile collector of the Prometheus node exporter.
+        """
+        with open(path + '.tmp', 'w') as file:
+            file.write(self.render())
+        os.replace(path + '.tmp', path)
+
+    def serve(self, port, host='0.0.0.0'):
+        """
+        Serves the metrics text on http://host:port/metrics from a background thread.
+
+        Returns:
+        ThreadingHTTPServer: The server, to be shut down with `shutdown()`.
+        """
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+        logging.info(f'Serving Metrics on http://{host}:{port}/metrics')
+        return server
+
+
+# The metrics shared by every module of the bot
+metrics = Metrics()
+span = metrics.span
@@ -0,0 +1,65 @@
+import logging
+
+# Number of phone numbers a single form accepts
+FORM_SLOTS = 20
+
+
+class BatchPlanner:
+    """
+    Packs pending DID's into forms of 20 numbers and reports how well the form slots are used.
+
+    Parameters:
+    size (int): The number of phone numbers per form.
+
+    The rows given to `pack()` must already be filtered (pending, valid and unique DID's) and sorted
+    by priority, e.g. by `JobLedger.pending()`: every form is then full, except the last one of a run.
+    """
+
+    def __init__(self, size=FORM_SLOTS):
+        self.size = size
+        self.forms = 0
+        self.dids = 0
+
+    def pack(self, rows):
+        """
+        Packs rows into full forms, lazily.
+
+        Parameters:
+        rows (iterable): The rows to be submitted, a list or rows still being downloaded.
+
+        Yields:
+        list: A batch of `size` rows, as soon as it is complete. Only the last batch may hold fewer rows.
+        """
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == self.size:
+                yield self._planned(batch)
+                batch = []
+        if batch:
+            yield self._planned(batch)
+        report = self.report()
+        logging.info(
+            f"Batch Plan => {report['forms']} Form(s) for {report['dids']} DID(s), "
+            f"{report['dids']}/{report['slots']} Slots Used ({report['utilization']:.1%})"
+        )
+
+    def _planned(self, batch):
+        self.forms += 1
+        self.dids += len(batch)
+        return batch
+
+    def report(self):
+        """
+        Returns the slot utilization of the batches packed so far.
+
+        Returns:
+        dict: The number of `forms` and `dids`, the number of form `slots` and their `utilization` (0 to 1).
+        """
+        slots = self.forms * self.size
+        return {
+            'forms': self.forms,
+            'dids': self.dids,
+            'slots': slots,
+            'utilization': self.dids / slots if slots else 0.0,
+        }
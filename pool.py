@@ -0,0 +1,124 @@
+import logging
+import threading
+from queue import Queue
+from time import perf_counter
+
+
+class SubmissionPool:
+    """
+    A pool of worker threads, each owning its own WebDriver, pulling batches from a shared queue.
+
+    Parameters:
+    driver_factory (callable): Builds a new WebDriver for the worker index it is called with, e.g. `driver_setup`.
+    concurrency (int): The number of workers (and browsers) to run in parallel.
+
+    Drivers are created lazily by their worker and kept across runs until `close()` is called.
+    A failing batch only affects its own worker: the error is logged, the batch is counted as
+    failed and the worker replaces its driver if the browser is no longer responding.
+    """
+
+    def __init__(self, driver_factory, concurrency=1):
+        self.driver_factory = driver_factory
+        self.concurrency = max(1, int(concurrency))
+        self.drivers = [None] * self.concurrency
+        self.lock = threading.Lock()
+
+    def _driver(self, worker):
+        """
+        Returns the driver of a worker, (re)creating it if it is missing or no longer responding.
+        """
+        driver = self.drivers[worker]
+        if driver is not None:
+            try:
+                driver.current_url
+                return driver
+            except Exception as e:
+                logging.error(f'Worker {worker + 1}: Driver Not Responding, Replacing It => {e}')
+                try:
+                    driver.quit()
+                except Exception:
+                    pass
+        driver = self.driver_factory(worker)
+        self.drivers[worker] = driver
+        return driver
+
+    def _work(self, worker, jobs, submit, results, stats):
+        while True:
+            item = jobs.get()
+            if item is None:
+                return
+            position, job = item
+            try:
+                result = submit(self._driver(worker), job)
+            except Exception as e:
+                logging.error(f'Worker {worker + 1}: Batch Failed => {e}')
+                result = None
+            with self.lock:
+                results[position] = result
+                stats['succeeded' if result else 'failed'] += 1
+
+    def _feed(self, jobs, queue, workers, stats):
+        try:
+            for position, job in enumerate(jobs):
+                queue.put((position, job))
+                stats['batches'] += 1
+        except Exception as e:
+            logging.error(f'Could Not Produce More Batches => {e}')
+        finally:
+            # One stop marker per worker
+            for _ in range(workers):
+                queue.put(None)
+
+    def run(self, jobs, submit):
+        """
+        Runs every job through `submit` on the pool's drivers and waits for all of them to finish.
+
+        Parameters:
+        jobs (iterable): The jobs (batches) to be processed. A generator is consumed lazily,
+                         so workers start on the first jobs while the next ones are still produced.
+        submit (callable): Called as `submit(driver, job)`, returns the result of the job or None on failure.
+
+        Returns:
+        tuple: The list of results, in the order of `jobs`, and a summary dict with the number of
+               `batches`, `succeeded` and `failed` jobs, the `workers` used, the `elapsed` seconds
+               and the `batches_per_minute`.
+        """
+        workers = min(self.concurrency, len(jobs)) if hasattr(jobs, '__len__') else self.concurrency
+        queue = Queue(maxsize=2 * self.concurrency)
+        results = {}
+        stats = {'batches': 0, 'succeeded': 0, 'failed': 0}
+        start = perf_counter()
+
+        threads = [
+            threading.Thread(target=self._work, args=(worker, queue, submit, results, stats), name=f'submission-worker-{worker + 1}')
+            for worker in range(workers)
+        ]
+        for thread in threads:
+            thread.start()
+        self._feed(jobs, queue, workers, stats)
+        for thread in threads:
+            thread.join()
+
+        elapsed = perf_counter() - start
+        summary = {
+            'batches': stats['batches'],
+            'succeeded': stats['succeeded'],
+            'failed': stats['failed'],
+            'workers': workers,
+            'elapsed': round(elapsed, 2),
+            'batches_per_minute': round(stats['succeeded'] / elapsed * 60, 2) if elapsed else 0.0,
+        }
+        logging.info(f"Run Summary => {summary['succeeded']}/{summary['batches']} Batches on {workers} Worker(s) in {summary['elapsed']}s ({summary['batches_per_minute']} Batches/Minute)")
+        return [results.get(position) for position in range(stats['batches'])], summary
+
+    def close(self):
+        """
+        Quits every driver owned by the pool.
+        """
+        for worker, driver in enumerate(self.drivers):
+            if driver is not None:
+                try:
+                    driver.quit()
+                except Exception as e:
+                    logging.error(f'Worker {worker + 1}: Could Not Quit Driver => {e}')
+                self.drivers[worker] = None
@@ -0,0 +1,255 @@
+import logging
+import os
+import re
+import threading
+from collections import deque
+from time import monotonic, perf_counter
+from metrics import metrics
+
+# Failure classes of a form submission
+PAGE_LOAD = 'page_load'  # The form page did not load
+ELEMENT_TIMEOUT = 'element_timeout'  # A field or button of the form did not show up (or could not be used)
+OTP_TIMEOUT = 'otp_timeout'  # No usable OTP: none arrived in time, or the form refused it
+REJECTED_NUMBER = 'rejected_number'  # The form refused one or more of the phone numbers
+SUBMIT_TIMEOUT = 'submit_timeout'  # Neither a feedback ID nor an error showed up after the submit
+UNKNOWN = 'unknown'
+
+# Retries allowed for each failure class within a batch and seconds before the first of them (doubled after each)
+POLICIES = {
+    PAGE_LOAD: {'retries': 3, 'backoff': 5.0},
+    ELEMENT_TIMEOUT: {'retries': 2, 'backoff': 2.0},
+    OTP_TIMEOUT: {'retries': 2, 'backoff': 0.0},
+    SUBMIT_TIMEOUT: {'retries': 2, 'backoff': 1.0},
+    UNKNOWN: {'retries': 1, 'backoff': 2.0},
+}
+
+# Seconds an OTP stays usable, so a retry on the same page submits it again instead of asking for a new one
+otp_ttl = float(os.getenv('OTP_TTL', 300))
+
+# Reason recorded in the ledger for the DID's the form refused, see `JobLedger.reject()`
+FORM_REJECTED = 'form_rejected'
+
+
+class SubmitError(Exception):
+    """
+    A failed submission attempt, classified.
+
+    Parameters:
+    kind (str): The failure class, e.g. `OTP_TIMEOUT`.
+    message (str): What went wrong.
+    rejected (list): The phone numbers the form named as refused, if it did.
+    """
+
+    def __init__(self, kind, message='', rejected=()):
+        super().__init__(f'{kind}: {message}' if message else kind)
+        self.kind = kind
+        self.rejected = list(rejected)
+
+
+class Progress:
+    """
+    What the previous attempts at a group of DID's left on the page, so a retry resumes from there.
+
+    `filled` is set once the form holds the numbers, `otp` once a code was received for it.
+    A failure that leaves the page unusable calls `reset()`: the next attempt reloads and fills it again.
+    """
+
+    def __init__(self):
+        self.filled = False
+        self.otp = None
+        self.otp_at = None
+
+    def received(self, otp):
+        self.otp, self.otp_at = otp, monotonic()
+
+    def usable_otp(self):
+        """
+        Returns the OTP received for the page if it is still fresh, None otherwise.
+        """
+        if self.otp and monotonic() - self.otp_at < otp_ttl:
+            return self.otp
+        return None
+
+    def reset(self):
+        self.filled = False
+        self.otp = self.otp_at = None
+
+
+class RetryEngine:
+    """
+    Submits batches with retries suited to each failure class, salvaging what a failure does not concern.
+
+    Parameters:
+    policies (dict): The retries and backoff of every failure class, see `POLICIES`.
+    stopping (threading.Event): Set when a shutdown is requested, cuts the backoffs short and stops retrying.
+
+    Per failure class:
+    - page load, element and unknown failures reload and fill the form again after the backoff,
+    - an OTP timeout asks for a new code on the page already filled,
+    - a submit timeout submits the page again with the same OTP, while it is fresh (OTP_TTL),
+    - a rejected number drops the DID's the form named (by number or by their field), and the other
+      DID's of the batch go through on a new form. When the form refuses a number without naming it, the
+      batch is split in halves until the refused DID is alone. An error naming another number (e.g. the
+      contact phone) is retried as unknown.
+
+    The time of every failed attempt is counted as wasted work (`report()`, and the `wasted_work`
+    stage of the metrics, labelled with its failure class).
+    """
+
+    def __init__(self, policies=None, stopping=None):
+        self.policies = {**POLICIES, **(policies or {})}
+        self.stopping = stopping or threading.Event()
+        self.lock = threading.Lock()
+        self.stats = {
+            'attempts': 0, 'failures': {}, 'wasted_seconds': 0.0, 'useful_seconds': 0.0,
+            'otps_reused': 0, 'splits': 0, 'dids_done': 0, 'dids_salvaged': 0, 'dids_rejected': 0, 'dids_failed': 0,
+        }
+
+    def _count(self, **counts):
+        with self.lock:
+            for key, value in counts.items():
+                self.stats[key] += value
+
+    def _failed(self, kind, seconds):
+        with self.lock:
+            self.stats['failures'][kind] = self.stats['failures'].get(kind, 0) + 1
+            self.stats['wasted_seconds'] += seconds
+        metrics.observe('wasted_work', seconds, kind)
+
+    def run(self, rows, attempt):
+        """
+        Submits a batch, retrying it, splitting it and dropping its refused DID's as its failures call for.
+
+        Parameters:
+        rows (list): The rows of the batch, each holding a DID.
+        attempt (callable): Called as `attempt(rows, progress)`: submits the rows through the form,
+                            resuming from `progress` (`Progress`), and returns the feedback ID.
+                            Raises a `SubmitError` when it fails.
+
+        Returns:
+        tuple: The (rows, feedback ID) groups submitted, and the (raw value, reason) pairs of the
+               DID's the form refused. The other DID's of the batch failed and stay pending.
+        """
+        done, rejected = [], []
+        groups = deque([rows])
+        failed_once = False
+        while groups:
+            group = groups.popleft()
+            retries, progress = {}, Progress()
+            while True:
+                if self.stopping.is_set():
+                    self._count(dids_failed=len(group))
+                    break
+                start = perf_counter()
+                if progress.filled and progress.usable_otp():
+                    self._count(otps_reused=1)
+                try:
+                    feedback = attempt(group, progress)
+                except SubmitError as e:
+                    error = e
+                except Exception as e:
+                    error = SubmitError(UNKNOWN, str(e))
+                else:
+                    elapsed = perf_counter() - start
+                    done.append((group, feedback))
+                    self._count(attempts=1, useful_seconds=elapsed, dids_done=len(group))
+                    if failed_once:
+                        self._count(dids_salvaged=len(group))
+                    break
+
+                failed_once = True
+                self._count(attempts=1)
+                self._failed(error.kind, perf_counter() - start)
+                logging.error(f'Attempt Failed ({len(group)} DID(s)) => {error}')
+
+                bad = []
+                if error.kind == REJECTED_NUMBER:
+                    named = {_digits(number) for number in error.rejected}
+                    bad = [row for row in group if _digits(row[0]) in named]
+                if bad:
+                    # The form named the refused DID's: drop them, submit the rest on a new form
+                    rejected += [(row[0], FORM_REJECTED) for row in bad]
+                    rest = [row for row in group if row not in bad]
+                    if rest:
+                        groups.appendleft(rest)
+                    break
+                if error.kind == REJECTED_NUMBER and not error.rejected:
+                    # The form refused a number without naming it: isolate it, each half on its own form
+                    if len(group) == 1:
+                        rejected.append((group[0][0], FORM_REJECTED))
+                    else:
+                        half = len(group) // 2
+                        groups.extendleft([group[half:], group[:half]])
+                        self._count(splits=1)
+                    break
+                if error.kind == REJECTED_NUMBER:
+                    # The numbers named are not on the form: no DID is rejected on a guess
+                    error.kind = UNKNOWN
+
+                policy = self.policies.get(error.kind, self.policies[UNKNOWN])
+                retries[error.kind] = retries.get(error.kind, 0) + 1
+                if retries[error.kind] > policy['retries']:
+                    logging.error(f'Giving Up On {len(group)} DID(s) After {retries[error.kind] - 1} {error.kind} Retries')
+                    self._count(dids_failed=len(group))
+                    break
+                if error.kind == OTP_TIMEOUT:
+                    # The form is still filled: only a new code is needed
+                    progress.otp = None
+                elif error.kind != SUBMIT_TIMEOUT:
+                    progress.reset()
+                self.stopping.wait(policy['backoff'] * 2 ** (retries[error.kind] - 1))
+
+        self._count(dids_rejected=len(rejected))
+        return done, rejected
+
+    def report(self):
+        """
+        Returns the counters of the engine and the share of the form time wasted on failed attempts.
+
+        Returns:
+        dict: The counters, `wasted_share` (0 to 1) and the `effective_dids_per_hour` of the form time.
+        """
+        with self.lock:
+            report = {**self.stats, 'failures': dict(self.stats['failures'])}
+        spent = report['wasted_seconds'] + report['useful_seconds']
+        report['wasted_seconds'] = round(report['wasted_seconds'], 2)
+        report['useful_seconds'] = round(report['useful_seconds'], 2)
+        report['wasted_share'] = round(report['wasted_seconds'] / spent, 3) if spent else 0.0
+        report['effective_dids_per_hour'] = round(report['dids_done'] / spent * 3600) if spent else 0
+        return report
+
+
+def form_error(message, phone_numbers, fields=()):
+    """
+    Classifies the error a form showed after a submit.
+
+    Parameters:
+    message (str): The error shown by the form.
+    phone_numbers (list): The phone numbers of the form, in the order of their fields.
+    fields (list): The IDs of the fields the form marked as invalid, if any.
+
+    Returns:
+    SubmitError: The failure. A rejected number when the message names phone numbers of the form
+                 or the form marked their `enterprise_phone_*` fields, which are then listed as refused,
+                 or when it refuses a phone number without naming any (none listed). Errors about other
+                 fields or naming another number (e.g. the contact phone) are not rejected numbers.
+    """
+    numbers = re.findall(r'\d[\d\s().-]{8,}\d', message)
+    named = {_digits(number) for number in numbers}
+    refused = [number for number in phone_numbers if _digits(number) in named]
+    for field in list(fields) + re.findall(r'enterprise_phone_\d+', message):
+        index = int(field.rsplit('_', 1)[-1]) if re.fullmatch(r'enterprise_phone_\d+', field) else None
+        if index is not None and index < len(phone_numbers) and phone_numbers[index] not in refused:
+            refused.append(phone_numbers[index])
+    if refused:
+        return SubmitError(REJECTED_NUMBER, message, refused)
+    if re.search(r'verification code|one[- ]time|\botp\b|captcha', message, re.I):
+        return SubmitError(OTP_TIMEOUT, message)
+    if not numbers and re.search(r'\bnumbers?\b', message, re.I) and not re.search(r'contact', message, re.I):
+        # e.g. 'One of the phone numbers cannot be registered.'
+        return SubmitError(REJECTED_NUMBER, message)
+    return SubmitError(UNKNOWN, message)
+
+
+def _digits(value):
+    return ''.join(character for character in str(value) if character.isdigit())[-10:]
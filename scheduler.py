@@ -0,0 +1,75 @@
+import logging
+import signal
+import threading
+from time import monotonic
+
+
+class Scheduler:
+    """
+    Runs the bot as a long-lived loop of cycles instead of re-entering `main()` recursively.
+
+    Parameters:
+    cycle (callable): Runs one cycle (fetch, batch, submit, sync). Called with no argument.
+    interval (float): The minimum number of seconds between the start of two cycles.
+    max_batches_per_minute (float): The submission rate limit shared by every worker, 0 for none.
+    max_cycles (int): Stops after that many cycles, None to run until stopped.
+
+    SIGINT and SIGTERM request a graceful shutdown: the batches already submitting finish,
+    the rest of the cycle is skipped and the loop exits.
+    """
+
+    def __init__(self, cycle, interval=60, max_batches_per_minute=0, max_cycles=None):
+        self.cycle = cycle
+        self.interval = interval
+        self.max_batches_per_minute = max_batches_per_minute
+        self.max_cycles = max_cycles
+        self.stopping = threading.Event()
+        self.lock = threading.Lock()
+        self.next_slot = monotonic()
+        self.cycles = 0
+
+    def stop(self, *args):
+        """
+        Requests a graceful shutdown.
+        """
+        if not self.stopping.is_set():
+            logging.info('Shutdown Requested, Finishing The Current Batches')
+        self.stopping.set()
+
+    def throttle(self):
+        """
+        Waits for the next submission slot allowed by the rate limit.
+
+        Returns:
+        bool: True if a batch may be submitted, False if a shutdown was requested meanwhile.
+        """
+        if self.max_batches_per_minute:
+            with self.lock:
+                slot = max(self.next_slot, monotonic())
+                self.next_slot = slot + 60 / self.max_batches_per_minute
+            self.stopping.wait(max(0, slot - monotonic()))
+        return not self.stopping.is_set()
+
+    def run(self):
+        """
+        Runs cycles until a shutdown is requested (or `max_cycles` is reached).
+
+        Returns:
+        None
+        """
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGINT, self.stop)
+            signal.signal(signal.SIGTERM, self.stop)
+
+        while not self.stopping.is_set():
+            start = monotonic()
+            self.cycles += 1
+            try:
+                self.cycle()
+            except Exception as e:
+                logging.error(f'Cycle {self.cycles} Failed => {e}')
+            if self.max_cycles and self.cycles >= self.max_cycles:
+                break
+            self.stopping.wait(max(0, self.interval - (monotonic() - start)))
+
+        logging.info(f'Scheduler Stopped After {self.cycles} Cycle(s)')
@@ -0,0 +1,334 @@
+import logging
+import re
+
+# Column holding the DID in the Google Sheet
+DID_COLUMN = "DID'S"
+
+# Base URL of the Google Sheets values API
+SHEETS_API = 'https://sheets.googleapis.com/v4/spreadsheets'
+
+# Connect and read timeouts of the Sheets API requests
+TIMEOUT = (5, 30)
+
+# Characters left around DID's by the sheet and by `str(list)`
+DID_NOISE = r"[\[\]'\"]"
+
+
+def normalize_did(value):
+    """
+    Normalizes a single DID into its comparable key, the same way `normalize_dids()` does.
+
+    Parameters:
+    value: The raw DID value.
+
+    Returns:
+    str: The normalized key.
+    """
+    return re.sub(DID_NOISE, '', str(value)).strip().lower()
+
+
+def normalize_dids(series):
+    """
+    Normalizes a column of DID's into comparable keys in one vectorized pass.
+
+    Parameters:
+    series (pandas.Series): The raw DID values as read from the sheet or produced by a run.
+
+    Returns:
+    pandas.Series: The normalized keys (stripped of brackets, quotes and whitespace, lowercased).
+    """
+    return (
+        series.astype(str)
+        .str.replace(DID_NOISE, '', regex=True)
+        .str.strip()
+        .str.lower()
+    )
+
+
+def merge_results(existing_data, df):
+    """
+    Merges the rows of a run into the existing sheet data, keyed on the normalized DID.
+
+    Parameters:
+    existing_data (pandas.DataFrame): The data currently in the sheet.
+    df (pandas.DataFrame): The new rows, one per DID, to be written over the matching sheet rows.
+
+    Returns:
+    tuple: The merged DataFrame and a report dict with the number of `matched` sheet rows,
+           `unmatched` new rows (no row in the sheet) and `duplicated` new rows (same DID given twice).
+
+    Every existing row whose DID matches a new row is overwritten with the values of that row,
+    for the columns both frames share. When a DID appears twice in `df` the first one wins.
+    The work is a single index lookup per frame, so it scales linearly with the sheet size.
+    """
+    import pandas as pd
+
+    report = {'matched': 0, 'unmatched': 0, 'duplicated': 0}
+    if existing_data.empty or df.empty:
+        report['unmatched'] = len(df)
+        return existing_data, report
+
+    # Index the new rows by their normalized DID, keeping the first occurrence
+    new_keys = normalize_dids(df[DID_COLUMN])
+    duplicated = new_keys.duplicated(keep='first')
+    report['duplicated'] = int(duplicated.sum())
+    new_rows = df.loc[~duplicated.to_numpy()]
+    new_index = pd.Index(new_keys[~duplicated])
+
+    # Look up every existing row in the index of new rows
+    existing_keys = normalize_dids(existing_data[DID_COLUMN])
+    positions = new_index.get_indexer(existing_keys)
+    matched = positions >= 0
+    report['matched'] = int(matched.sum())
+    report['unmatched'] = int((pd.Index(existing_keys.unique()).get_indexer(new_index) < 0).sum())
+
+    if matched.any():
+        columns = [column for column in df.columns if column in existing_data.columns]
+        merged = existing_data.copy()
+        # Columns receiving new values may change dtype (e.g. TIME going from '' to a timestamp)
+        merged[columns] = merged[columns].astype(object)
+        updates = new_rows[columns].to_numpy()[positions[matched]]
+        merged.loc[matched, columns] = updates
+        existing_data = merged
+
+    return existing_data, report
+
+
+def clear_results(existing_data):
+    """
+    Clears the 'TIME' and 'Feedback ID' columns of the sheet data, once all DID's were done.
+
+    Parameters:
+    existing_data (pandas.DataFrame): The data currently in the sheet.
+
+    Returns:
+    pandas.DataFrame: A copy of the data with the result columns emptied.
+    """
+    import pandas as pd
+
+    existing_data = existing_data.copy()
+    if 'TIME' in existing_data.columns:
+        existing_data['TIME'] = pd.NA
+        logging.info('Time Cleared')
+    if 'Feedback ID' in existing_data.columns:
+        existing_data['Feedback ID'] = pd.NA
+        logging.info('Feedback ID Cleared')
+    return existing_data
+
+
+def render_values(df):
+    """
+    Renders a DataFrame into the cell values Google Sheets would hold for it, header row first.
+
+    Parameters:
+    df (pandas.DataFrame): The data to be rendered.
+
+    Returns:
+    list: A list of rows, each a list of cell strings. Missing values render as empty cells.
+    """
+    rows = df.astype(object).where(df.notna(), '').to_numpy().tolist()
+    return [[str(column) for column in df.columns]] + [[str(value) for value in row] for row in rows]
+
+
+def column_letter(col):
+    """
+    Converts a 1-based column number into its A1 letters (1 => A, 27 => AA).
+
+    Parameters:
+    col (int): The 1-based column number.
+
+    Returns:
+    str: The column letters.
+    """
+    letters = ''
+    while col:
+        col, remainder = divmod(col - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+
+def diff_cells(old_values, new_values):
+    """
+    Computes the cells that differ between two grids of sheet values.
+
+    Parameters:
+    old_values (list): The rows currently in the sheet, as returned by `worksheet.get_all_values()`.
+    new_values (list): The rows the sheet should hold.
+
+    Returns:
+    list: A list of (row, col, value) tuples, 1-based, sorted by row then column.
+          Cells present only in `old_values` are emptied.
+    """
+    cells = []
+    for r in range(max(len(old_values), len(new_values))):
+        old_row = old_values[r] if r < len(old_values) else []
+        new_row = new_values[r] if r < len(new_values) else []
+        for c in range(max(len(old_row), len(new_row))):
+            old = old_row[c] if c < len(old_row) else ''
+            new = new_row[c] if c < len(new_row) else ''
+            if old != new:
+                cells.append((r + 1, c + 1, new))
+    return cells
+
+
+def coalesce_ranges(cells):
+    """
+    Groups changed cells into contiguous rectangular ranges.
+
+    Parameters:
+    cells (list): The (row, col, value) tuples as returned by `diff_cells()`.
+
+    Returns:
+    list: A list of {'range': 'C2:D4', 'values': [[...], ...]} dicts, ready for `worksheet.batch_update()`.
+
+    Consecutive columns of a row are joined into a run first, then runs covering the same
+    columns on consecutive rows are stacked into one rectangle.
+    """
+    # Join consecutive columns of the same row into runs
+    runs = []
+    for row, col, value in cells:
+        if runs and runs[-1][0] == row and runs[-1][2] == col - 1:
+            runs[-1][2] = col
+            runs[-1][3].append(value)
+        else:
+            runs.append([row, col, col, [value]])
+
+    # Stack runs spanning the same columns on consecutive rows
+    blocks = []
+    open_blocks = {}
+    for row, first, last, values in runs:
+        block = open_blocks.get((first, last))
+        if block and block['last_row'] == row - 1:
+            block['last_row'] = row
+            block['values'].append(values)
+        else:
+            block = {'first_row': row, 'last_row': row, 'first': first, 'last': last, 'values': [values]}
+            open_blocks[(first, last)] = block
+            blocks.append(block)
+
+    return [
+        {
+            'range': f"{column_letter(b['first'])}{b['first_row']}:{column_letter(b['last'])}{b['last_row']}",
+            'values': b['values'],
+        }
+        for b in blocks
+    ]
+
+
+def column_matches(column, values, col=1):
+    """
+    Checks a column read from the sheet against the same column of a grid of values.
+
+    Parameters:
+    column (list): The cells of the column, as returned by `worksheet.col_values()`.
+    values (list): The rows the writes are computed against, e.g. a snapshot.
+    col (int): The 1-based index of the column.
+
+    Returns:
+    bool: True if both hold the same cells, trailing empty cells aside.
+    """
+    expected = [row[col - 1] if len(row) >= col else '' for row in values]
+    actual = [str(cell) for cell in column]
+    while expected and expected[-1] == '':
+        expected.pop()
+    while actual and actual[-1] == '':
+        actual.pop()
+    return expected == actual
+
+
+def write_delta(worksheet, old_values, new_values):
+    """
+    Writes only the changed cells to the worksheet, in a single `batch_update` call.
+
+    Parameters:
+    worksheet (gspread.Worksheet): The worksheet to be updated.
+    old_values (list): The rows currently in the worksheet, as returned by `worksheet.get_all_values()`.
+    new_values (list): The rows the worksheet should hold.
+
+    Returns:
+    int: The number of cells written.
+    """
+    cells = diff_cells(old_values, new_values)
+    if not cells:
+        logging.info('Sheet unchanged, nothing to write.')
+        return 0
+
+    # Grow the grid if the new data does not fit in it
+    rows = max(row for row, _, _ in cells)
+    cols = max(col for _, col, _ in cells)
+    if rows > worksheet.row_count:
+        worksheet.add_rows(rows - worksheet.row_count)
+    if cols > worksheet.col_count:
+        worksheet.add_cols(cols - worksheet.col_count)
+
+    ranges = coalesce_ranges(cells)
+    worksheet.batch_update(ranges, value_input_option='USER_ENTERED')
+    logging.info(f'Wrote {len(cells)} Changed Cell(s) in {len(ranges)} Range(s)')
+    return len(cells)
+
+
+def http_session():
+    """
+    Builds the pooled HTTP session used for the Sheets API, retrying transient errors.
+
+    Returns:
+    requests.Session: The session, keeping its connections alive between requests.
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    session = requests.Session()
+    retries = Retry(total=3, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504), allowed_methods=('GET',))
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=retries)
+    session.mount('https://', adapter)
+    return session
+
+
+# The HTTP session shared by every request to the Sheets API, see `get_http()`
+shared_http = None
+
+
+def get_http():
+    """
+    Returns the HTTP session shared by every request to the Google APIs, created on first use.
+    """
+    global shared_http
+    if shared_http is None:
+        shared_http = http_session()
+    return shared_http
+
+
+def iter_sheet_rows(sheet_id, api_key, columns=('A', 'D'), page_size=1000, header=False):
+    """
+    Reads the rows of a Google Sheet page by page and yields them as they arrive.
+
+    Parameters:
+    sheet_id (str): The ID of the Google Sheet.
+    api_key (str): The Google API key.
+    columns (tuple): The first and last column to read (DID'S, STATUS, TIME and Feedback ID by default).
+    page_size (int): The number of rows requested per page.
+    header (bool): Also reads the header row, as the first row of the first page (whose index is then -1).
+
+    Yields:
+    tuple: The index of the page's first data row (0 is the row below the header) and the list of its rows.
+
+    Only the `values` field of the response is requested, and the header row is skipped unless asked for.
+    Reading stops at the first page without any row.
+    """
+    first, last = columns
+    start = 1 if header else 2
+    while True:
+        end = start + page_size - 1
+        response = get_http().get(
+            f'{SHEETS_API}/{sheet_id}/values/{first}{start}:{last}{end}',
+            params={'key': api_key, 'majorDimension': 'ROWS', 'fields': 'values'},
+            timeout=TIMEOUT,
+        )
+        response.raise_for_status()
+        rows = response.json().get('values', [])
+        if not rows:
+            return
+        logging.info(f'Fetched Sheet Rows {start}-{start + len(rows) - 1}')
+        yield start - 2, rows
+        start = end + 1
@@ -0,0 +1,278 @@
+import json
+import logging
+import os
+import threading
+from collections import Counter
+from datetime import datetime
+import pytz
+from sheets import get_http, iter_sheet_rows, TIMEOUT
+
+# Base URL of the Google Drive files API, for the revision of a spreadsheet
+DRIVE_API = 'https://www.googleapis.com/drive/v3/files'
+
+
+def fetch_revision(sheet_id, api_key, etag=None):
+    """
+    Asks Google Drive for the current revision of a spreadsheet, conditionally on its last known ETag.
+
+    Parameters:
+    sheet_id (str): The ID of the Google Sheet.
+    api_key (str): The Google API key.
+    etag (str): The ETag of the last known revision, sent as If-None-Match.
+
+    Returns:
+    tuple: (modified, revision, etag). `modified` is False when Drive answered 304 Not Modified.
+           The revision and ETag are None when they could not be read; the sheet then counts as modified.
+    """
+    headers = {'If-None-Match': etag} if etag else {}
+    try:
+        response = get_http().get(
+            f'{DRIVE_API}/{sheet_id}',
+            params={'key': api_key, 'fields': 'version,modifiedTime'},
+            headers=headers,
+            timeout=TIMEOUT,
+        )
+        if response.status_code == 304:
+            return False, None, etag
+        response.raise_for_status()
+        return True, str(response.json().get('version') or '') or None, response.headers.get('ETag')
+    except Exception as e:
+        logging.error(f'Could Not Read The Sheet Revision => {e}')
+        return True, None, None
+
+
+class SheetSnapshot:
+    """
+    The cell values of a Google Sheet at a given revision, header row first.
+
+    Parameters:
+    sheet_id (str): The ID of the Google Sheet.
+    values (list): The rows of the sheet. Rows are padded with empty cells to the same width.
+    revision (str): The Drive revision the values were read at, None if unknown.
+    etag (str): The ETag of that revision, None if unknown.
+    fetched_at (str): When the values were read, in ISO format.
+    """
+
+    def __init__(self, sheet_id, values, revision=None, etag=None, fetched_at=None):
+        width = max((len(row) for row in values), default=0)
+        self.sheet_id = sheet_id
+        self.values = [[str(cell) for cell in row] + [''] * (width - len(row)) for row in values]
+        self.revision = revision
+        self.etag = etag
+        self.fetched_at = fetched_at or datetime.now(pytz.utc).replace(microsecond=0).isoformat()
+
+    @property
+    def rows(self):
+        """
+        The rows of the sheet, without the header.
+        """
+        return self.values[1:]
+
+
+class SnapshotCache:
+    """
+    Keeps the last snapshot of each Google Sheet on disk (Parquet) and in memory for the current cycle.
+
+    Parameters:
+    api_key (str): The Google API key.
+    folder (str): The folder holding the snapshots, one `<sheet ID>.parquet` file and its `<sheet ID>.json`
+                  metadata (revision, ETag, fetch time) per sheet.
+    read_wait (float): Seconds `get()` waits for a read of the sheet already under way before reading it itself.
+
+    Within a cycle (`begin_cycle()`), the read path (`pages()`) and the write path (`fresh()`, then `written()`)
+    share one snapshot. The write path checks it against the current revision first, as writes address
+    rows by position. Its first use checks the Drive revision of the sheet: an unchanged sheet is served
+    from disk, otherwise it is read again, page by page. `get()` called from another thread while the
+    sheet is being read waits for that read for a while (`read_wait`), then reads the sheet itself: a
+    stream is consumed at the pace of the submissions, and may be abandoned (e.g. on shutdown).
+    """
+
+    def __init__(self, api_key, folder='sheet_cache', read_wait=10.0):
+        self.api_key = api_key
+        self.folder = folder
+        self.read_wait = read_wait
+        self.snapshots = {}
+        # The number of reads under way, per sheet
+        self.reading = Counter()
+        self.condition = threading.Condition()
+        self.stats = {'hits': 0, 'misses': 0}
+
+    def begin_cycle(self):
+        """
+        Forgets the in-memory snapshots, so the next use checks the revision of the sheet again.
+        """
+        self.snapshots.clear()
+
+    def _paths(self, sheet_id):
+        base = os.path.join(self.folder, sheet_id)
+        return base + '.parquet', base + '.json'
+
+    def load(self, sheet_id):
+        """
+        Loads the snapshot of a sheet from disk.
+
+        Returns:
+        SheetSnapshot: The snapshot, or None if there is none (or it could not be read).
+        """
+        data_path, meta_path = self._paths(sheet_id)
+        if not (os.path.exists(data_path) and os.path.exists(meta_path)):
+            return None
+        import pandas as pd
+
+        try:
+            with open(meta_path) as file:
+                meta = json.load(file)
+            values = pd.read_parquet(data_path).to_numpy().tolist()
+        except Exception as e:
+            logging.error(f'Could Not Load The Sheet Snapshot => {e}')
+            return None
+        return SheetSnapshot(sheet_id, values, meta.get('revision'), meta.get('etag'), meta.get('fetched_at'))
+
+    def save(self, snapshot):
+        """
+        Writes a snapshot to disk, replacing the previous one of its sheet.
+        """
+        import pandas as pd
+
+        os.makedirs(self.folder, exist_ok=True)
+        data_path, meta_path = self._paths(snapshot.sheet_id)
+        width = len(snapshot.values[0]) if snapshot.values else 0
+        frame = pd.DataFrame(snapshot.values, columns=[str(col) for col in range(width)], dtype=str)
+        frame.to_parquet(data_path + '.tmp', index=False)
+        os.replace(data_path + '.tmp', data_path)
+        with open(meta_path + '.tmp', 'w') as file:
+            json.dump({
+                'sheet_id': snapshot.sheet_id,
+                'revision': snapshot.revision,
+                'etag': snapshot.etag,
+                'fetched_at': snapshot.fetched_at,
+                'rows': len(snapshot.values),
+            }, file)
+        os.replace(meta_path + '.tmp', meta_path)
+
+    def _cached(self, sheet_id):
+        """
+        Looks for the snapshot of the cycle, or the one on disk if the sheet did not change since.
+
+        Returns:
+        tuple: The snapshot (None if the sheet must be read) and the current (revision, etag) of the sheet,
+               when it was read from Drive.
+        """
+        if sheet_id in self.snapshots:
+            return self.snapshots[sheet_id], None
+        cached = self.load(sheet_id)
+        modified, revision, etag = fetch_revision(sheet_id, self.api_key, cached.etag if cached else None)
+        if cached is None or cached.revision is None or (modified and (revision is None or revision != cached.revision)):
+            return None, (revision, etag)
+        logging.info(f'Sheet Unchanged Since {cached.fetched_at}, Served From The Cache')
+        self.stats['hits'] += 1
+        self.snapshots[sheet_id] = cached
+        return cached, None
+
+    def _read(self, sheet_id, revision, etag):
+        """
+        Reads the whole sheet page by page, yielding its pages, and stores its snapshot once the last one was read.
+        """
+        self.stats['misses'] += 1
+        with self.condition:
+            self.reading[sheet_id] += 1
+        try:
+            values = []
+            for start, rows in iter_sheet_rows(sheet_id, self.api_key, header=True):
+                values.extend(rows)
+                if start < 0:
+                    start, rows = 0, rows[1:]
+                if rows:
+                    yield start, rows
+            snapshot = SheetSnapshot(sheet_id, values, revision, etag)
+            self.snapshots[sheet_id] = snapshot
+            self.save(snapshot)
+        finally:
+            with self.condition:
+                self.reading[sheet_id] -= 1
+                self.condition.notify_all()
+
+    def pages(self, sheet_id):
+        """
+        Yields the rows of a sheet page by page, like `iter_sheet_rows()`, from the cache when it is fresh.
+
+        Yields:
+        tuple: The index of the page's first data row (0 is the row below the header) and the list of its rows.
+
+        When the sheet is read again, its pages are yielded as they arrive.
+        """
+        cached, current = self._cached(sheet_id)
+        if cached is None:
+            yield from self._read(sheet_id, *current)
+        elif cached.rows:
+            yield 0, cached.rows
+
+    def get(self, sheet_id):
+        """
+        Returns the snapshot of a sheet for the current cycle, reading the sheet only if it changed.
+
+        Returns:
+        SheetSnapshot: The snapshot.
+        """
+        with self.condition:
+            if not self.condition.wait_for(lambda: not self.reading[sheet_id], self.read_wait):
+                logging.info(f'Sheet Still Being Read After {self.read_wait}s, Reading It Again')
+        cached, current = self._cached(sheet_id)
+        if cached is None:
+            for _ in self._read(sheet_id, *current):
+                pass
+        return self.snapshots[sheet_id]
+
+    def fresh(self, sheet_id):
+        """
+        Returns the snapshot of a sheet checked against its current revision, read again if the sheet changed.
+
+        Returns:
+        SheetSnapshot: The snapshot.
+
+        Writes address cells by row position: they must be computed against what the sheet holds now,
+        not what it held at the start of the cycle, as rows may have been inserted, deleted or sorted since.
+        """
+        snapshot = self.get(sheet_id)
+        modified, revision, etag = fetch_revision(sheet_id, self.api_key, snapshot.etag)
+        if not modified or (revision is not None and revision == snapshot.revision):
+            return snapshot
+        logging.info(f'Sheet Changed Since Its Snapshot Of {snapshot.fetched_at}, Reading It Again Before Writing')
+        return self.reload(sheet_id, revision, etag)
+
+    def reload(self, sheet_id, revision=None, etag=None):
+        """
+        Reads a sheet again, whatever its revision.
+
+        Parameters:
+        sheet_id (str): The ID of the Google Sheet.
+        revision (str): The current revision of the sheet, if known.
+        etag (str): Its ETag, if known.
+
+        Returns:
+        SheetSnapshot: The new snapshot.
+        """
+        self.snapshots.pop(sheet_id, None)
+        for _ in self._read(sheet_id, revision, etag):
+            pass
+        return self.snapshots[sheet_id]
+
+    def written(self, snapshot, values):
+        """
+        Records the values just written to a sheet, so they need not be read back.
+
+        Parameters:
+        snapshot (SheetSnapshot): The snapshot the write was computed against.
+        values (list): The rows now in the sheet, header row first.
+
+        Returns:
+        None
+
+        The revision created by the write is read right away: a change made by someone else in the
+        meantime would be missed until the sheet changes again, which is why `update_sheet_data()` checks
+        the DID column of the sheet against the snapshot before every write.
+        """
+        _, revision, etag = fetch_revision(snapshot.sheet_id, self.api_key)
+        snapshot = SheetSnapshot(snapshot.sheet_id, values, revision, etag)
+        self.snapshots[snapshot.sheet_id] = snapshot
+        self.save(snapshot)
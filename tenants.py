@@ -0,0 +1,182 @@
+import json
+import logging
+import re
+import threading
+from time import monotonic
+from ledger import JobLedger
+
+# Form fields a tenant may set in its form profile, see `browser.form_values()`
+FORM_FIELDS = (
+    'enterprise_category', 'enterprise_contact_name', 'enterprise_contact_phone', 'enterprise_contact_email',
+    'enterprise_company_name', 'enterprise_company_address_line_1', 'enterprise_company_address_city',
+    'enterprise_company_address_state', 'enterprise_company_address_zip', 'enterprise_company_url',
+    'enterprise_service_provider', 'call_count', 'additional_feedback',
+)
+
+
+class Tenant:
+    """
+    A client served by the bot: its Google Sheet, its form profile and its throttles.
+
+    Parameters:
+    name (str): The name of the tenant, used in the logs and for its ledger file.
+    sheet_id (str): The ID of the Google Sheet holding its DID's.
+    ledger_path (str): Its own job ledger, defaults to `ledger-{name}.sqlite3`.
+    sheet_url (str): The URL of the sheet, defaults to the one of `sheet_id`.
+    form (dict): The form fields of the tenant (company details), keyed by field ID. Fields it does not set
+                 keep the values of `creds`.
+    max_batches_per_minute (float): The submission rate limit of the tenant, 0 for none.
+    weight (int): Its share of the submissions when tenants compete for the browsers, see `FairShare`.
+
+    Every tenant keeps its own ledger and write-back, the browsers, the OTP watcher and the Google Sheets
+    client are shared. The OTP emails of every tenant must reach the watched mailbox (e.g. aliases of it).
+    """
+
+    def __init__(self, name, sheet_id, ledger_path=None, sheet_url=None, form=None, max_batches_per_minute=0, weight=1):
+        self.name = name
+        self.sheet_id = sheet_id
+        self.sheet_url = sheet_url or f'https://docs.google.com/spreadsheets/d/{sheet_id}/edit?gid=0#gid=0'
+        self.ledger_path = ledger_path or f'ledger-{name}.sqlite3'
+        self.form = dict(form or {})
+        self.max_batches_per_minute = float(max_batches_per_minute)
+        self.weight = max(1, int(weight))
+        self.next_slot = monotonic()
+        self.ledger = None
+        self.writer = None
+
+    def __repr__(self):
+        return f'Tenant({self.name!r})'
+
+    def open(self):
+        """
+        Opens the ledger of the tenant.
+
+        Returns:
+        JobLedger: The ledger.
+        """
+        if self.ledger is None:
+            self.ledger = JobLedger(self.ledger_path)
+        return self.ledger
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.stop()
+            self.writer = None
+        if self.ledger is not None:
+            self.ledger.close()
+            self.ledger = None
+
+    def fields(self, defaults):
+        """
+        Returns the form fields of the tenant, over the default ones (`browser.form_values()`).
+        """
+        return {**defaults, **self.form}
+
+    @property
+    def ready_at(self):
+        """
+        The time (`time.monotonic()`) the rate limit of the tenant allows its next batch at.
+        """
+        return self.next_slot if self.max_batches_per_minute else 0.0
+
+    def reserve(self):
+        """
+        Takes the next submission slot of the tenant.
+        """
+        if self.max_batches_per_minute:
+            self.next_slot = max(self.next_slot, monotonic()) + 60 / self.max_batches_per_minute
+
+
+def load_tenants(path):
+    """
+    Reads the tenants from a JSON config file.
+
+    Parameters:
+    path (str): The path of the config file, e.g.
+        {"tenants": [{"name": "surplus", "sheet_id": "1Yy...", "max_batches_per_minute": 2, "weight": 1,
+                      "form": {"enterprise_contact_name": "Kathleen Perez", ...}}]}
+
+    Returns:
+    list: The tenants, in the order of the file.
+
+    Raises ValueError if a tenant has no name or sheet, a name is used twice or a form field is unknown.
+    """
+    with open(path) as file:
+        config = json.load(file)
+    tenants = []
+    for entry in config.get('tenants', []):
+        name, sheet_id = entry.get('name'), entry.get('sheet_id')
+        if not name or not sheet_id:
+            raise ValueError(f'Tenant Without A Name Or Sheet In {path} => {entry}')
+        if not re.fullmatch(r'[\w.-]+', name):
+            raise ValueError(f'Invalid Tenant Name => {name!r}')
+        if any(tenant.name == name for tenant in tenants):
+            raise ValueError(f'Duplicated Tenant => {name}')
+        unknown = set(entry.get('form', {})) - set(FORM_FIELDS)
+        if unknown:
+            raise ValueError(f'Unknown Form Fields For Tenant {name} => {sorted(unknown)}')
+        tenants.append(Tenant(
+            name,
+            sheet_id,
+            ledger_path=entry.get('ledger'),
+            sheet_url=entry.get('sheet_url'),
+            form=entry.get('form'),
+            max_batches_per_minute=entry.get('max_batches_per_minute', 0),
+            weight=entry.get('weight', 1),
+        ))
+    if not tenants:
+        raise ValueError(f'No Tenants In {path}')
+    logging.info(f'Tenants => {[tenant.name for tenant in tenants]}')
+    return tenants
+
+
+class FairShare:
+    """
+    Interleaves the batches of several tenants, so that a big sheet cannot starve the others.
+
+    Parameters:
+    stopping (threading.Event): Set when a shutdown is requested, ends the interleaving.
+
+    The next batch always comes from the tenant that got the smallest share of the submissions so far
+    (submissions / weight) among those its rate limit allows to submit now. When every tenant with
+    batches left is throttled, it waits for the first slot. Batches are pulled lazily, one at a time,
+    so a tenant whose sheet is still streaming does not hold the others back, and a tenant whose
+    batches fail to come (e.g. its sheet cannot be read) only drops out of the cycle.
+    """
+
+    def __init__(self, stopping=None):
+        self.stopping = stopping or threading.Event()
+        self.served = {}
+
+    def interleave(self, queues):
+        """
+        Merges the batches of every tenant into one fair stream.
+
+        Parameters:
+        queues (dict): The batches of every tenant (an iterable, lazy or not), keyed by tenant.
+
+        Yields:
+        tuple: The tenant and its next batch.
+        """
+        active = {tenant: iter(batches) for tenant, batches in queues.items()}
+        self.served = {tenant.name: 0 for tenant in active}
+        while active and not self.stopping.is_set():
+            now = monotonic()
+            ready = [tenant for tenant in active if tenant.ready_at <= now]
+            if not ready:
+                self.stopping.wait(min(tenant.ready_at for tenant in active) - now)
+                continue
+            tenant = min(ready, key=lambda tenant: self.served[tenant.name] / tenant.weight)
+            try:
+                batch = next(active[tenant], None)
+            except Exception as e:
+                # e.g. its sheet could not be read: the other tenants go on
+                logging.error(f'Batches Of {tenant.name} Failed, Skipped For This Cycle => {e}')
+                batch = None
+            if batch is None:
+                del active[tenant]
+                continue
+            tenant.reserve()
+            self.served[tenant.name] += 1
+            yield tenant, batch
+        logging.info(f'Fair Share => {self.served}')
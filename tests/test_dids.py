@@ -0,0 +1,43 @@
+import math
+
+import pytest
+
+from dids import (
+    EMPTY, INVALID_AREA_CODE, INVALID_CHARACTERS, INVALID_EXCHANGE_CODE, NOT_NANP,
+    canonical_did, national_number, validate_dids,
+)
+
+
+@pytest.mark.parametrize('value, did, reason', [
+    ('5612000000', '+15612000000', None),
+    ('+1 (561) 200-0000', '+15612000000', None),
+    ('1-561-200-0000', '+15612000000', None),
+    ("['5612000000']", '+15612000000', None),
+    (5612000000, '+15612000000', None),
+    ('', None, EMPTY),
+    (None, None, EMPTY),
+    (math.nan, None, EMPTY),
+    ('561200000x', None, INVALID_CHARACTERS),
+    ('561200000', None, NOT_NANP),
+    ('25612000000', None, NOT_NANP),
+    ('1612000000', None, INVALID_AREA_CODE),
+    ('9112000000', None, INVALID_AREA_CODE),
+    ('5611000000', None, INVALID_EXCHANGE_CODE),
+    ('5614110000', None, INVALID_EXCHANGE_CODE),
+])
+def test_validate_dids(value, did, reason):
+    checked = validate_dids([value])
+    assert checked['did'].iloc[0] == did
+    assert checked['reason'].iloc[0] == reason
+    assert canonical_did(value) == did
+
+
+def test_validate_dids_keeps_the_order():
+    checked = validate_dids(['5612000001', 'bad', '5612000002'])
+    assert checked['did'].tolist() == ['+15612000001', None, '+15612000002']
+    assert checked['raw'].tolist() == ['5612000001', 'bad', '5612000002']
+
+
+def test_national_number():
+    assert national_number('+1 (561) 200-0000') == '5612000000'
+    assert national_number("['123']") == '123'
@@ -0,0 +1,103 @@
+from datetime import datetime, timedelta, timezone
+from time import monotonic
+
+import pytest
+import pytz
+
+from fakes import FakeIMAPServer
+from fetch_email import OTPFetcher, OTPWatcher, fetch_otp, wait_for_otp
+
+NOW = datetime(2026, 10, 17, 12, 0, tzinfo=pytz.utc)
+
+
+class Session:
+    mail = None
+
+
+def email(uid, seconds, subject):
+    return uid, NOW + timedelta(seconds=seconds), subject
+
+
+def test_dispatch_assigns_emails_in_request_order():
+    watcher = OTPWatcher(Session())
+    first, second = watcher.expect(NOW), watcher.expect(NOW + timedelta(seconds=5))
+    watcher.dispatch([email(1, 10, 'OTP: 111111'), email(2, 12, 'OTP: 222222')])
+    assert first.result(0) == 'OTP: 111111'
+    assert second.result(0) == 'OTP: 222222'
+    assert watcher.requests == []
+
+
+def test_dispatch_skips_requests_sent_after_the_email():
+    watcher = OTPWatcher(Session())
+    late = watcher.expect(NOW + timedelta(seconds=30))
+    watcher.dispatch([email(1, 10, 'OTP: 111111')])
+    assert not late.done()
+    watcher.dispatch([email(2, 40, 'OTP: 222222')])
+    assert late.result(0) == 'OTP: 222222'
+
+
+def test_dispatch_unclaimed_email():
+    watcher = OTPWatcher(Session())
+    watcher.dispatch([email(1, 10, 'OTP: 111111')])
+    request = watcher.expect(NOW + timedelta(seconds=20))
+    assert not request.done()
+    assert watcher.wait(request, timeout=0) is None
+    assert watcher.requests == []
+
+
+@pytest.fixture
+def imap():
+    server = FakeIMAPServer().start()
+    yield server
+    server.stop()
+
+
+def test_fetcher_only_reads_the_new_emails(imap):
+    mail = imap.connect()
+    fetcher = OTPFetcher(mail)
+    imap.deliver('Your verification code: 11111')
+    imap.deliver('Newsletter', sender='news@example.com')
+    imap.deliver('Your verification code: 22222')
+    assert [subject for _, _, subject in fetcher.poll(datetime.now(pytz.utc))] == [
+        'Your verification code: 11111', 'Your verification code: 22222',
+    ]
+    assert fetcher.poll(datetime.now(pytz.utc)) == []
+    imap.deliver('Your verification code: 33333')
+    assert [uid for uid, _, _ in fetcher.poll(datetime.now(pytz.utc))] == [4]
+    assert imap.commands['UID SEARCH'] == 3
+    mail.logout()
+
+
+def test_fetch_otp_on_a_server_behind_utc():
+    # Just after midnight UTC, it is still the day before on the server
+    server = FakeIMAPServer(tz=timezone(timedelta(hours=-5))).start()
+    try:
+        mail = server.connect()
+        start_time = datetime.now(pytz.utc).replace(hour=0, minute=5, second=0, microsecond=0)
+        server.deliver('Your verification code: 11111', date=start_time - timedelta(minutes=1))
+        server.deliver('Your verification code: 22222', date=start_time + timedelta(minutes=1))
+        assert fetch_otp(mail, start_time) == 'Your verification code: 22222'
+        mail.logout()
+    finally:
+        server.stop()
+
+
+def test_wait_for_otp_wakes_up_on_idle(imap):
+    mail = imap.connect()
+    # INTERNALDATE has a one second resolution
+    start_time = datetime.now(pytz.utc).replace(microsecond=0) - timedelta(seconds=1)
+    imap.deliver('Your verification code: 11111', date=start_time - timedelta(minutes=1))
+    imap.deliver('Your verification code: 22222', delay=0.3)
+    started = monotonic()
+    assert wait_for_otp(mail, start_time, timeout=10) == 'Your verification code: 22222'
+    # Woken up by the IDLE notification, not by a polling backoff
+    assert monotonic() - started < 2
+    assert imap.commands['IDLE'] == 1
+    mail.logout()
+
+
+def test_wait_for_otp_times_out(imap):
+    mail = imap.connect()
+    imap.deliver('Your verification code: 11111')
+    assert wait_for_otp(mail, datetime.now(pytz.utc), timeout=0.5) is None
+    mail.logout()
@@ -0,0 +1,87 @@
+import pytest
+
+from ledger import JobLedger
+
+DIDS = [str(5612000000 + i) for i in range(5)]
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    ledger = JobLedger(str(tmp_path / 'ledger.sqlite3'))
+    yield ledger
+    ledger.close()
+
+
+def full_sync(ledger, values):
+    ledger.begin_sync()
+    ledger.sync(values)
+    return ledger.complete_sync()
+
+
+def result(did, feedback='FB1'):
+    return {"DID'S": did, 'STATUS': '', 'TIME': 'T', 'Feedback ID': feedback}
+
+
+def test_sync_adds_pending_and_done_rows(ledger):
+    assert ledger.sync([[DIDS[0]], [DIDS[1], '', 'T', 'FB0'], ['']]) == {'added': 2, 'updated': 0}
+    assert ledger.pending() == [[DIDS[0]]]
+    assert ledger.counts() == {'pending': 1, 'done': 1}
+
+
+def test_sync_keeps_results_not_yet_written(ledger):
+    ledger.sync([[did] for did in DIDS[:2]])
+    ledger.finish_batch(ledger.start_batch([[DIDS[0]]]), [result(DIDS[0])])
+    # The sheet does not show the result yet: it must not go back to pending
+    ledger.sync([[did] for did in DIDS[:2]])
+    assert ledger.counts() == {'done': 1, 'pending': 1}
+    assert ledger.unsynced() == [result(DIDS[0])]
+    ledger.mark_synced(ledger.unsynced())
+    assert ledger.unsynced() == []
+
+
+def test_finish_batch(ledger):
+    ledger.sync([[did] for did in DIDS])
+    done = ledger.start_batch([[did] for did in DIDS[:2]])
+    failed = ledger.start_batch([[did] for did in DIDS[2:4]])
+    assert ledger.counts() == {'in_flight': 4, 'pending': 1}
+    ledger.finish_batch(done, [result(did) for did in DIDS[:2]])
+    ledger.finish_batch(failed, None)
+    assert ledger.counts() == {'done': 2, 'pending': 3}
+    # The attempted DID's come first
+    assert ledger.pending()[:2] == [[DIDS[2]], [DIDS[3]]]
+
+
+def test_requeue(ledger):
+    ledger.sync([[did] for did in DIDS])
+    ledger.start_batch([[did] for did in DIDS[3:]])
+    assert ledger.pending(in_flight=True)[:2] == [[DIDS[3]], [DIDS[4]]]
+    assert ledger.requeue() == 2
+    assert ledger.counts() == {'pending': 5}
+    assert ledger.pending()[:2] == [[DIDS[3]], [DIDS[4]]]
+
+
+def test_full_sync_removes_the_dids_gone_from_the_sheet(ledger):
+    assert full_sync(ledger, [[did] for did in DIDS]) == 0
+    assert full_sync(ledger, [[did] for did in DIDS[:3]]) == 2
+    assert ledger.pending() == [[did] for did in DIDS[:3]]
+    # A new cycle does not bring them back
+    ledger.reset()
+    assert ledger.counts() == {'pending': 3, 'removed': 2}
+    # Unless they are added to the sheet again
+    full_sync(ledger, [[did] for did in DIDS])
+    assert ledger.counts() == {'pending': 5}
+
+
+def test_partial_sync_removes_nothing(ledger):
+    full_sync(ledger, [[did] for did in DIDS])
+    ledger.sync([[DIDS[0]]])
+    assert ledger.complete_sync() == 0
+    assert ledger.counts() == {'pending': 5}
+
+
+def test_reject(ledger):
+    ledger.sync([[did] for did in DIDS])
+    ledger.reject([(DIDS[0], 'invalid')])
+    assert ledger.counts() == {'pending': 4, 'rejected': 1}
+    ledger.reset()
+    assert ledger.counts() == {'pending': 5}
@@ -0,0 +1,36 @@
+import pytest
+
+from planner import BatchPlanner
+
+
+def test_pack_fills_every_form_but_the_last():
+    planner = BatchPlanner(size=20)
+    batches = list(planner.pack(range(45)))
+    assert [len(batch) for batch in batches] == [20, 20, 5]
+    assert [row for batch in batches for row in batch] == list(range(45))
+    assert planner.report() == {'forms': 3, 'dids': 45, 'slots': 60, 'utilization': 0.75}
+
+
+def test_pack_is_lazy():
+    pulled = []
+
+    def rows():
+        for row in range(10):
+            pulled.append(row)
+            yield row
+
+    batches = BatchPlanner(size=4).pack(rows())
+    assert next(batches) == [0, 1, 2, 3]
+    assert pulled == [0, 1, 2, 3]
+
+
+def test_pack_exact_multiple():
+    planner = BatchPlanner(size=5)
+    assert [len(batch) for batch in planner.pack(range(10))] == [5, 5]
+    assert planner.report()['utilization'] == pytest.approx(1.0)
+
+
+def test_report_without_forms():
+    planner = BatchPlanner()
+    assert list(planner.pack([])) == []
+    assert planner.report() == {'forms': 0, 'dids': 0, 'slots': 0, 'utilization': 0.0}
@@ -0,0 +1,131 @@
+import pytest
+
+from retries import (
+    ELEMENT_TIMEOUT, FORM_REJECTED, OTP_TIMEOUT, REJECTED_NUMBER, SUBMIT_TIMEOUT, UNKNOWN,
+    RetryEngine, SubmitError, form_error,
+)
+
+ROWS = [['5612000000'], ['5612000001'], ['5612000002']]
+
+
+def engine():
+    return RetryEngine({kind: {'retries': 2, 'backoff': 0.0} for kind in (ELEMENT_TIMEOUT, OTP_TIMEOUT, SUBMIT_TIMEOUT, UNKNOWN)})
+
+
+def scripted(*failures):
+    """
+    Returns an attempt raising the given errors in turn, then succeeding, and the calls it got.
+    """
+    calls = []
+
+    def attempt(rows, progress):
+        calls.append(([row[0] for row in rows], progress.filled, progress.usable_otp()))
+        if len(calls) <= len(failures):
+            progress.filled = True
+            progress.received('123456')
+            raise failures[len(calls) - 1]
+        return f'FB{len(calls)}'
+
+    return attempt, calls
+
+
+def test_run_succeeds_first_time():
+    attempt, calls = scripted()
+    assert engine().run(ROWS, attempt) == ([(ROWS, 'FB1')], [])
+    assert len(calls) == 1
+
+
+def test_run_retries_otp_timeout_on_the_filled_form():
+    attempt, calls = scripted(SubmitError(OTP_TIMEOUT))
+    done, rejected = engine().run(ROWS, attempt)
+    assert done == [(ROWS, 'FB2')]
+    # The form stays filled, a new code is asked for
+    assert calls[1][1:] == (True, None)
+
+
+def test_run_reuses_the_otp_after_a_submit_timeout():
+    attempt, calls = scripted(SubmitError(SUBMIT_TIMEOUT))
+    retry_engine = engine()
+    retry_engine.run(ROWS, attempt)
+    assert calls[1][1:] == (True, '123456')
+    assert retry_engine.report()['otps_reused'] == 1
+
+
+def test_run_reloads_after_an_element_timeout():
+    attempt, calls = scripted(SubmitError(ELEMENT_TIMEOUT))
+    engine().run(ROWS, attempt)
+    assert calls[1][1:] == (False, None)
+
+
+def test_run_drops_the_rejected_numbers():
+    attempt, calls = scripted(SubmitError(REJECTED_NUMBER, 'refused', ['(561) 200-0001']))
+    retry_engine = engine()
+    done, rejected = retry_engine.run(ROWS, attempt)
+    assert rejected == [('5612000001', FORM_REJECTED)]
+    assert done == [([ROWS[0], ROWS[2]], 'FB2')]
+    assert retry_engine.report()['dids_salvaged'] == 2
+
+
+def test_run_rejects_nothing_on_a_guess():
+    attempt, calls = scripted(SubmitError(REJECTED_NUMBER, 'refused', ['5559990000']))
+    retry_engine = engine()
+    done, rejected = retry_engine.run(ROWS, attempt)
+    assert rejected == [] and done == [(ROWS, 'FB2')]
+    assert retry_engine.report()['failures'] == {REJECTED_NUMBER: 1}
+
+
+def test_run_splits_the_batch_to_isolate_an_unnamed_refused_number():
+    rows = [[str(5612000000 + i)] for i in range(5)]
+    submitted = []
+
+    def attempt(group, progress):
+        if ['5612000003'] in group:
+            raise form_error('One of the phone numbers cannot be registered.', [row[0] for row in group])
+        submitted.append(group)
+        return f'FB{len(submitted)}'
+
+    retry_engine = engine()
+    done, rejected = retry_engine.run(rows, attempt)
+    assert rejected == [('5612000003', FORM_REJECTED)]
+    assert sorted(row[0] for group, _ in done for row in group) == ['5612000000', '5612000001', '5612000002', '5612000004']
+    report = retry_engine.report()
+    assert report['splits'] == 3
+    assert report['dids_failed'] == 0
+
+
+def test_run_does_not_split_on_a_contact_phone_error():
+    attempt, calls = scripted(*[form_error('The contact phone number is invalid.', [row[0] for row in ROWS])] * 5)
+    retry_engine = engine()
+    assert retry_engine.run(ROWS, attempt) == ([], [])
+    assert retry_engine.report()['splits'] == 0
+    assert all(len(call[0]) == 3 for call in calls)
+
+
+def test_run_gives_up_after_its_retries():
+    attempt, calls = scripted(*[SubmitError(UNKNOWN)] * 5)
+    retry_engine = engine()
+    assert retry_engine.run(ROWS, attempt) == ([], [])
+    assert len(calls) == 3
+    assert retry_engine.report()['dids_failed'] == 3
+
+
+def test_run_stops_retrying_on_shutdown():
+    attempt, calls = scripted(SubmitError(UNKNOWN))
+    retry_engine = engine()
+    retry_engine.stopping.set()
+    assert retry_engine.run(ROWS, attempt) == ([], [])
+    assert calls == []
+
+
+@pytest.mark.parametrize('message, fields, kind, refused', [
+    ('Phone number 561-200-0001 cannot be registered.', (), REJECTED_NUMBER, ['5612000001']),
+    ('Invalid number.', ('enterprise_phone_2',), REJECTED_NUMBER, ['5612000002']),
+    ('The contact phone 561-555-0100 is invalid.', (), UNKNOWN, []),
+    ('Invalid verification code.', (), OTP_TIMEOUT, []),
+    ('Something went wrong.', (), UNKNOWN, []),
+    ('One of the phone numbers cannot be registered.', (), REJECTED_NUMBER, []),
+    ('Invalid contact phone number.', (), UNKNOWN, []),
+])
+def test_form_error(message, fields, kind, refused):
+    error = form_error(message, [row[0] for row in ROWS], fields)
+    assert (error.kind, error.rejected) == (kind, refused)
@@ -0,0 +1,104 @@
+import pandas as pd
+
+from fakes import FakeWorksheet
+from sheets import DID_COLUMN, coalesce_ranges, column_matches, diff_cells, merge_results, write_delta
+
+
+def test_merge_results_matches_normalized_dids():
+    existing = pd.DataFrame({DID_COLUMN: ["['111']", '222', '333'], 'TIME': ['', '', ''], 'Feedback ID': ['', '', '']})
+    df = pd.DataFrame({DID_COLUMN: ['111', ' 333 ', '444'], 'TIME': ['t1', 't3', 't4'], 'Feedback ID': ['f1', 'f3', 'f4']})
+    merged, report = merge_results(existing, df)
+    assert report == {'matched': 2, 'unmatched': 1, 'duplicated': 0}
+    assert merged[DID_COLUMN].tolist() == ['111', '222', ' 333 ']
+    assert merged['TIME'].tolist() == ['t1', '', 't3']
+    assert merged['Feedback ID'].tolist() == ['f1', '', 'f3']
+    assert existing['TIME'].tolist() == ['', '', '']
+
+
+def test_merge_results_first_duplicate_wins():
+    existing = pd.DataFrame({DID_COLUMN: ['111', '222'], 'TIME': ['', '']})
+    df = pd.DataFrame({DID_COLUMN: ['111', '"111"'], 'TIME': ['first', 'second'], 'Extra': ['x', 'y']})
+    merged, report = merge_results(existing, df)
+    assert report == {'matched': 1, 'unmatched': 0, 'duplicated': 1}
+    assert merged['TIME'].tolist() == ['first', '']
+    assert 'Extra' not in merged.columns
+
+
+def test_merge_results_empty_sheet():
+    existing = pd.DataFrame(columns=[DID_COLUMN, 'TIME'])
+    df = pd.DataFrame({DID_COLUMN: ['111', '222'], 'TIME': ['t1', 't2']})
+    merged, report = merge_results(existing, df)
+    assert merged is existing
+    assert report == {'matched': 0, 'unmatched': 2, 'duplicated': 0}
+
+
+def test_diff_cells_ragged_rows():
+    old = [['a', 'b'], ['c']]
+    new = [['a'], ['c', 'd', 'e']]
+    assert diff_cells(old, new) == [(1, 2, ''), (2, 2, 'd'), (2, 3, 'e')]
+
+
+def test_diff_cells_empties_removed_rows():
+    assert diff_cells([['a'], ['b', 'c']], [['a']]) == [(2, 1, ''), (2, 2, '')]
+
+
+def test_diff_cells_unchanged():
+    assert diff_cells([['a', 'b']], [['a', 'b']]) == []
+
+
+def test_coalesce_ranges_joins_runs_of_a_row():
+    assert coalesce_ranges([(2, 2, 'x'), (2, 3, 'y'), (2, 5, 'z')]) == [
+        {'range': 'B2:C2', 'values': [['x', 'y']]},
+        {'range': 'E2:E2', 'values': [['z']]},
+    ]
+
+
+def test_coalesce_ranges_stacks_rectangles():
+    cells = [(2, 2, 'a'), (2, 3, 'b'), (3, 2, 'c'), (3, 3, 'd'), (4, 2, 'e'), (6, 2, 'f'), (6, 3, 'g')]
+    assert coalesce_ranges(cells) == [
+        {'range': 'B2:C3', 'values': [['a', 'b'], ['c', 'd']]},
+        {'range': 'B4:B4', 'values': [['e']]},
+        {'range': 'B6:C6', 'values': [['f', 'g']]},
+    ]
+
+
+def test_write_delta_writes_only_changes():
+    old = [["DID'S", 'STATUS'], ['5612000000', ''], ['5612000001', '']]
+    new = [["DID'S", 'STATUS'], ['5612000000', 'done'], ['5612000001', '']]
+    worksheet = FakeWorksheet(old)
+    assert write_delta(worksheet, old, new) == 1
+    assert worksheet.get_all_values() == new
+    assert worksheet.calls['batch_update'] == 1
+    assert worksheet.cells_written == 1
+
+
+def test_write_delta_ragged_grid():
+    old = [['a', 'b', 'c'], ['d']]
+    new = [['a', 'x'], ['d', 'e', 'f']]
+    worksheet = FakeWorksheet(old)
+    write_delta(worksheet, worksheet.get_all_values(), new)
+    assert worksheet.get_all_values() == [['a', 'x', ''], ['d', 'e', 'f']]
+
+
+def test_write_delta_grows_the_grid():
+    old = [['a', 'b']]
+    new = [['a', 'b', 'c'], ['d', 'e', 'f'], ['g', 'h', 'i']]
+    worksheet = FakeWorksheet(old, rows=1, cols=2)
+    assert write_delta(worksheet, old, new) == 7
+    assert (worksheet.row_count, worksheet.col_count) == (3, 3)
+    assert worksheet.calls['add_rows'] == worksheet.calls['add_cols'] == 1
+    assert worksheet.get_all_values() == new
+
+
+def test_write_delta_unchanged():
+    worksheet = FakeWorksheet([['a']])
+    assert write_delta(worksheet, [['a']], [['a']]) == 0
+    assert worksheet.calls['batch_update'] == 0
+
+
+def test_column_matches():
+    values = [["DID'S", 'STATUS'], ['5612000000', 'x'], ['5612000001', ''], ['', '']]
+    assert column_matches(["DID'S", '5612000000', '5612000001'], values)
+    assert not column_matches(["DID'S", '5612000001', '5612000000'], values)
+    assert not column_matches(["DID'S", '5612000000'], values)
+    assert column_matches(FakeWorksheet(values).col_values(1), values)
@@ -0,0 +1,65 @@
+import snapshots
+from fakes import FakeWorksheet
+from snapshots import SnapshotCache
+
+HEADER = ["DID'S", 'STATUS', 'TIME', 'Feedback ID']
+
+
+def fake_sheet(monkeypatch, worksheet, page_size=2):
+    """
+    Serves the worksheet through `iter_sheet_rows()` page by page, its revision bumped by every write.
+    """
+    def iter_sheet_rows(sheet_id, api_key, header=False):
+        values = worksheet.get_all_values()
+        yield -1, values[:page_size + 1]
+        for start in range(page_size, len(values) - 1, page_size):
+            yield start, values[start + 1:start + page_size + 1]
+
+    def fetch_revision(sheet_id, api_key, etag=None):
+        return True, str(worksheet.calls['batch_update'] + worksheet.calls['update']), None
+
+    monkeypatch.setattr(snapshots, 'iter_sheet_rows', iter_sheet_rows)
+    monkeypatch.setattr(snapshots, 'fetch_revision', fetch_revision)
+
+
+def test_get_does_not_wait_for_an_abandoned_stream(monkeypatch, tmp_path):
+    worksheet = FakeWorksheet([HEADER] + [[str(5612000000 + i)] for i in range(6)])
+    fake_sheet(monkeypatch, worksheet)
+    cache = SnapshotCache(None, str(tmp_path), read_wait=0.1)
+    pages = cache.pages('fake')
+    next(pages)
+    # The stream is left half read: `get()` reads the sheet itself
+    assert len(cache.get('fake').rows) == 6
+    pages.close()
+    assert not cache.reading['fake']
+
+
+def test_fresh_serves_the_snapshot_while_the_sheet_is_unchanged(monkeypatch, tmp_path):
+    worksheet = FakeWorksheet([HEADER] + [[str(5612000000 + i)] for i in range(3)])
+    fake_sheet(monkeypatch, worksheet)
+    cache = SnapshotCache(None, str(tmp_path))
+    snapshot = cache.get('fake')
+    assert cache.fresh('fake') is snapshot
+    assert cache.stats == {'hits': 0, 'misses': 1}
+
+
+def test_fresh_reads_a_changed_sheet_again(monkeypatch, tmp_path):
+    worksheet = FakeWorksheet([HEADER] + [[str(5612000000 + i)] for i in range(3)])
+    fake_sheet(monkeypatch, worksheet)
+    cache = SnapshotCache(None, str(tmp_path))
+    cache.get('fake')
+    # Someone sorts the sheet
+    values = worksheet.get_all_values()
+    worksheet.update([values[0]] + values[1:][::-1])
+    assert [row[0] for row in cache.fresh('fake').rows] == ['5612000002', '5612000001', '5612000000']
+    assert cache.stats['misses'] == 2
+
+
+def test_unchanged_sheet_is_served_from_disk_next_cycle(monkeypatch, tmp_path):
+    worksheet = FakeWorksheet([HEADER] + [[str(5612000000 + i)] for i in range(3)])
+    fake_sheet(monkeypatch, worksheet)
+    cache = SnapshotCache(None, str(tmp_path))
+    cache.get('fake')
+    cache.begin_cycle()
+    assert len(SnapshotCache(None, str(tmp_path)).get('fake').rows) == 3
+    assert worksheet.calls['get_all_values'] == 1
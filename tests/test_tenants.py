@@ -0,0 +1,74 @@
+import json
+import threading
+
+import pytest
+
+from tenants import FairShare, Tenant, load_tenants
+
+
+def names(stream):
+    return [tenant.name for tenant, _ in stream]
+
+
+def test_interleave_follows_the_weights():
+    heavy, light = Tenant('heavy', 'sheet-1', weight=2), Tenant('light', 'sheet-2')
+    share = FairShare()
+    order = names(share.interleave({heavy: range(10), light: range(10)}))
+    assert order[:6] == ['heavy', 'light', 'heavy', 'heavy', 'light', 'heavy']
+    assert share.served == {'heavy': 10, 'light': 10}
+
+
+def test_interleave_drops_a_failing_tenant():
+    def broken():
+        yield 'first'
+        raise ConnectionError('sheet unreachable')
+
+    bad, good = Tenant('bad', 'sheet-1'), Tenant('good', 'sheet-2')
+    share = FairShare()
+    assert names(share.interleave({bad: broken(), good: range(3)})) == ['bad', 'good', 'good', 'good']
+    assert share.served == {'bad': 1, 'good': 3}
+
+
+def test_interleave_waits_for_the_rate_limit():
+    throttled, free = Tenant('throttled', 'sheet-1', max_batches_per_minute=600), Tenant('free', 'sheet-2')
+    order = names(FairShare().interleave({throttled: range(3), free: range(3)}))
+    assert order == ['throttled', 'free', 'free', 'free', 'throttled', 'throttled']
+
+
+def test_interleave_stops_on_shutdown():
+    stopping = threading.Event()
+    share = FairShare(stopping)
+    stream = share.interleave({Tenant('solo', 'sheet-1'): range(5)})
+    next(stream)
+    stopping.set()
+    assert list(stream) == []
+    assert share.served == {'solo': 1}
+
+
+def test_load_tenants(tmp_path):
+    path = tmp_path / 'tenants.json'
+    path.write_text(json.dumps({'tenants': [
+        {'name': 'surplus', 'sheet_id': 'abc', 'weight': 3, 'form': {'enterprise_contact_name': 'Jane Doe'}},
+        {'name': 'other', 'sheet_id': 'def', 'ledger': 'other.sqlite3'},
+    ]}))
+    surplus, other = load_tenants(str(path))
+    assert surplus.weight == 3
+    assert surplus.ledger_path == 'ledger-surplus.sqlite3'
+    assert surplus.fields({'call_count': '1', 'enterprise_contact_name': 'x'}) == {
+        'call_count': '1', 'enterprise_contact_name': 'Jane Doe',
+    }
+    assert other.ledger_path == 'other.sqlite3'
+
+
+@pytest.mark.parametrize('tenants', [
+    [],
+    [{'name': 'a'}],
+    [{'name': 'a b', 'sheet_id': 'x'}],
+    [{'name': 'a', 'sheet_id': 'x'}, {'name': 'a', 'sheet_id': 'y'}],
+    [{'name': 'a', 'sheet_id': 'x', 'form': {'password': 'secret'}}],
+])
+def test_load_tenants_rejects_bad_configs(tmp_path, tenants):
+    path = tmp_path / 'tenants.json'
+    path.write_text(json.dumps({'tenants': tenants}))
+    with pytest.raises(ValueError):
+        load_tenants(str(path))
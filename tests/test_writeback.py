@@ -0,0 +1,66 @@
+import threading
+
+from ledger import JobLedger
+from writeback import WriteBack
+
+
+def finished(tmp_path, count=3):
+    ledger = JobLedger(str(tmp_path / 'ledger.sqlite3'))
+    ledger.sync([[str(5612000000 + i)] for i in range(count)])
+    batch_id = ledger.start_batch(ledger.pending())
+    ledger.finish_batch(batch_id, [
+        {"DID'S": str(5612000000 + i), 'STATUS': '', 'TIME': 'T', 'Feedback ID': 'FB1'} for i in range(count)
+    ])
+    return ledger
+
+
+def test_drain_writes_the_results_once(tmp_path):
+    ledger = finished(tmp_path)
+    writes = []
+    writer = WriteBack(ledger, writes.append, window=60).start()
+    writer.notify()
+    assert writer.drain(timeout=5)
+    writer.stop()
+    assert [len(results) for results in writes] == [3]
+    assert ledger.unsynced() == []
+    assert writer.stats['flushes'] == 1
+
+
+def test_flush_retries_a_failed_write(tmp_path):
+    ledger = finished(tmp_path)
+    attempts = []
+
+    def write(results):
+        attempts.append(results)
+        if len(attempts) == 1:
+            raise OSError('quota')
+
+    writer = WriteBack(ledger, write, backoff=0)
+    assert writer.flush()
+    assert len(attempts) == 2
+    assert writer.stats['failures'] == 1
+    assert ledger.unsynced() == []
+
+
+def test_results_stay_unsynced_when_every_write_fails(tmp_path):
+    ledger = finished(tmp_path)
+
+    def write(results):
+        raise OSError('down')
+
+    writer = WriteBack(ledger, write, retries=2, backoff=0)
+    assert not writer.flush()
+    assert len(ledger.unsynced()) == 3
+
+
+def test_notifications_within_the_window_are_coalesced(tmp_path):
+    ledger = finished(tmp_path)
+    writes = []
+    written = threading.Event()
+    writer = WriteBack(ledger, lambda results: (writes.append(results), written.set()), window=0.2).start()
+    for _ in range(5):
+        writer.notify()
+    assert written.wait(5)
+    assert writer.drain(timeout=5)
+    writer.stop()
+    assert len(writes) == 1
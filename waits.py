@@ -0,0 +1,140 @@
+import logging
+import os
+import threading
+from time import perf_counter
+from selenium.common.exceptions import TimeoutException, WebDriverException
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
+
+# Seconds between two checks of a wait condition (Selenium's default is 0.5)
+POLL = float(os.getenv('WAIT_POLL', 0.05))
+
+# Time spent waiting by the current thread since the last `reset()`
+clock = threading.local()
+
+# Returns the elements with the given IDs, or null if any of them is missing
+ELEMENTS_JS = """
+var elements = arguments[0].map(function (id) { return document.getElementById(id); });
+return elements.every(function (element) { return element; }) ? elements : null;
+"""
+
+# Runs a check script (the body of a function, inlined as `check`) again after every DOM mutation
+# and resolves with its first non-null result, or with null once the timeout is over
+MUTATION_JS = """
+var timeout = arguments[0], args = Array.prototype.slice.call(arguments, 1, -1), done = arguments[arguments.length - 1];
+var check = function () {
+/* check */
+};
+var result = check.apply(null, args);
+if (result !== null && result !== undefined) return done(result);
+var timer;
+var observer = new MutationObserver(function () {
+    var result = check.apply(null, args);
+    if (result !== null && result !== undefined) {
+        observer.disconnect();
+        clearTimeout(timer);
+        done(result);
+    }
+});
+observer.observe(document.documentElement, {childList: true, subtree: true, attributes: true, characterData: true});
+timer = setTimeout(function () { observer.disconnect(); done(null); }, timeout * 1000);
+"""
+
+
+def reset():
+    """
+    Starts measuring the time the current thread spends waiting, e.g. at the start of a batch.
+    """
+    clock.waited = 0.0
+
+
+def waited():
+    """
+    Returns the seconds the current thread spent waiting since the last `reset()`.
+    """
+    return getattr(clock, 'waited', 0.0)
+
+
+def _timed(wait, *args):
+    start = perf_counter()
+    try:
+        return wait(*args)
+    finally:
+        clock.waited = waited() + perf_counter() - start
+
+
+def until(driver, condition, timeout=10):
+    """
+    Waits for a condition with a tight poll interval.
+
+    Parameters:
+    driver (webdriver.Chrome): The WebDriver instance.
+    condition (callable): Called with the driver, e.g. an `expected_conditions` one. Its first truthy result is returned.
+    timeout (float): Seconds before a `TimeoutException` is raised.
+
+    Returns:
+    The first truthy result of the condition.
+    """
+    return _timed(WebDriverWait(driver, timeout, poll_frequency=POLL).until, condition)
+
+
+def element(driver, element_id, timeout=10):
+    """
+    Waits for the element with the given ID to be present.
+    """
+    return until(driver, EC.presence_of_element_located((By.ID, element_id)), timeout)
+
+
+def clickable(driver, element_id, timeout=10):
+    """
+    Waits for the element with the given ID to be clickable.
+    """
+    return until(driver, EC.element_to_be_clickable((By.ID, element_id)), timeout)
+
+
+def elements(driver, element_ids, timeout=10):
+    """
+    Waits for a group of elements at once: a single script checks them all on every poll.
+
+    Parameters:
+    driver (webdriver.Chrome): The WebDriver instance.
+    element_ids (list): The IDs of the elements.
+    timeout (float): Seconds before a `TimeoutException` is raised.
+
+    Returns:
+    dict: The elements, keyed by their ID.
+    """
+    found = until(driver, lambda driver: driver.execute_script(ELEMENTS_JS, list(element_ids)), timeout)
+    return dict(zip(element_ids, found))
+
+
+def observe(driver, script, *args, timeout=30):
+    """
+    Waits for a check script to return something, run again on every DOM mutation of the page instead of polling.
+
+    Parameters:
+    driver (webdriver.Chrome): The WebDriver instance.
+    script (str): The check, run like `driver.execute_script(script, *args)`: it returns null until the
+                  page shows what is waited for.
+    timeout (float): Seconds before a `TimeoutException` is raised.
+
+    Returns:
+    The first non-null result of the check.
+
+    If the page navigates while waiting, the wait falls back to polling the check.
+    """
+    def wait(timeout):
+        driver.set_script_timeout(timeout + 5)
+        try:
+            found = driver.execute_async_script(MUTATION_JS.replace('/* check */', script), timeout, *args)
+        except TimeoutException:
+            raise
+        except WebDriverException as e:
+            logging.info(f'DOM Observer Interrupted, Polling Instead => {e.msg}')
+            return WebDriverWait(driver, timeout, poll_frequency=POLL).until(lambda driver: driver.execute_script(script, *args))
+        if found is None:
+            raise TimeoutException(f'Nothing showed up within {timeout}s')
+        return found
+
+    return _timed(wait, timeout)
@@ -0,0 +1,120 @@
+import logging
+import threading
+from queue import Queue, Empty
+from time import monotonic
+
+
+class WriteBack:
+    """
+    Writes finished batch results back to the Google Sheet from a background thread.
+
+    Parameters:
+    ledger (JobLedger): The local job ledger holding the results not yet in the sheet (`unsynced()`).
+    write (callable): Writes a list of result dicts to the sheet, e.g. through `update_sheet_data()`.
+    window (float): Seconds results are gathered for after the first one arrives, so they go out in one write.
+    retries (int): The number of attempts of a flush before it is left for the next one.
+    backoff (float): Seconds before the first retry, doubled after every failed attempt.
+
+    Workers call `notify()` once a batch is recorded in the ledger and go on with the next batch.
+    The ledger is the spool: a result stays unsynced until its write succeeded, so nothing is lost
+    when a write fails or the bot crashes, and the results of a crashed run go out with the next flush.
+    """
+
+    def __init__(self, ledger, write, window=5.0, retries=5, backoff=2.0):
+        self.ledger = ledger
+        self.write = write
+        self.window = window
+        self.retries = retries
+        self.backoff = backoff
+        self.queue = Queue()
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.idle = threading.Event()
+        self.idle.set()
+        self.stopping = threading.Event()
+        self.thread = None
+        self.stats = {'flushes': 0, 'results': 0, 'failures': 0}
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name='sheet-write-back', daemon=True)
+        self.thread.start()
+        return self
+
+    def notify(self):
+        """
+        Signals that new results were recorded in the ledger.
+        """
+        with self.lock:
+            self.pending += 1
+            self.idle.clear()
+        self.queue.put(True)
+
+    def drain(self, timeout=None):
+        """
+        Flushes the results gathered so far without waiting for the end of the window,
+        and waits until every result signaled so far was flushed (or its flush gave up).
+
+        Returns:
+        bool: True if the writer is idle, False if the timeout expired first.
+        """
+        self.queue.put('flush')
+        return self.idle.wait(timeout)
+
+    def stop(self, timeout=None):
+        """
+        Flushes what is left and stops the writer thread.
+        """
+        self.stopping.set()
+        self.queue.put(None)
+        if self.thread:
+            self.thread.join(timeout)
+        logging.info(f'Write-Back Stopped => {self.stats}')
+
+    def _run(self):
+        stop = False
+        while not stop:
+            item = self.queue.get()
+            stop = item is None
+            # Coalesce everything arriving within the window into one write, unless a flush is requested
+            deadline = monotonic() + self.window
+            while item is True and not self.stopping.is_set():
+                try:
+                    item = self.queue.get(timeout=max(0, deadline - monotonic()))
+                except Empty:
+                    break
+                stop = item is None
+            with self.lock:
+                taken = self.pending
+            self.flush()
+            with self.lock:
+                self.pending -= taken
+                if not self.pending:
+                    self.idle.set()
+
+    def flush(self):
+        """
+        Writes every unsynced result of the ledger to the sheet, retrying with an exponential backoff.
+
+        Returns:
+        bool: True if nothing is left to write, False if every attempt failed.
+        """
+        for attempt in range(self.retries):
+            results = self.ledger.unsynced()
+            if not results:
+                return True
+            try:
+                self.write(results)
+            except Exception as e:
+                self.stats['failures'] += 1
+                delay = self.backoff * 2 ** attempt
+                logging.error(f'Write-Back Failed (Attempt {attempt + 1}/{self.retries}), Retrying in {delay:.1f}s => {e}')
+                if self.stopping.wait(delay) and attempt:
+                    # Shutting down: one more try at most
+                    break
+                continue
+            self.ledger.mark_synced(results)
+            self.stats['flushes'] += 1
+            self.stats['results'] += len(results)
+            logging.info(f'Write-Back Flushed {len(results)} Result(s) to the Sheet', extra={'dids': len(results)})
+            return True
+        return False